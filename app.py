@@ -22,6 +22,8 @@ from routes.credit_routes import credits_bp
 from routes.support_routes import supportbp
 from routes.claims_routes import claims_bp
 from routes.account_routes import account_bp
+from routes.progress_routes import progress_bp
+from cli import register_cli
 
 # Create the app instance
 app = create_app()
@@ -82,6 +84,11 @@ app.register_blueprint(credits_bp)
 app.register_blueprint(supportbp)
 app.register_blueprint(claims_bp)
 app.register_blueprint(account_bp)
+app.register_blueprint(progress_bp)
+
+# Maintenance CLI commands (flask --app app <command>)
+register_cli(app)
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     print(f"Starting Flask on port {port}")
@@ -0,0 +1,188 @@
+# benchmarks/condition_persistence.py
+#
+# Write throughput of the per-diagnosis persistence path vs. the bulk stage in
+# helpers/condition_persistence.py, for files of 100, 1k and 5k conditions.
+#
+#   per_row: for every diagnosis, in its own session: INSERT condition
+#            (RETURNING id), INSERT embedding, INSERT condition_tags, COMMIT
+#            -- the statement pattern of diagnosis_worker/process_condition_embedding
+#   bulk:    one transaction: multi-row INSERT ... RETURNING for the conditions,
+#            then batched inserts for the embeddings and condition_tags
+#
+# Embeddings are random vectors, so only the database work is measured. Runs
+# against scratch tables (bench_conditions, bench_condition_embeddings,
+# bench_condition_tags), so no application data is touched:
+#
+#   DATABASE_URL=postgresql://... python benchmarks/condition_persistence.py
+#   DATABASE_URL=postgresql://... python benchmarks/condition_persistence.py --sizes 1000 --dims 1024
+#   DATABASE_URL=postgresql://... python benchmarks/condition_persistence.py --drop
+
+import os
+import time
+import argparse
+from datetime import date
+import numpy as np
+from sqlalchemy import create_engine, text, insert, MetaData, Table, Column, Integer
+from pgvector.sqlalchemy import HALFVEC
+from sqlalchemy.orm import sessionmaker
+
+TABLES = ("bench_condition_tags", "bench_condition_embeddings", "bench_conditions")
+
+
+def setup(engine, dims):
+    with engine.begin() as conn:
+        for table in TABLES:
+            conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        conn.execute(text("""
+            CREATE TABLE bench_conditions (
+                condition_id SERIAL PRIMARY KEY,
+                user_id INTEGER,
+                file_id INTEGER,
+                page_number INTEGER,
+                condition_name VARCHAR(255) NOT NULL,
+                date_of_visit DATE,
+                findings TEXT,
+                is_ratable BOOLEAN DEFAULT true,
+                in_service BOOLEAN NOT NULL DEFAULT false
+            )
+        """))
+        conn.execute(text(f"""
+            CREATE TABLE bench_condition_embeddings (
+                embedding_id SERIAL PRIMARY KEY,
+                condition_id INTEGER NOT NULL REFERENCES bench_conditions (condition_id) ON DELETE CASCADE,
+                user_id INTEGER,
+                embedding_half halfvec({dims})
+            )
+        """))
+        conn.execute(text("""
+            CREATE TABLE bench_condition_tags (
+                condition_id INTEGER REFERENCES bench_conditions (condition_id) ON DELETE CASCADE,
+                tag_id INTEGER,
+                PRIMARY KEY (condition_id, tag_id)
+            )
+        """))
+
+
+def make_file(n, dims, rng):
+    vectors = rng.standard_normal((n, dims)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return [
+        {
+            "user_id": 1,
+            "file_id": 1,
+            "page_number": i // 5,
+            "condition_name": f"condition {i % 400}",
+            "date_of_visit": date(2020, 1, 1),
+            "findings": "Findings text " * 10,
+            "in_service": bool(i % 2),
+            "vector": "[" + ",".join(f"{v:.6f}" for v in vectors[i]) + "]",
+            "array": vectors[i],
+            "tag_id": int(rng.integers(1, 800)),
+        }
+        for i in range(n)
+    ]
+
+
+INSERT_CONDITION = text("""
+    INSERT INTO bench_conditions (user_id, file_id, page_number, condition_name, date_of_visit, findings, in_service)
+    VALUES (:user_id, :file_id, :page_number, :condition_name, :date_of_visit, :findings, :in_service)
+    RETURNING condition_id
+""")
+INSERT_EMBEDDING = text(
+    "INSERT INTO bench_condition_embeddings (condition_id, user_id, embedding_half) "
+    "VALUES (:condition_id, :user_id, CAST(:vector AS halfvec))"
+)
+INSERT_TAG = text("INSERT INTO bench_condition_tags (condition_id, tag_id) VALUES (:condition_id, :tag_id)")
+
+
+def per_row(Session, rows):
+    for row in rows:
+        session = Session()
+        try:
+            condition_id = session.execute(INSERT_CONDITION, row).scalar_one()
+            session.execute(INSERT_EMBEDDING, {"condition_id": condition_id, **row})
+            session.execute(INSERT_TAG, {"condition_id": condition_id, "tag_id": row["tag_id"]})
+            session.commit()
+        finally:
+            session.close()
+
+
+def bulk(Session, rows, tables):
+    session = Session()
+    try:
+        # Same statements as persist_file_conditions: executemany INSERTs sent as
+        # multi-row VALUES pages of insertmanyvalues_page_size rows
+        columns = ("user_id", "file_id", "page_number", "condition_name", "date_of_visit", "findings", "in_service")
+        result = session.execute(
+            insert(tables["conditions"]).returning(tables["conditions"].c.condition_id, sort_by_parameter_order=True),
+            [{c: row[c] for c in columns} for row in rows]
+        )
+        condition_ids = result.scalars().all()
+
+        session.execute(insert(tables["embeddings"]), [
+            {"condition_id": cid, "user_id": row["user_id"], "embedding_half": row["array"]}
+            for cid, row in zip(condition_ids, rows)
+        ])
+        session.execute(insert(tables["tags"]), [
+            {"condition_id": cid, "tag_id": row["tag_id"]} for cid, row in zip(condition_ids, rows)
+        ])
+        session.commit()
+    finally:
+        session.close()
+
+
+def truncate(engine):
+    with engine.begin() as conn:
+        conn.execute(text("TRUNCATE bench_condition_tags, bench_condition_embeddings, bench_conditions"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Condition persistence throughput benchmark")
+    parser.add_argument("--drop", action="store_true", help="drop the scratch tables and exit")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--dims", type=int, default=3072, help="embedding dimensions (1024 for compact storage)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows per multi-row INSERT (BULK_INSERT_ROWS)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    engine = create_engine(
+        os.getenv("DATABASE_URL", "").replace("postgres://", "postgresql://", 1),
+        insertmanyvalues_page_size=args.batch_size,
+    )
+    if args.drop:
+        with engine.begin() as conn:
+            for table in TABLES:
+                conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        return
+
+    setup(engine, args.dims)
+    metadata = MetaData()
+    tables = {
+        "conditions": Table("bench_conditions", metadata, autoload_with=engine),
+        "embeddings": Table(
+            "bench_condition_embeddings", metadata,
+            Column("embedding_id", Integer, primary_key=True),
+            Column("condition_id", Integer),
+            Column("user_id", Integer),
+            Column("embedding_half", HALFVEC(args.dims)),
+        ),
+        "tags": Table("bench_condition_tags", metadata, autoload_with=engine),
+    }
+    Session = sessionmaker(bind=engine)
+    rng = np.random.default_rng(args.seed)
+
+    print(f"{'conditions':>10} {'strategy':>8} {'seconds':>8} {'rows/s':>8}")
+    for size in args.sizes:
+        rows = make_file(size, args.dims, rng)
+        for name, run in (("per_row", lambda: per_row(Session, rows)),
+                          ("bulk", lambda: bulk(Session, rows, tables))):
+            truncate(engine)
+            started = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - started
+            print(f"{size:>10} {name:>8} {elapsed:>8.2f} {size / elapsed:>8.0f}")
+    truncate(engine)
+
+
+if __name__ == "__main__":
+    main()
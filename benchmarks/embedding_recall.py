@@ -0,0 +1,94 @@
+# benchmarks/embedding_recall.py
+#
+# Tag-assignment recall of compact embeddings against the current full vectors.
+#
+# For a sample of stored condition embeddings, the nearest tag is computed with
+# the full Vector(3072) columns (the reference) and again with vectors shortened
+# to each candidate dimension, re-normalized and rounded to float16 - exactly
+# what EMBEDDING_STORAGE=compact stores. Reports, per dimension:
+#   top1_agreement   - same nearest tag as the full vectors
+#   recall@k         - reference tag found in the compact top-k
+#   ratable_agreement- same ratable / non-ratable decision at MAX_COSINE_DISTANCE
+#   bytes_per_row    - storage of one vector
+#
+# Usage:
+#   DATABASE_URL=postgresql://... python benchmarks/embedding_recall.py --sample 5000 --dims 256 512 1024 1536
+
+import os
+import time
+import argparse
+import numpy as np
+from sqlalchemy import create_engine, text
+
+# Same threshold as helpers/embedding_helpers.MAX_COSINE_DISTANCE
+MAX_COSINE_DISTANCE = 0.65
+
+
+def parse_vector(value):
+    if isinstance(value, str):
+        return np.asarray([float(v) for v in value.strip("[]").split(",")], dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+
+def normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def compact(matrix, dims):
+    """Shorten, re-normalize and round to half precision (the compact storage format)."""
+    return normalize(matrix[:, :dims]).astype(np.float16).astype(np.float32)
+
+
+def nearest(queries, tags, k):
+    distances = 1.0 - normalize(queries) @ normalize(tags).T
+    order = np.argsort(distances, axis=1)[:, :k]
+    return order, np.take_along_axis(distances, order, axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tag-assignment recall of compact embeddings")
+    parser.add_argument("--sample", type=int, default=5000, help="condition embeddings to sample")
+    parser.add_argument("--dims", type=int, nargs="+", default=[256, 512, 1024, 1536, 3072])
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    db_url = os.getenv("DATABASE_URL", "").replace("postgres://", "postgresql://", 1)
+    engine = create_engine(db_url)
+
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        tag_rows = conn.execute(text(
+            "SELECT tag_id, embeddings::text FROM tags WHERE embeddings IS NOT NULL ORDER BY tag_id"
+        )).all()
+        condition_rows = conn.execute(text(
+            "SELECT embedding::text FROM condition_embeddings WHERE embedding IS NOT NULL "
+            "ORDER BY random() LIMIT :n"
+        ), {"n": args.sample}).all()
+    print(f"Loaded {len(tag_rows)} tags and {len(condition_rows)} conditions in {time.perf_counter() - started:.1f}s")
+    if not tag_rows or not condition_rows:
+        print("Nothing to compare.")
+        return
+
+    tags = np.stack([parse_vector(r[1]) for r in tag_rows])
+    conditions = np.stack([parse_vector(r[0]) for r in condition_rows])
+
+    ref_idx, ref_dist = nearest(conditions, tags, 1)
+    ref_tag = ref_idx[:, 0]
+    ref_ratable = ref_dist[:, 0] <= MAX_COSINE_DISTANCE
+
+    print(f"{'dims':>6} {'top1_agreement':>15} {'recall@' + str(args.k):>10} {'ratable_agreement':>18} {'bytes_per_row':>14}")
+    for dims in args.dims:
+        dims = min(dims, tags.shape[1])
+        idx, dist = nearest(compact(conditions, dims), compact(tags, dims), args.k)
+        top1 = np.mean(idx[:, 0] == ref_tag)
+        recall = np.mean([ref_tag[i] in idx[i] for i in range(len(ref_tag))])
+        ratable = np.mean((dist[:, 0] <= MAX_COSINE_DISTANCE) == ref_ratable)
+        bytes_per_row = 2 * dims + 8  # halfvec: 2 bytes per dimension + header
+        print(f"{dims:>6} {top1:>15.4f} {recall:>10.4f} {ratable:>18.4f} {bytes_per_row:>14}")
+
+    print(f"Full Vector(3072) reference: {4 * 3072 + 8} bytes per row")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# benchmarks/semantic_search_latency.py
+#
+# p50/p95 latency of per-user semantic search for users with 100, 10k and 100k
+# conditions, exact scan vs. the HNSW + iterative scan strategy used by
+# helpers/condition_search.py, plus the recall of the ANN results.
+#
+# Runs against a scratch table (bench_condition_embeddings) shaped like
+# condition_embeddings, so no application data is touched:
+#
+#   DATABASE_URL=postgresql://... python benchmarks/semantic_search_latency.py --setup
+#   DATABASE_URL=postgresql://... python benchmarks/semantic_search_latency.py --queries 200
+#   DATABASE_URL=postgresql://... python benchmarks/semantic_search_latency.py --drop
+#
+# --setup loads the three benchmark users plus --background-rows rows spread
+# over other users, so the user_id filter is selective as it is in production.
+
+import os
+import time
+import argparse
+import numpy as np
+from sqlalchemy import create_engine, text
+
+USER_SIZES = {1: 100, 2: 10_000, 3: 100_000}
+TABLE = "bench_condition_embeddings"
+
+
+def random_unit_vectors(n, dims, rng):
+    vectors = rng.standard_normal((n, dims)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def to_literal(vector):
+    return "[" + ",".join(f"{v:.6f}" for v in vector) + "]"
+
+
+def setup(engine, dims, background_rows, rng):
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+        conn.execute(text(f"""
+            CREATE TABLE {TABLE} (
+                embedding_id SERIAL PRIMARY KEY,
+                condition_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                embedding_half halfvec({dims}) NOT NULL
+            )
+        """))
+
+    rows = [(user_id, n) for user_id, n in USER_SIZES.items()]
+    rows.append((None, background_rows))
+    condition_id = 0
+    for user_id, count in rows:
+        inserted = 0
+        while inserted < count:
+            batch = min(2000, count - inserted)
+            vectors = random_unit_vectors(batch, dims, rng)
+            params = []
+            for vector in vectors:
+                condition_id += 1
+                owner = user_id if user_id is not None else int(rng.integers(100, 100_000))
+                params.append({"c": condition_id, "u": owner, "v": to_literal(vector)})
+            with engine.begin() as conn:
+                conn.execute(
+                    text(f"INSERT INTO {TABLE} (condition_id, user_id, embedding_half) VALUES (:c, :u, CAST(:v AS halfvec))"),
+                    params
+                )
+            inserted += batch
+        print(f"Loaded {count} rows for user {user_id if user_id is not None else 'background'}")
+
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE INDEX ON {TABLE} (user_id)"))
+        conn.execute(text(
+            f"CREATE INDEX ON {TABLE} USING hnsw (embedding_half halfvec_cosine_ops) WITH (m = 16, ef_construction = 64)"
+        ))
+        conn.execute(text(f"ANALYZE {TABLE}"))
+    print(f"Built indexes in {time.perf_counter() - started:.1f}s")
+
+
+EXACT_SQL = f"""
+    SELECT condition_id FROM {TABLE}
+    WHERE user_id = :user_id
+    ORDER BY (embedding_half <=> CAST(:q AS halfvec)) + 0
+    LIMIT :limit
+"""
+
+ANN_SQL = f"""
+    WITH nearest AS MATERIALIZED (
+        SELECT condition_id, embedding_half <=> CAST(:q AS halfvec) AS distance
+        FROM {TABLE}
+        WHERE user_id = :user_id
+        ORDER BY distance
+        LIMIT :limit
+    )
+    SELECT condition_id FROM nearest ORDER BY distance
+"""
+
+
+def run_query(engine, sql, params, ann_settings=None):
+    with engine.begin() as conn:
+        if ann_settings:
+            for name, value in ann_settings.items():
+                conn.execute(text("SELECT set_config(:name, :value, true)"), {"name": name, "value": value})
+        started = time.perf_counter()
+        ids = [r[0] for r in conn.execute(text(sql), params)]
+        return time.perf_counter() - started, ids
+
+
+def benchmark(engine, dims, queries, limit, ef_search, iterative_scan, rng):
+    ann_settings = {"hnsw.ef_search": str(ef_search)}
+    if iterative_scan != "off":
+        ann_settings["hnsw.iterative_scan"] = iterative_scan
+
+    print(f"{'conditions':>10} {'strategy':>8} {'p50_ms':>8} {'p95_ms':>8} {'recall@' + str(limit):>10}")
+    for user_id, size in USER_SIZES.items():
+        exact_times, ann_times, recalls = [], [], []
+        for vector in random_unit_vectors(queries, dims, rng):
+            params = {"q": to_literal(vector), "user_id": user_id, "limit": limit}
+            exact_time, exact_ids = run_query(engine, EXACT_SQL, params)
+            ann_time, ann_ids = run_query(engine, ANN_SQL, params, ann_settings)
+            exact_times.append(exact_time)
+            ann_times.append(ann_time)
+            recalls.append(len(set(exact_ids) & set(ann_ids)) / max(len(exact_ids), 1))
+
+        for name, times in (("exact", exact_times), ("hnsw", ann_times)):
+            p50, p95 = np.percentile(np.asarray(times) * 1000, [50, 95])
+            recall = "1.0000" if name == "exact" else f"{np.mean(recalls):.4f}"
+            print(f"{size:>10} {name:>8} {p50:>8.1f} {p95:>8.1f} {recall:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-user semantic search latency benchmark")
+    parser.add_argument("--setup", action="store_true", help="(re)create and load the scratch table")
+    parser.add_argument("--drop", action="store_true", help="drop the scratch table and exit")
+    parser.add_argument("--dims", type=int, default=1024, help="vector dimensions (COMPACT_EMBEDDING_DIMENSIONS)")
+    parser.add_argument("--background-rows", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--ef-search", type=int, default=100)
+    parser.add_argument("--iterative-scan", default="relaxed_order")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    engine = create_engine(os.getenv("DATABASE_URL", "").replace("postgres://", "postgresql://", 1))
+    rng = np.random.default_rng(args.seed)
+
+    if args.drop:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+        return
+    if args.setup:
+        setup(engine, args.dims, args.background_rows, rng)
+    benchmark(engine, args.dims, args.queries, args.limit, args.ef_search, args.iterative_scan, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,33 @@
 from celery import Celery, chain
+from celery.signals import (
+    worker_init, worker_process_init, worker_process_shutdown, before_task_publish, task_prerun, task_postrun
+)
 import logging
 import os
 import json
+import time
 import tempfile
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 import ssl
 from helpers.text_ext_helpers import read_and_extract_document
 from database.session import ScopedSession
 from helpers.azure_helpers import download_blob_to_tempfile
-from helpers.sql_helpers import discover_nexus_tags, revoke_nexus_tags_if_invalid, File
-from helpers.visit_processor import process_visit
+from helpers.sql_helpers import File
+from helpers.visit_processor import submit_visit, wait_for_diagnoses
+from helpers.embedding_helpers import embed_pending_conditions
+from helpers.condition_persistence import CONDITION_PERSISTENCE, persist_file_conditions
+from helpers.metrics_helpers import (
+    start_metrics_server, mark_process_dead, clear_multiproc_dir,
+    celery_tasks_in_flight, celery_tasks, celery_task_duration, celery_task_queue_wait
+)
+from helpers.queue_metrics import QueueCollector, PUBLISHED_AT_HEADER
+from helpers.claim_check import store_stage_output, load_stage_output, cleanup_stage_outputs
+from helpers.page_checkpoints import clear_checkpoints
+from helpers.progress_events import publish_progress
+from helpers.worker_warmup import warm_up_main_process, warm_up_worker_process
+from helpers.nexus_finalize import schedule_nexus_recompute, run_debounced_recompute, NEXUS_DEBOUNCE_SECONDS
+from helpers.nexus_summary_cache import NEXUS_SUMMARY_BACKGROUND, regenerate_nexus_summaries
+from helpers.llm_helpers import generate_claim_response
 
 # Using a Redis broker with SSL.
 CELERY_BROKER_URL = os.getenv(
@@ -31,14 +49,137 @@ celery.conf.update(
 celery.conf.worker_prefetch_multiplier = 1
 # Use late acknowledgements to ensure that if a worker dies mid-task the work is requeued.
 celery.conf.task_acks_late = True
-# Recycle a worker after it has processed 10 tasks to reduce memory fragmentation.
-celery.conf.worker_max_tasks_per_child = 10
+# Recycle a prefork child once its resident memory exceeds this many KiB (checked
+# after each task), instead of after a fixed task count: every new child pays a
+# cold start (celery_worker_warmup_seconds), so children are kept while healthy.
+# Set per lane in celery-deployment.yaml to stay under the pod limit / concurrency.
+celery.conf.worker_max_memory_per_child = int(os.getenv("CELERY_MAX_MEMORY_PER_CHILD_KB", "1500000"))
+# Optional task-count backstop; 0 disables it.
+celery.conf.worker_max_tasks_per_child = int(os.getenv("CELERY_MAX_TASKS_PER_CHILD", "0")) or None
+
+# --- Queues ---
+# Each stage runs on its own queue so the lanes can be sized and scaled separately
+# (celery-deployment.yaml, celery-worker-hpa.yaml):
+#   ocr      - extraction_task: CPU-bound Tesseract OCR (+ per-page LLM calls), prefork pool
+#   llm      - process_pages_task: I/O-bound embeddings and DB writes, threads pool
+#   finalize - finalize_task: short DB-bound nexus tag updates, small pool
+# Files of BULK_FILE_BYTES or more go to the *_bulk lanes so one huge upload
+# does not hold up everyone's small ones.
+QUEUE_OCR = 'ocr'
+QUEUE_LLM = 'llm'
+QUEUE_FINALIZE = 'finalize'
+BULK_QUEUE_SUFFIX = '_bulk'
+BULK_FILE_BYTES = int(os.getenv("BULK_FILE_BYTES", str(20 * 1024 * 1024)))
+# Delay before (and between retries of) the per-user sweep of pending conditions
+EMBEDDING_SWEEP_DELAY_SECONDS = int(os.getenv("EMBEDDING_SWEEP_DELAY_SECONDS", "300"))
+
+celery.conf.task_routes = {
+    'celery_app.extraction_task': {'queue': QUEUE_OCR},
+    'celery_app.process_pages_task': {'queue': QUEUE_LLM},
+    'celery_app.finalize_task': {'queue': QUEUE_FINALIZE},
+    'celery_app.pipeline_failed_task': {'queue': QUEUE_FINALIZE},
+    'celery_app.finalize_user_task': {'queue': QUEUE_FINALIZE},
+    'celery_app.embed_pending_conditions_task': {'queue': QUEUE_LLM},
+    'celery_app.regenerate_nexus_summaries_task': {'queue': QUEUE_LLM},
+}
+
+
+def pipeline_queues(file_size):
+    """Queues for the extraction, processing and finalize stages of a file of `file_size` bytes."""
+    suffix = BULK_QUEUE_SUFFIX if file_size and file_size >= BULK_FILE_BYTES else ''
+    return {
+        'extraction': QUEUE_OCR + suffix,
+        'processing': QUEUE_LLM + suffix,
+        'finalize': QUEUE_FINALIZE,
+    }
+
+# --- Metrics ---
+# The worker main process serves /metrics; with PROMETHEUS_MULTIPROC_DIR set it
+# aggregates the metrics written by the prefork child processes.
+# Queue length and oldest-message age of every lane are read from the broker
+# at scrape time, for the backlog-based HPAs (celery-worker-hpa.yaml).
+CELERY_METRICS_PORT = int(os.getenv("CELERY_METRICS_PORT", "9808"))
+QUEUE_METRICS_ENABLED = os.getenv("QUEUE_METRICS_ENABLED", "true").lower() == "true"
+ALL_QUEUES = [
+    QUEUE_OCR, QUEUE_OCR + BULK_QUEUE_SUFFIX,
+    QUEUE_LLM, QUEUE_LLM + BULK_QUEUE_SUFFIX,
+    QUEUE_FINALIZE,
+]
+
+@worker_init.connect
+def start_worker_metrics(**kwargs):
+    clear_multiproc_dir()
+    collectors = [QueueCollector(celery, ALL_QUEUES)] if QUEUE_METRICS_ENABLED else []
+    try:
+        start_metrics_server(CELERY_METRICS_PORT, collectors=collectors)
+    except OSError as e:
+        logging.warning(f"Could not start metrics exporter on port {CELERY_METRICS_PORT}: {e}")
+
+@worker_init.connect
+def warm_up_worker(sender=None, **kwargs):
+    # Catalogs are loaded in the main process so prefork children inherit them;
+    # pools without child processes (threads) are warmed here directly
+    warm_up_main_process()
+    if 'prefork' not in str(getattr(sender, 'pool_cls', 'prefork')).lower():
+        warm_up_worker_process()
+
+@worker_process_init.connect
+def warm_up_child(**kwargs):
+    warm_up_worker_process()
+
+@worker_process_shutdown.connect
+def cleanup_worker_metrics(pid=None, **kwargs):
+    mark_process_dead(pid or os.getpid())
+
+@before_task_publish.connect
+def stamp_publish_time(headers=None, **kwargs):
+    # Read back by the queue collector (message age) and task_prerun (queue wait)
+    if headers is not None:
+        headers.setdefault(PUBLISHED_AT_HEADER, time.time())
+
+def _task_queue(task):
+    return (task.request.delivery_info or {}).get('routing_key') or 'unknown'
+
+def _queued_since(task):
+    """When the task became runnable: its publish time, or its ETA/countdown if later."""
+    published_at = getattr(task.request, PUBLISHED_AT_HEADER, None)
+    if not published_at:
+        return None
+    queued_since = float(published_at)
+    eta = task.request.eta
+    if eta:
+        try:
+            eta = eta if isinstance(eta, datetime) else datetime.fromisoformat(eta)
+        except ValueError:
+            return None  # unknown ETA format: the wait can't be told apart from the delay
+        queued_since = max(queued_since, eta.timestamp())
+    return queued_since
+
+@task_prerun.connect
+def record_task_start(task=None, **kwargs):
+    queue = _task_queue(task)
+    task.request._metrics_started = time.time()
+    celery_tasks_in_flight.labels(task.name, queue).inc()
+    queued_since = _queued_since(task)
+    if queued_since:
+        celery_task_queue_wait.labels(task.name, queue).observe(max(time.time() - queued_since, 0))
+
+@task_postrun.connect
+def record_task_end(task=None, state=None, **kwargs):
+    queue = _task_queue(task)
+    celery_tasks_in_flight.labels(task.name, queue).dec()
+    celery_tasks.labels(task.name, queue, state or 'UNKNOWN').inc()
+    started = getattr(task.request, '_metrics_started', None)
+    if started:
+        celery_task_duration.labels(task.name, queue).observe(time.time() - started)
 
 @celery.task(bind=True, max_retries=3, default_retry_delay=10)
 def extraction_task(self, user_id, blob_url, file_type, file_id):
     """
     Downloads the file from Azure (if needed) and extracts document details.
-    Returns parsed details as a Python object.
+    Pages finished by an earlier attempt are reused from their checkpoints.
+    Returns the parsed details, or a claim-check reference to them when they are
+    large (helpers/claim_check.py).
     """
     try:
         # Mark the file as "Extracting Data"
@@ -48,6 +189,7 @@ def extraction_task(self, user_id, blob_url, file_type, file_id):
                 file_record.status = 'Extracting Data'
                 session.add(file_record)
                 session.commit()
+        publish_progress(user_id, file_id, "status", status='Extracting Data')
 
         # Download the blob to a temporary file.
         with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
@@ -56,7 +198,7 @@ def extraction_task(self, user_id, blob_url, file_type, file_id):
         download_blob_to_tempfile(blob_url, local_path)
 
         # Perform extraction.
-        details_str = read_and_extract_document(user_id, local_path, file_type)
+        details_str = read_and_extract_document(user_id, local_path, file_type, file_id=file_id)
 
         # Clean up the temporary file.
         os.remove(local_path)
@@ -66,7 +208,7 @@ def extraction_task(self, user_id, blob_url, file_type, file_id):
 
         # Convert JSON string to Python object.
         parsed_details = json.loads(details_str)
-        return parsed_details
+        return store_stage_output(file_id, "extraction", parsed_details)
 
     except Exception as exc:
         logging.exception(f"Extraction failed: {exc}")
@@ -75,12 +217,17 @@ def extraction_task(self, user_id, blob_url, file_type, file_id):
 @celery.task(bind=True, max_retries=3, default_retry_delay=10)
 def process_pages_task(self, details, user_id, user_uuid, file_info):
     """
-    Processes pages in parallel at the 'visit' level using a ThreadPoolExecutor.
-    Each thread calls process_visit, which handles its own DB session internally.
+    With CONDITION_PERSISTENCE=bulk (default) the file's conditions, embeddings
+    and tag links are written in one transaction (helpers/condition_persistence.py).
+    With per_row, every diagnosis is submitted to the per-process diagnosis
+    queue (helpers/diagnosis_queue.py) and stored in its own DB session.
+    Conditions still without an embedding are then embedded together in
+    batched requests.
     """
     try:
         service_periods = file_info.get('service_periods')
         file_id = file_info.get('file_id')
+        details = load_stage_output(details)
 
         # Mark the file as "Finding Evidence"
         with ScopedSession() as session:
@@ -89,11 +236,16 @@ def process_pages_task(self, details, user_id, user_uuid, file_info):
                 file_record.status = 'Finding Evidence'
                 session.add(file_record)
                 session.commit()
+        publish_progress(user_id, file_id, "status", status='Finding Evidence')
 
         processed_results = []
 
-        # Process multiple visits concurrently.
-        with ThreadPoolExecutor(max_workers=10) as executor:
+        if CONDITION_PERSISTENCE == "bulk":
+            # One transaction for the file's conditions, embeddings and tag links
+            with ScopedSession() as session:
+                processed_results = persist_file_conditions(session, details, user_id, file_id, service_periods)
+        else:
+            # Queue every diagnosis of the file; the queue bounds concurrency for the process.
             futures = []
             for page in details:
                 page_number = page.get('page')
@@ -101,52 +253,152 @@ def process_pages_task(self, details, user_id, user_uuid, file_info):
                 if page.get('category') == 'Clinical Records':
                     visits = page.get('details', {}).get('visits', [])
                     logging.info(f"Found {len(visits)} visits on page {page_number}")
-                    for visit in visits:
-                        future = executor.submit(
-                            process_visit,
-                            visit=visit,
-                            page_number=page_number,
-                            service_periods=service_periods,
-                            user_id=user_id,
-                            file_id=file_id
-                        )
-                        futures.append(future)
-
-            for future in as_completed(futures):
-                try:
-                    visit_result = future.result()
-                    if visit_result is not None:
-                        processed_results.append(visit_result)
-                except Exception as e:
-                    logging.exception(f"Error processing a visit: {e}")
-
-        return processed_results
+                    for visit_index, visit in enumerate(visits):
+                        try:
+                            visit_result, visit_futures = submit_visit(
+                                visit=visit,
+                                page_number=page_number,
+                                service_periods=service_periods,
+                                user_id=user_id,
+                                file_id=file_id,
+                                defer_embedding=True,
+                                visit_index=visit_index
+                            )
+                        except Exception as e:
+                            logging.exception(f"Error processing a visit: {e}")
+                            continue
+                        if visit_result is not None:
+                            processed_results.append(visit_result)
+                        futures.extend(visit_futures)
+
+            wait_for_diagnoses(futures)
+            publish_progress(user_id, file_id, "conditions", found=len(futures))
+
+        # Embed the file's conditions that are still pending in batched requests.
+        # A failure retries the task; once retries are used up the file still
+        # completes and a per-user sweep keeps retrying the pending conditions.
+        with ScopedSession() as session:
+            try:
+                embed_pending_conditions(session, user_id, file_id=file_id)
+            except Exception as e:
+                if self.request.retries < self.max_retries:
+                    raise
+                logging.exception(f"Embedding stage failed for file_id {file_id}; scheduling a sweep: {e}")
+                embed_pending_conditions_task.apply_async(args=(user_id,), countdown=EMBEDDING_SWEEP_DELAY_SECONDS)
+
+        return store_stage_output(file_id, "process_pages", processed_results)
 
     except Exception as exc:
+        # Safe to retry: stored conditions are skipped by their idempotency keys
         logging.exception(f"Processing pages failed: {exc}")
+        raise self.retry(exc=exc)
+
+@celery.task(bind=True, max_retries=5, default_retry_delay=EMBEDDING_SWEEP_DELAY_SECONDS)
+def embed_pending_conditions_task(self, user_id):
+    """
+    Sweeps every pending (untagged, unembedded) condition of the user, e.g.
+    after an embedding outage outlasted process_pages_task's retries, then
+    schedules the user's nexus recompute for the newly tagged conditions.
+    """
+    try:
+        with ScopedSession() as session:
+            processed = embed_pending_conditions(session, user_id)
+    except Exception as exc:
+        logging.exception(f"Pending condition sweep failed for user_id {user_id}: {exc}")
+        raise self.retry(exc=exc)
+    if processed:
+        schedule_nexus_recompute(user_id, finalize_user_task)
+    return {"status": "complete", "user_id": user_id, "processed": processed}
 
 @celery.task(bind=True, max_retries=3, default_retry_delay=10)
 def finalize_task(self, processed_results, user_id, file_id):
     """
-    Final DB updates after pages are processed, e.g. discovering and revoking nexus tags.
+    Final DB updates after pages are processed: marks the file Complete and
+    schedules the user's nexus tag recompute, which is debounced so a
+    multi-file upload triggers one recompute after its last file
+    (helpers/nexus_finalize.py, finalize_user_task).
+    Removes the file's claim-check blobs (CLAIM_CHECK_CLEANUP) and page checkpoints afterwards.
     """
     try:
         with ScopedSession() as session:
-            discover_nexus_tags(session, user_id)
-            revoke_nexus_tags_if_invalid(session, user_id)
             file_record = session.query(File).filter_by(file_id=file_id).first()
             if file_record:
                 file_record.status = 'Complete'
                 session.add(file_record)
             session.commit()
+        publish_progress(user_id, file_id, "status", status='Complete')
+        schedule_nexus_recompute(user_id, finalize_user_task)
+        cleanup_stage_outputs(file_id, succeeded=True)
+        clear_checkpoints(file_id)
         return {"status": "complete", "user_id": user_id}
 
     except Exception as exc:
         logging.exception(f"Finalize step failed: {exc}")
+        if self.request.retries >= self.max_retries:
+            cleanup_stage_outputs(file_id, succeeded=False)
         with ScopedSession() as session:
             file_record = session.query(File).filter_by(file_id=file_id).first()
             if file_record:
                 file_record.status = 'Failed'
                 session.add(file_record)
                 session.commit()
+            publish_progress(user_id, file_id, "status", status='Failed')
             raise self.retry(exc=exc)
+
+@celery.task
+def pipeline_failed_task(request, exc, traceback, user_id, file_id):
+    """
+    Error callback of the document chain (link_error on every stage): runs
+    once a stage has failed for good, after its retries. finalize_task never
+    runs then, so this marks the file Failed and removes its claim-check
+    blobs (CLAIM_CHECK_CLEANUP=always) in its place.
+    """
+    logging.error(f"Pipeline task {request.id} failed for file_id {file_id}: {exc}")
+    with ScopedSession() as session:
+        file_record = session.query(File).filter_by(file_id=file_id).first()
+        if file_record and file_record.task_ids and request.id not in file_record.task_ids.values():
+            # A revoked run of a file that has since been reprocessed
+            logging.info(f"Ignoring failure of stale task {request.id} for file_id {file_id}")
+            return
+        if file_record and file_record.status != 'Failed':
+            file_record.status = 'Failed'
+            session.add(file_record)
+            session.commit()
+    publish_progress(user_id, file_id, "status", status='Failed')
+    cleanup_stage_outputs(file_id, succeeded=False)
+
+@celery.task(bind=True, max_retries=3, default_retry_delay=10)
+def finalize_user_task(self, user_id, token):
+    """
+    Debounced per-user nexus tag recompute scheduled by finalize_task. Does
+    nothing if a later file has re-armed the debounce; re-checks later while
+    other files of the user are still processing.
+    """
+    try:
+        outcome = run_debounced_recompute(user_id, token)
+    except Exception as exc:
+        logging.exception(f"Nexus recompute for user_id {user_id} failed: {exc}")
+        raise self.retry(exc=exc)
+    if outcome == "waiting":
+        self.apply_async(args=(user_id, token), countdown=NEXUS_DEBOUNCE_SECONDS)
+    elif outcome == "recomputed" and NEXUS_SUMMARY_BACKGROUND in ("stale", "all"):
+        regenerate_nexus_summaries_task.delay(user_id)
+    return {"status": outcome, "user_id": user_id}
+
+@celery.task(bind=True, max_retries=1, default_retry_delay=60)
+def regenerate_nexus_summaries_task(self, user_id):
+    """
+    Background regeneration of the user's nexus summaries after a recompute
+    (NEXUS_SUMMARY_BACKGROUND, helpers/nexus_summary_cache.py), so the next
+    /generate_nexus_summary request is served from the table.
+    """
+    try:
+        with ScopedSession() as session:
+            generated = regenerate_nexus_summaries(
+                session, user_id, generate_claim_response,
+                include_missing=NEXUS_SUMMARY_BACKGROUND == "all"
+            )
+        return {"status": "complete", "user_id": user_id, "generated": generated}
+    except Exception as exc:
+        logging.exception(f"Regenerating nexus summaries for user_id {user_id} failed: {exc}")
+        raise self.retry(exc=exc)
@@ -0,0 +1,95 @@
+# cli.py
+#
+# Maintenance commands, registered on the Flask app:
+#   flask --app app retag-conditions [--chunk-size 2000] [--max-distance 0.65] [--user-id N] [--dry-run]
+#   flask --app app seed-tag-aliases
+#   flask --app app recompute-nexus-tags --user-id N [--full]
+#   flask --app app bulk-recompute-nexus [--shard i --shards n] [--batch-size 500] [--max-duty 0.5] [--dry-run]
+
+import click
+from helpers.embedding_helpers import MAX_COSINE_DISTANCE
+
+
+def register_cli(app):
+
+    @app.cli.command("retag-conditions")
+    @click.option("--chunk-size", default=2000, show_default=True, help="Embeddings matched per batch.")
+    @click.option("--max-distance", default=MAX_COSINE_DISTANCE, show_default=True, type=float,
+                  help="Cosine distance above which a condition is non-ratable.")
+    @click.option("--user-id", default=None, type=int, help="Only re-tag this user's conditions.")
+    @click.option("--dry-run", is_flag=True, help="Count the changes without writing them.")
+    def retag_conditions_command(chunk_size, max_distance, user_id, dry_run):
+        """Re-tag stored condition embeddings against the current tags table."""
+        from helpers.retag_helpers import retag_conditions
+
+        stats = retag_conditions(
+            chunk_size=chunk_size,
+            max_distance=max_distance,
+            user_id=user_id,
+            dry_run=dry_run
+        )
+        click.echo(f"{'[dry run] ' if dry_run else ''}Re-tag finished: {stats}")
+
+    @app.cli.command("seed-tag-aliases")
+    def seed_tag_aliases_command():
+        """Add every tag's disability_name to the condition-name alias dictionary."""
+        from database.session import SessionFactory
+        from helpers.tag_alias_index import seed_aliases_from_tags
+
+        session = SessionFactory()
+        try:
+            count = seed_aliases_from_tags(session)
+        finally:
+            session.close()
+        click.echo(f"Seeded {count} tag aliases")
+
+    @app.cli.command("recompute-nexus-tags")
+    @click.option("--user-id", required=True, type=int, help="User whose nexus tags are recomputed.")
+    @click.option("--full", is_flag=True, help="Re-aggregate the whole condition history instead of the changed counters.")
+    def recompute_nexus_tags_command(user_id, full):
+        """Recompute a user's nexus tags under the per-user lock."""
+        from helpers.nexus_finalize import recompute_nexus_tags
+
+        recompute_nexus_tags(user_id, full=full)
+        click.echo(f"Recomputed nexus tags for user_id {user_id}{' (full)' if full else ''}")
+
+    @app.cli.command("bulk-recompute-nexus")
+    @click.option("--batch-size", default=500, show_default=True, help="Users recomputed per transaction.")
+    @click.option("--shard", default=0, show_default=True, help="Only users with user_id % shards == shard.")
+    @click.option("--shards", default=1, show_default=True, help="Number of shards the user base is split into.")
+    @click.option("--start-after", default=0, show_default=True, help="Resume after this user_id.")
+    @click.option("--max-duty", default=0.5, show_default=True, type=float,
+                  help="Largest share of wall time spent in the database; the job sleeps for the rest.")
+    @click.option("--min-sleep", default=0.0, show_default=True, type=float, help="Minimum pause between batches (seconds).")
+    @click.option("--rebuild-counts", is_flag=True,
+                  help="Also rewrite user_tag_counts from the conditions. Requires NEXUS_MAINTENANCE_MODE=true "
+                       "(uploads and processing stopped).")
+    @click.option("--dry-run", is_flag=True, help="Count the changes and roll every batch back.")
+    def bulk_recompute_nexus_command(batch_size, shard, shards, start_after, max_duty, min_sleep, rebuild_counts, dry_run):
+        """Recompute nexus tags for all users (or one shard) in set-based SQL."""
+        from helpers.nexus_bulk import bulk_recompute_nexus
+
+        def report(stats):
+            click.echo(
+                f"{'[dry run] ' if dry_run else ''}{stats['users']} users, +{stats['discovered']} / "
+                f"-{stats['revoked']} nexus tags, {stats['users_per_second']} users/s, "
+                f"{len(stats['skipped_users'])} skipped, last user_id {stats['last_user_id']}"
+            )
+
+        try:
+            stats = bulk_recompute_nexus(
+                batch_size=batch_size,
+                shard=shard,
+                shards=shards,
+                start_after=start_after,
+                max_duty=max_duty,
+                min_sleep=min_sleep,
+                rebuild_counts=rebuild_counts,
+                dry_run=dry_run,
+                progress=report
+            )
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        click.echo(f"{'[dry run] ' if dry_run else ''}Bulk nexus recompute finished: {stats}")
+        if stats["skipped_users"]:
+            click.echo(f"Skipped (locked) users, rerun them with recompute-nexus-tags --full: {stats['skipped_users']}")
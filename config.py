@@ -12,3 +12,9 @@ class Config:
     # CORS settings
     CORS_ORIGINS = os.getenv("CORS_ORIGINS")
     CORS_SUPPORTS_CREDENTIALS = True
+
+    # Embedding storage: "full" keeps Vector(3072) columns, "compact" writes
+    # reduced-dimension half-precision vectors (text-embedding-3 `dimensions`)
+    # to the *_half columns added in migrations/002_compact_embeddings.sql
+    EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "full")
+    COMPACT_EMBEDDING_DIMENSIONS = int(os.getenv("COMPACT_EMBEDDING_DIMENSIONS", "1024"))
@@ -11,7 +11,20 @@ raw_db_url = os.getenv("DATABASE_URL")
 if raw_db_url and raw_db_url.startswith("postgres://"):
     raw_db_url = raw_db_url.replace("postgres://", "postgresql://", 1)
 
-engine = create_engine(raw_db_url, pool_pre_ping=True)
+# Connections per process. Keep DIAGNOSIS_CONCURRENCY (helpers/diagnosis_queue.py)
+# below pool_size + max_overflow, and the sum over all processes below the
+# server's max_connections.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+engine = create_engine(
+    raw_db_url,
+    pool_pre_ping=True,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+)
 
 # Create a configured "Session" class
 SessionFactory = sessionmaker(bind=engine)
@@ -0,0 +1,27 @@
+# gunicorn.conf.py
+#
+# Prometheus exporter for the Flask app. Metrics are served by the gunicorn
+# master on METRICS_PORT, an internal port for the Prometheus scraper only, and
+# never by the public app on port 5000. The multiprocess directory is cleared
+# at startup so files left by the pids of a previous run are not summed in.
+
+import os
+import logging
+from helpers.metrics_helpers import start_metrics_server, mark_process_dead, clear_multiproc_dir
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+
+def on_starting(server):
+    clear_multiproc_dir()
+
+
+def when_ready(server):
+    try:
+        start_metrics_server(METRICS_PORT)
+    except OSError as e:
+        logging.warning(f"Could not start metrics exporter on port {METRICS_PORT}: {e}")
+
+
+def child_exit(server, worker):
+    mark_process_dead(worker.pid)
@@ -276,3 +276,17 @@ def download_blob_with_credentials(blob_name: str) -> bytes:
     except Exception as e:
         logging.error(f"Error downloading blob '{blob_name}': {e}")
         return None
+
+
+def delete_blobs_with_prefix(prefix: str) -> int:
+    """
+    Deletes every blob in the container whose name starts with `prefix`.
+    Returns the number of blobs deleted.
+    """
+    container_client = blob_service_client.get_container_client(os.getenv("AZURE_CONTAINER_NAME"))
+    deleted = 0
+    for blob in container_client.list_blobs(name_starts_with=prefix):
+        container_client.delete_blob(blob.name)
+        deleted += 1
+    logging.info(f"Deleted {deleted} blobs under '{prefix}'")
+    return deleted
@@ -10,7 +10,11 @@ from flask import g
 from openai import OpenAI
 from pinecone import Pinecone
 import decimal
-from helpers.llm_wrappers import call_openai_chat_create, call_openai_embeddings
+from helpers.llm_wrappers import call_openai_chat_create, call_openai_embeddings, record_usage
+from helpers.openai_client import get_openai_client
+from helpers.metrics_helpers import llm_request_latency, llm_errors, record_llm_tokens
+from helpers.embedding_storage import embedding_request_kwargs
+from helpers.condition_search import nearest_condition_ids
 
 # Import both Conditions and ConditionEmbedding so we can do the basic list + semantic search
 from models.sql_models import Conditions, ConditionEmbedding, NexusTags, Tag
@@ -33,7 +37,7 @@ EMBEDDING_MODEL_SMALL = "text-embedding-3-small"
 EMBEDDING_MODEL_LARGE = "text-embedding-3-large"
 
 # Initialize the OpenAI client
-client = OpenAI(api_key=OPENAI_API_KEY)
+client = get_openai_client()
 assistant_id = ASSISTANT_ID
 
 # Initialize Pinecone
@@ -74,7 +78,8 @@ def clean_up_query_with_llm(user_id: int, user_query: str) -> str:
         user_id=user_id,
         model="gpt-4o",
         messages=messages,
-        temperature=0
+        temperature=0,
+        call_site="chatbot.clean_up_query_with_llm"
     )
 
     cleaned_query = response.choices[0].message.content
@@ -92,7 +97,8 @@ def get_embedding_small(user_id: int, text: str) -> list:
         user_id=user_id,
         input_text=text,
         model="text-embedding-3-small",
-        cost_per_token=cost_rate
+        cost_per_token=cost_rate,
+        call_site="chatbot.get_embedding_small"
     )
     return response.data[0].embedding
 
@@ -103,7 +109,9 @@ def get_embedding_large(user_id: int, text: str) -> list:
         user_id=user_id,
         input_text=text,
         model="text-embedding-3-large",
-        cost_per_token=cost_rate
+        cost_per_token=cost_rate,
+        call_site="chatbot.get_embedding_large",
+        **embedding_request_kwargs()
     )
     return response.data[0].embedding
 
@@ -301,14 +309,13 @@ def semantic_search_user_conditions(user_id: int, query_text: str, limit: int =
 
     query_vec = get_embedding_large(user_id, query_text)
 
-    results = (
-        session.query(Conditions)
-        .join(ConditionEmbedding, Conditions.condition_id == ConditionEmbedding.condition_id)
-        .filter(Conditions.user_id == user_id)
-        .order_by(ConditionEmbedding.embedding.op("<->")(query_vec))
-        .limit(limit)
-        .all()
-    )
+    # Per-user ANN search (HNSW + user_id filter), then load the rows in rank order
+    ranked_ids = [cid for cid, _ in nearest_condition_ids(session, user_id, query_vec, limit)]
+    conditions_by_id = {
+        cond.condition_id: cond
+        for cond in session.query(Conditions).filter(Conditions.condition_id.in_(ranked_ids)).all()
+    } if ranked_ids else {}
+    results = [conditions_by_id[cid] for cid in ranked_ids if cid in conditions_by_id]
 
     if not results:
         return f"No semantically similar conditions found for user_id={user_id}."
@@ -378,6 +385,7 @@ def continue_conversation(
         print(f"[LOG] Added user message. ID: {user_message.id}")
 
         # 3) Create a new run
+        run_started_at = time.perf_counter()
         run = client.beta.threads.runs.create(
             thread_id=thread.id,
             assistant_id=assistant_id
@@ -484,6 +492,13 @@ def continue_conversation(
             print(f"[LOG] After tool submission => run status: {updated_run.status}")
 
         # 6) Evaluate final status
+        run_model = getattr(updated_run, "model", None) or "gpt-4o"
+        llm_request_latency.labels("chatbot.assistant_run", run_model, "assistant_run").observe(
+            time.perf_counter() - run_started_at
+        )
+        if updated_run.status != "completed":
+            llm_errors.labels("chatbot.assistant_run", run_model, "assistant_run", f"run_{updated_run.status}").inc()
+
         if updated_run.status == "completed":
                         # *** NEW: Beta Threads usage logging ***
             # We'll do it here, before returning the final message.
@@ -495,10 +510,10 @@ def continue_conversation(
                 prompt_tokens = usage_obj.prompt_tokens
                 completion_tokens = usage_obj.completion_tokens
                 total_tokens = usage_obj.total_tokens
+                record_llm_tokens("chatbot.assistant_run", run_model, prompt_tokens, completion_tokens)
 
-                # Now, let's log it in openai_usage_logs
-                from models.sql_models import Users, OpenAIUsageLog
-                from datetime import datetime
+                # Now, let's log it in openai_usage_logs and the daily rollup
+                from models.sql_models import Users
                 import decimal
 
                 db_session = g.session
@@ -515,22 +530,8 @@ def continue_conversation(
                     completion_cost = completion_tokens * cost_per_completion_token
                     total_cost = prompt_cost + completion_cost
 
-                    # Insert a usage log row
-                    usage_log = OpenAIUsageLog(
-                        user_id=user_id,
-                        model=updated_run.model or "gpt-4o",  # e.g. "gpt-4o"
-                        prompt_tokens=prompt_tokens,
-                        completion_tokens=completion_tokens,
-                        total_tokens=total_tokens,
-                        cost=total_cost,
-                        created_at=datetime.utcnow()
-                    )
-                    db_session.add(usage_log)
-
-                    # Update user’s credits or balance
-                    # If you do token-based:
-                    # user.credits_remaining -= total_tokens
-                    user.credits_remaining -= total_tokens
+                    # Insert a usage log row, update the rollup and the user's credits
+                    record_usage(db_session, user, run_model, prompt_tokens, completion_tokens, total_tokens, total_cost)
 
                     db_session.commit()
 
@@ -0,0 +1,84 @@
+# helpers/claim_check.py
+#
+# Claim-check pattern for the document processing chain.
+#
+# extraction_task used to return the parsed details of every page, which
+# Celery stored in the Redis result backend and then re-sent as the argument
+# of process_pages_task, so a large file sat in Redis twice. Stage outputs
+# larger than CLAIM_CHECK_MIN_BYTES are now written to Azure Blob Storage as
+# gzipped JSON under pipeline/<file_id>/ and only a small reference is passed
+# along the chain:
+#
+#   {"claim_check": "pipeline/42/extraction-<uuid>.json.gz", "bytes": 5242880}
+#
+# load_stage_output accepts either a reference or an inline payload, so tasks
+# queued before a deploy still work. finalize_task, or pipeline_failed_task
+# when a stage fails for good, removes a file's stage outputs according to
+# CLAIM_CHECK_CLEANUP:
+#   on_success (default) - delete after a successful finalize, keep failed runs for debugging
+#   always               - delete once the chain has finished, whether or not it succeeded
+#   never                - keep them (e.g. rely on a storage lifecycle rule)
+
+import os
+import gzip
+import json
+import uuid
+import logging
+from helpers.azure_helpers import upload_to_azure_blob, download_blob_with_credentials, delete_blobs_with_prefix
+
+CLAIM_CHECK_ENABLED = os.getenv("CLAIM_CHECK_ENABLED", "true").lower() == "true"
+CLAIM_CHECK_MIN_BYTES = int(os.getenv("CLAIM_CHECK_MIN_BYTES", "32768"))
+CLAIM_CHECK_CLEANUP = os.getenv("CLAIM_CHECK_CLEANUP", "on_success")
+CLAIM_CHECK_PREFIX = "pipeline"
+
+
+def _stage_prefix(file_id) -> str:
+    return f"{CLAIM_CHECK_PREFIX}/{file_id}/"
+
+
+def is_claim_check(payload) -> bool:
+    return isinstance(payload, dict) and "claim_check" in payload
+
+
+def store_stage_output(file_id, stage: str, payload):
+    """
+    Returns a claim-check reference to `payload`, stored in blob storage, or
+    the payload itself when it is small, claim checks are disabled, or the
+    upload fails.
+    """
+    if not CLAIM_CHECK_ENABLED:
+        return payload
+
+    body = json.dumps(payload, default=str).encode("utf-8")
+    if len(body) < CLAIM_CHECK_MIN_BYTES:
+        return payload
+
+    blob_name = f"{_stage_prefix(file_id)}{stage}-{uuid.uuid4().hex}.json.gz"
+    blob_url = upload_to_azure_blob(blob_name, file_data=gzip.compress(body), content_type="application/gzip")
+    if blob_url is None:
+        logging.warning(f"Claim check upload failed for file_id {file_id} ({stage}); passing the payload inline")
+        return payload
+
+    logging.info(f"Stored {stage} output for file_id {file_id} ({len(body)} bytes) as {blob_name}")
+    return {"claim_check": blob_name, "bytes": len(body)}
+
+
+def load_stage_output(payload):
+    """Resolves a claim-check reference to the stored payload; inline payloads are returned unchanged."""
+    if not is_claim_check(payload):
+        return payload
+
+    data = download_blob_with_credentials(payload["claim_check"])
+    if data is None:
+        raise RuntimeError(f"Claim check blob {payload['claim_check']} could not be downloaded")
+    return json.loads(gzip.decompress(data).decode("utf-8"))
+
+
+def cleanup_stage_outputs(file_id, succeeded: bool):
+    """Deletes the file's stored stage outputs according to CLAIM_CHECK_CLEANUP."""
+    if CLAIM_CHECK_CLEANUP == "never" or (CLAIM_CHECK_CLEANUP == "on_success" and not succeeded):
+        return
+    try:
+        delete_blobs_with_prefix(_stage_prefix(file_id))
+    except Exception as e:
+        logging.warning(f"Claim check cleanup failed for file_id {file_id}: {e}")
@@ -0,0 +1,192 @@
+# helpers/condition_persistence.py
+#
+# Bulk persistence stage for a file's extracted conditions.
+#
+# The per-diagnosis path (helpers/visit_processor.py -> diagnosis_worker) adds
+# and flushes one Conditions row, adds its ConditionEmbedding, merges, appends
+# the tag and commits, in its own session, for every diagnosis. For a large
+# file that is thousands of round trips and commits. persist_file_conditions
+# instead:
+#   1. builds every condition row of the file from the extracted visits,
+#   2. embeds every condition in batched requests (generate_embeddings_batch)
+#      and resolves tags by alias (helpers/tag_alias_index.py), falling back to
+#      the nearest tag, before any write,
+#   3. in one transaction, inserts the conditions with multi-row
+#      INSERT ... RETURNING, then the embeddings and condition_tags rows with
+#      batched inserts, and marks the unmatched conditions non-ratable.
+#
+# CONDITION_PERSISTENCE=per_row switches process_pages_task back to the
+# per-diagnosis path. benchmarks/condition_persistence.py compares the two.
+
+import os
+import time
+import logging
+from sqlalchemy import insert, update, select
+from models.sql_models import Conditions, ConditionEmbedding, condition_tags
+from helpers.visit_processor import parse_visit
+from helpers.llm_helpers import generate_embeddings_batch
+from helpers.embedding_helpers import MAX_COSINE_DISTANCE, build_condition_text
+from helpers.embedding_storage import condition_embedding_values
+from helpers.tag_alias_index import alias_index, learn_aliases
+from helpers.tag_index import tag_index
+from helpers.page_checkpoints import condition_idempotency_key
+from helpers.progress_events import publish_progress
+
+CONDITION_PERSISTENCE = os.getenv("CONDITION_PERSISTENCE", "bulk")
+BULK_INSERT_ROWS = int(os.getenv("BULK_INSERT_ROWS", "1000"))
+
+
+def build_condition_rows(details, user_id, file_id, service_periods):
+    """
+    Flattens the extracted pages into Conditions rows (dicts) and the per-visit
+    results process_pages_task returns. Diagnoses without a valid name are skipped.
+    Each row carries an idempotency_key derived from its position in the file.
+    """
+    rows, visit_results = [], []
+    for page in details:
+        page_number = page.get('page')
+        if page.get('category') != 'Clinical Records':
+            continue
+        for visit_index, visit in enumerate(page.get('details', {}).get('visits', [])):
+            parsed = parse_visit(visit, page_number, service_periods)
+            if parsed is None:
+                continue
+            visit_results.append({
+                "date_of_visit": parsed["date_of_visit"],
+                "date_of_visit_dt": parsed["date_of_visit_dt"]
+            })
+            for diagnosis_index, diagnosis in enumerate(parsed["diagnosis_list"]):
+                condition_name = diagnosis.get('diagnosis_name')
+                if not isinstance(condition_name, str):
+                    logging.warning(f"Invalid condition_name: {condition_name} on page {page_number}")
+                    continue
+                rows.append({
+                    "user_id": user_id,
+                    "file_id": file_id,
+                    "page_number": page_number,
+                    "condition_name": condition_name,
+                    "date_of_visit": parsed["date_of_visit_dt"],
+                    "medical_professionals": parsed["medical_professionals_str"],
+                    "medications_list": diagnosis.get('medication_list', []),
+                    "treatments": diagnosis.get('treatments'),
+                    "findings": diagnosis.get('findings'),
+                    "comments": diagnosis.get('doctor_comments'),
+                    "in_service": parsed["in_service"],
+                    "is_ratable": True,
+                    "idempotency_key": condition_idempotency_key(
+                        file_id, page_number, visit_index, diagnosis_index, condition_name
+                    ),
+                })
+    return rows, visit_results
+
+
+def _resolve_tags(session, user_id, rows):
+    """
+    Returns (tag_ids, vectors, pending, learned). tag_ids and vectors have one entry
+    per row: the alias or nearest tag within MAX_COSINE_DISTANCE (None if there
+    is none) and the embedding. Alias hits are embedded too, so they stay
+    searchable and re-taggable; the alias only replaces the similarity search.
+    Rows the embedding request failed for are returned in `pending`: they are
+    stored without an embedding (untagged and ratable unless an alias tagged
+    them), and process_pages_task embeds them right after with
+    embed_pending_conditions; if that fails too the task is retried, and once
+    its retries are used up embed_pending_conditions_task sweeps them later.
+    `learned` holds the embedding matches to record as aliases once the
+    conditions are committed.
+    """
+    tag_ids = [alias_index.lookup(session, row["condition_name"]) for row in rows]
+    # Don't hold a transaction (opened by the lookups) idle during the HTTP calls
+    session.commit()
+    try:
+        vectors = generate_embeddings_batch(
+            user_id, [build_condition_text(row["condition_name"], row["findings"]) for row in rows]
+        )
+    except Exception as e:
+        logging.error(f"Batched embedding failed for user_id {user_id}; conditions left pending: {e}")
+        return tag_ids, [None] * len(rows), set(range(len(rows))), []
+
+    pending = {i for i, v in enumerate(vectors) if v is None}
+    unresolved = [i for i, (tag_id, v) in enumerate(zip(tag_ids, vectors)) if tag_id is None and v is not None]
+    matches = tag_index.top_k(session, [vectors[i] for i in unresolved], k=1, max_distance=MAX_COSINE_DISTANCE)
+    learned = []
+    for i, match in zip(unresolved, matches):
+        if match:
+            tag_ids[i], distance = match[0]
+            learned.append((rows[i]["condition_name"], tag_ids[i], distance))
+    return tag_ids, vectors, pending, learned
+
+
+def persist_file_conditions(session, details, user_id, file_id, service_periods):
+    """
+    Writes all conditions of a file, their embeddings and their tag links in a
+    single transaction. Returns the per-visit results for finalize_task.
+    """
+    started = time.perf_counter()
+    rows, visit_results = build_condition_rows(details, user_id, file_id, service_periods)
+
+    # A retried task skips the conditions an earlier attempt already committed
+    existing = set(session.execute(
+        select(Conditions.idempotency_key).where(
+            Conditions.file_id == file_id,
+            Conditions.idempotency_key.in_([row["idempotency_key"] for row in rows])
+        )
+    ).scalars()) if rows else set()
+    session.commit()  # end the read transaction before the embedding calls
+    if existing:
+        logging.info(f"Skipping {len(existing)} conditions already stored for file_id {file_id}")
+        rows = [row for row in rows if row["idempotency_key"] not in existing]
+    if not rows:
+        return visit_results
+
+    tag_ids, vectors, pending, learned = _resolve_tags(session, user_id, rows)
+
+    try:
+        condition_ids = []
+        for start in range(0, len(rows), BULK_INSERT_ROWS):
+            result = session.execute(
+                insert(Conditions).returning(Conditions.condition_id, sort_by_parameter_order=True),
+                rows[start:start + BULK_INSERT_ROWS]
+            )
+            condition_ids.extend(result.scalars().all())
+
+        embedding_rows = [
+            {"condition_id": cid, "user_id": user_id, **condition_embedding_values(vector)}
+            for cid, vector in zip(condition_ids, vectors) if vector is not None
+        ]
+        # Inserted in a fixed order: each row fires the user_tag_counts upsert
+        # trigger, which locks the (user, tag) counter row, so concurrent files of
+        # the same user must reach those rows in the same (tag_id) order. The
+        # condition_ids of two files never overlap, so ordering by them alone would not.
+        tag_rows = sorted(
+            (
+                {"condition_id": cid, "tag_id": tag_id}
+                for cid, tag_id in zip(condition_ids, tag_ids) if tag_id is not None
+            ),
+            key=lambda row: (row["tag_id"], row["condition_id"])
+        )
+        non_ratable_ids = [
+            cid for i, (cid, tag_id) in enumerate(zip(condition_ids, tag_ids))
+            if tag_id is None and i not in pending
+        ]
+
+        if embedding_rows:
+            session.execute(insert(ConditionEmbedding), embedding_rows)
+        if tag_rows:
+            session.execute(insert(condition_tags), tag_rows)
+        if non_ratable_ids:
+            session.execute(
+                update(Conditions).where(Conditions.condition_id.in_(non_ratable_ids)).values(is_ratable=False)
+            )
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    learn_aliases(learned)
+
+    logging.info(
+        f"Persisted {len(rows)} conditions for file_id {file_id}: {len(embedding_rows)} embeddings, "
+        f"{len(tag_rows)} tagged, {len(non_ratable_ids)} non-ratable, {len(pending)} pending "
+        f"({time.perf_counter() - started:.2f}s)"
+    )
+    publish_progress(user_id, file_id, "conditions", found=len(rows) + len(existing), tagged=len(tag_rows))
+    return visit_results
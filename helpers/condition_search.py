@@ -0,0 +1,72 @@
+# helpers/condition_search.py
+#
+# Per-user nearest-neighbour search over condition_embeddings.
+#
+# condition_embeddings carries a copy of user_id (btree-indexed) and an HNSW
+# index on the stored vector (see migrations/003_condition_embedding_ann.sql):
+#   - users with a short history: the planner filters on user_id and sorts the
+#     few rows exactly, which is faster than walking the graph;
+#   - users with a long history: the HNSW index is walked with
+#     hnsw.iterative_scan, which keeps scanning until LIMIT rows that pass the
+#     user_id filter are found instead of returning too few (pgvector >= 0.8).
+# Iterative scans may return rows slightly out of order, so the candidates
+# are re-sorted by exact distance in the outer query.
+
+import os
+from sqlalchemy import text
+from helpers.embedding_storage import COMPACT_STORAGE, COMPACT_DIMENSIONS
+
+# "relaxed_order" / "strict_order", or "off" for pgvector < 0.8
+SEMANTIC_SEARCH_ITERATIVE_SCAN = os.getenv("SEMANTIC_SEARCH_ITERATIVE_SCAN", "relaxed_order")
+# Candidate list size while walking the HNSW graph (higher = better recall, slower)
+SEMANTIC_SEARCH_EF_SEARCH = int(os.getenv("SEMANTIC_SEARCH_EF_SEARCH", "100"))
+
+# Indexed expression: HNSW supports up to 2,000 dimensions for vector but 4,000
+# for halfvec, so full Vector(3072) rows are indexed (and searched) as halfvec.
+if COMPACT_STORAGE:
+    VECTOR_EXPRESSION = "embedding_half"
+    VECTOR_TYPE = f"halfvec({COMPACT_DIMENSIONS})"
+else:
+    VECTOR_EXPRESSION = "(embedding::halfvec(3072))"
+    VECTOR_TYPE = "halfvec(3072)"
+
+NEAREST_CONDITIONS_SQL = text(f"""
+    WITH nearest AS MATERIALIZED (
+        SELECT condition_id, {VECTOR_EXPRESSION} <=> CAST(:query_vec AS {VECTOR_TYPE}) AS distance
+        FROM condition_embeddings
+        WHERE user_id = :user_id
+        ORDER BY distance
+        LIMIT :limit
+    )
+    SELECT condition_id, distance FROM nearest ORDER BY distance
+""")
+
+
+def configure_ann_search(session):
+    """Sets the HNSW search parameters for the current transaction only."""
+    session.execute(
+        text("SELECT set_config('hnsw.ef_search', :ef_search, true)"),
+        {"ef_search": str(SEMANTIC_SEARCH_EF_SEARCH)}
+    )
+    if SEMANTIC_SEARCH_ITERATIVE_SCAN != "off":
+        session.execute(
+            text("SELECT set_config('hnsw.iterative_scan', :mode, true)"),
+            {"mode": SEMANTIC_SEARCH_ITERATIVE_SCAN}
+        )
+
+
+def nearest_condition_ids(session, user_id: int, query_vec: list, limit: int = 10):
+    """
+    Returns [(condition_id, cosine_distance), ...] for the user's `limit`
+    conditions closest to `query_vec`, nearest first.
+    """
+    configure_ann_search(session)
+    rows = session.execute(
+        NEAREST_CONDITIONS_SQL,
+        {
+            "query_vec": "[" + ",".join(str(float(v)) for v in query_vec) + "]",
+            "user_id": user_id,
+            "limit": limit,
+        }
+    ).all()
+    return [(row.condition_id, row.distance) for row in rows]
@@ -4,15 +4,14 @@ from pydantic import ValidationError
 from dotenv import load_dotenv
 from models.decision_models import BvaDecisionStructuredSummary
 from helpers.llm_wrappers import call_openai_chat_parse
+from helpers.openai_client import get_openai_client
 from decimal import Decimal 
 
 # Load environment variables from a .env file
 load_dotenv()
 
 # Set up the OpenAI API key to interact with the GPT models
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY"),  # Ensure this is set correctly
-)
+client = get_openai_client()
 if not client:
     raise ValueError("Please set the VA_AUTOMATION_API_KEY environment variable.")
 
@@ -53,6 +52,7 @@ def summarize_decision(document_text: str, user_id: int) -> BvaDecisionStructure
             temperature=0.2,
             cost_per_prompt_token=cost_per_prompt_token,
             cost_per_completion_token=cost_per_completion_token,
+            call_site="summarize_decision",
         )
 
         # 2) Extract the parsed content from the response
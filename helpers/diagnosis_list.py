@@ -2,6 +2,7 @@
 
 
 from helpers.diagnosis_worker import worker_process_diagnosis
+from helpers.tag_alias_index import learn_aliases
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
 
@@ -12,6 +13,7 @@ def process_diagnosis_list(diagnosis_list, user, file_id, page_number, date_of_v
     """
     max_workers = 10  # Adjust based on your environment
     futures = []
+    learned = []
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
         for diagnosis in diagnosis_list:
             future = executor.submit(
@@ -31,8 +33,9 @@ def process_diagnosis_list(diagnosis_list, user, file_id, page_number, date_of_v
 
         for future in as_completed(futures):
             try:
-                future.result()  # To catch exceptions raised in threads
+                learned.extend(future.result() or [])  # To catch exceptions raised in threads
             except Exception as e:
                 logging.error(f"Error in thread: {e}")
 
+    learn_aliases(learned)
     logging.info("All diagnoses have been processed.")
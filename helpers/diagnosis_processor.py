@@ -3,9 +3,11 @@
 import logging
 from models.sql_models import Conditions
 
-def process_diagnosis(diagnosis, user_id, file_id, page_number, date_of_visit, medical_professionals_str, in_service, session):
+def process_diagnosis(diagnosis, user_id, file_id, page_number, date_of_visit, medical_professionals_str, in_service, session, idempotency_key=None):
     """
     Processes a single diagnosis and saves it to the database.
+    Returns None without inserting when a condition with the same
+    idempotency_key already exists (the task is being retried).
     """
     condition_name = diagnosis.get('diagnosis_name')
     medications = diagnosis.get('medication_list', [])
@@ -18,6 +20,12 @@ def process_diagnosis(diagnosis, user_id, file_id, page_number, date_of_visit, m
         print(f"Invalid condition_name: {condition_name} on page {page_number}")
         return None
 
+    if idempotency_key is not None and session.query(
+        session.query(Conditions.condition_id).filter_by(idempotency_key=idempotency_key).exists()
+    ).scalar():
+        logging.info(f"Condition {idempotency_key[:12]} on page {page_number} already stored; skipping")
+        return None
+
     try:
         new_condition = Conditions(
             user_id=user_id,
@@ -30,7 +38,8 @@ def process_diagnosis(diagnosis, user_id, file_id, page_number, date_of_visit, m
             treatments=treatments,
             findings=findings,
             comments=comments,
-            in_service=in_service
+            in_service=in_service,
+            idempotency_key=idempotency_key
         )
 
         session.add(new_condition)
@@ -0,0 +1,106 @@
+# helpers/diagnosis_queue.py
+#
+# One bounded diagnosis work queue per worker process.
+#
+# process_pages_task used to open a 10-thread pool per task and process_visit
+# another 10-thread pool per visit, so a single file could hold up to 100 DB
+# sessions and OpenAI calls at once, multiplied by the worker concurrency.
+# Every diagnosis is now submitted to this queue instead: a fixed number of
+# threads (DIAGNOSIS_CONCURRENCY) drain it, pending work is capped at
+# DIAGNOSIS_QUEUE_MAX (submit blocks when full) and users are served
+# round-robin, so one large upload cannot starve another user's file that
+# shares the process.
+#
+# Size DIAGNOSIS_CONCURRENCY below DB_POOL_SIZE + DB_MAX_OVERFLOW
+# (database/session.py); each in-flight diagnosis holds one DB connection and
+# at most one OpenAI call.
+
+import os
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from database.session import DB_POOL_SIZE, DB_MAX_OVERFLOW
+from helpers.metrics_helpers import diagnosis_queue_depth, diagnosis_in_flight
+
+DIAGNOSIS_CONCURRENCY = int(os.getenv("DIAGNOSIS_CONCURRENCY", "8"))
+DIAGNOSIS_QUEUE_MAX = int(os.getenv("DIAGNOSIS_QUEUE_MAX", "500"))
+
+
+class DiagnosisQueue:
+    """Bounded per-process work queue with per-user round-robin scheduling."""
+
+    def __init__(self, concurrency: int = DIAGNOSIS_CONCURRENCY, max_pending: int = DIAGNOSIS_QUEUE_MAX):
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()  # user_id -> deque of (future, fn, args, kwargs)
+        self._pending = 0
+        self._threads = []
+        self._pid = None
+
+        connections = DB_POOL_SIZE + DB_MAX_OVERFLOW
+        if concurrency > connections:
+            logging.warning(
+                f"DIAGNOSIS_CONCURRENCY={concurrency} exceeds the DB pool "
+                f"({DB_POOL_SIZE} + {DB_MAX_OVERFLOW} overflow); diagnoses will wait on connections"
+            )
+
+    def _ensure_started(self):
+        # Threads do not survive the Celery prefork fork, so start them lazily in each child
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._queues.clear()
+        self._pending = 0
+        self._threads = [
+            threading.Thread(target=self._run, name=f"diagnosis-worker-{i}", daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for thread in self._threads:
+            thread.start()
+        logging.info(f"Diagnosis queue started with {self.concurrency} threads (pid {self._pid})")
+
+    def submit(self, user_id, fn, *args, **kwargs) -> Future:
+        """Queues fn(*args, **kwargs) under user_id; blocks while the queue is full."""
+        future = Future()
+        with self._cond:
+            self._ensure_started()
+            while self._pending >= self.max_pending:
+                self._cond.wait()
+            self._queues.setdefault(user_id, deque()).append((future, fn, args, kwargs))
+            self._pending += 1
+            diagnosis_queue_depth.inc()
+            self._cond.notify_all()
+        return future
+
+    def _next(self):
+        """Pops the next item, rotating through users so each gets a turn."""
+        with self._cond:
+            while not self._queues:
+                self._cond.wait()
+            user_id, items = next(iter(self._queues.items()))
+            item = items.popleft()
+            del self._queues[user_id]
+            if items:
+                self._queues[user_id] = items  # back of the rotation
+            self._pending -= 1
+            diagnosis_queue_depth.dec()
+            self._cond.notify_all()
+            return item
+
+    def _run(self):
+        while True:
+            future, fn, args, kwargs = self._next()
+            if not future.set_running_or_notify_cancel():
+                continue
+            diagnosis_in_flight.inc()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                diagnosis_in_flight.dec()
+
+
+diagnosis_queue = DiagnosisQueue()
@@ -4,10 +4,15 @@ import logging
 from helpers.diagnosis_processor import process_diagnosis
 from helpers.embedding_helpers import process_condition_embedding 
 
-def worker_process_diagnosis(diagnosis, user_id, file_id, page_number, date_of_visit, medical_professionals_str, in_service, session):
+def worker_process_diagnosis(diagnosis, user_id, file_id, page_number, date_of_visit, medical_professionals_str, in_service, session, defer_embedding=False, idempotency_key=None):
     """
     Worker function to process a single diagnosis and handle embedding.
+    With defer_embedding=True only the condition is stored; the caller embeds
+    the file's conditions in batches afterwards (embed_pending_conditions).
+    Returns the tag match to learn as an alias once committed (see
+    wait_for_diagnoses), or an empty list.
     """
+    learned = []
     try:
         result = process_diagnosis(
             diagnosis=diagnosis,
@@ -17,10 +22,11 @@ def worker_process_diagnosis(diagnosis, user_id, file_id, page_number, date_of_v
             date_of_visit=date_of_visit,
             medical_professionals_str=medical_professionals_str,
             in_service=in_service,
-            session=session
+            session=session,
+            idempotency_key=idempotency_key
         )
 
-        if result:
+        if result and not defer_embedding:
             condition_name = result["condition_name"]
             findings = result["findings"]
             condition_id = result["condition_id"]
@@ -35,7 +41,7 @@ def worker_process_diagnosis(diagnosis, user_id, file_id, page_number, date_of_v
             print(f"Combined text for embedding: {combined_text.strip()}")
             
             try:
-                process_condition_embedding(user_id, condition_id, combined_text, new_condition, session)
+                learned = process_condition_embedding(user_id, condition_id, combined_text, new_condition, session)
             except Exception as e:
                 logging.error(
                     f"Failed to generate or assign embedding for condition_id {condition_id}: {str(e)}"
@@ -50,3 +56,4 @@ def worker_process_diagnosis(diagnosis, user_id, file_id, page_number, date_of_v
         logging.error(f"Unexpected error in worker: {e}")
     finally:
         session.commit()
+    return learned
@@ -0,0 +1,131 @@
+# helpers/embedding_cache.py
+#
+# Shared embedding cache keyed by model + dimensions + normalized text.
+#
+# Condition texts such as "Condition Name: Hypertension, Findings: None" repeat
+# across visits and users, so every embedding is stored once in the
+# embedding_cache table, with an in-process LRU in front of it. Lookups are
+# counted in embedding_cache_lookups_total{result="memory_hit|db_hit|miss"}.
+#
+# Only the sha256 key is stored, never the text itself: condition texts hold
+# patient findings. The LRU keeps float32 arrays (~12 KB per 3,072-dim vector
+# instead of ~98 KB as a list of Python floats) in every process that embeds.
+
+import os
+import re
+import hashlib
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+from sqlalchemy.dialects.postgresql import insert
+from database.session import SessionFactory
+from models.sql_models import EmbeddingCache
+from helpers.metrics_helpers import embedding_cache_lookups
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_LRU_SIZE = int(os.getenv("EMBEDDING_CACHE_LRU_SIZE", "2000"))
+
+_lru = OrderedDict()
+_lru_lock = threading.Lock()
+
+
+def normalize_text(text: str) -> str:
+    """Case- and whitespace-insensitive form of the text used for the cache key."""
+    return re.sub(r"\s+", " ", text or "").strip().lower()
+
+
+def cache_key(model: str, dimensions: int, normalized: str) -> str:
+    return hashlib.sha256(f"{model}|{dimensions}|{normalized}".encode("utf-8")).hexdigest()
+
+
+def _lru_get(key):
+    with _lru_lock:
+        vector = _lru.get(key)
+        if vector is not None:
+            _lru.move_to_end(key)
+            return vector.tolist()
+        return None
+
+
+def _lru_put(key, vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    with _lru_lock:
+        _lru[key] = vector
+        _lru.move_to_end(key)
+        while len(_lru) > EMBEDDING_CACHE_LRU_SIZE:
+            _lru.popitem(last=False)
+
+
+def get_cached_embeddings(model: str, dimensions: int, texts: list) -> list:
+    """
+    Returns one entry per text: the cached vector, or None on a miss.
+    Checks the in-process LRU first, then the embedding_cache table (one query).
+    """
+    if not EMBEDDING_CACHE_ENABLED:
+        return [None] * len(texts)
+
+    keys = [cache_key(model, dimensions, normalize_text(t)) for t in texts]
+    results = [_lru_get(k) for k in keys]
+    for vector in results:
+        if vector is not None:
+            embedding_cache_lookups.labels(model, "memory_hit").inc()
+
+    missing = {k for k, v in zip(keys, results) if v is None}
+    if missing:
+        session = SessionFactory()
+        try:
+            rows = (
+                session.query(EmbeddingCache.cache_key, EmbeddingCache.embedding)
+                .filter(EmbeddingCache.cache_key.in_(missing))
+                .all()
+            )
+            found = {row.cache_key: np.asarray(row.embedding, dtype=np.float32).tolist() for row in rows}
+        except Exception as e:
+            logging.warning(f"Embedding cache lookup failed: {e}")
+            found = {}
+        finally:
+            session.close()
+
+        for i, key in enumerate(keys):
+            if results[i] is not None:
+                continue
+            if key in found:
+                results[i] = found[key]
+                _lru_put(key, found[key])
+                embedding_cache_lookups.labels(model, "db_hit").inc()
+            else:
+                embedding_cache_lookups.labels(model, "miss").inc()
+
+    return results
+
+
+def store_embeddings(model: str, dimensions: int, texts: list, vectors: list):
+    """Adds freshly generated embeddings to the LRU and the embedding_cache table."""
+    if not EMBEDDING_CACHE_ENABLED:
+        return
+
+    rows = {}
+    for text, vector in zip(texts, vectors):
+        if vector is None:
+            continue
+        key = cache_key(model, dimensions, normalize_text(text))
+        _lru_put(key, vector)
+        rows[key] = {
+            "cache_key": key,
+            "model": model,
+            "dimensions": dimensions,
+            "embedding": vector,
+        }
+    if not rows:
+        return
+
+    session = SessionFactory()
+    try:
+        session.execute(insert(EmbeddingCache).values(list(rows.values())).on_conflict_do_nothing())
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logging.warning(f"Embedding cache store failed: {e}")
+    finally:
+        session.close()
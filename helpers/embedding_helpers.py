@@ -3,11 +3,14 @@
 import logging
 from models.sql_models import Tag
 #from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, select
 from pgvector.sqlalchemy import Vector
-from models.sql_models import ConditionEmbedding  
+from models.sql_models import ConditionEmbedding, Conditions, condition_tags
 #from models.sql_models import db
-from helpers.llm_helpers import generate_embedding
+from helpers.llm_helpers import generate_embedding, generate_embeddings_batch
+from helpers.tag_index import tag_index
+from helpers.embedding_storage import condition_embedding_values
+from helpers.tag_alias_index import alias_index, learn_aliases
 
 
 MAX_COSINE_DISTANCE = .65
@@ -17,18 +20,10 @@ def find_top_tags(session, embedding_vector: list, top_n: int = 2):
     """
     Finds the top N tags with the smallest cosine distance to the provided embedding_vector.
     Returns a list of tuples (Tag, cosine_distance).
+    Uses the in-memory tag index (helpers/tag_index.py) rather than a pgvector query.
     """
-    # Calculate cosine distance using the ORM's built-in method
-    distance = Tag.embeddings.cosine_distance(embedding_vector)
-    
-    # Query both the Tag object and the distance, labeled as 'distance'
-    similar_tags = (
-        session.query(Tag, distance.label('distance'))
-        .order_by(distance)
-        .limit(top_n)
-        .all()
-    )
-    return similar_tags
+    matches = tag_index.top_k(session, [embedding_vector], k=top_n)[0]
+    return [(session.get(Tag, tag_id), distance) for tag_id, distance in matches]
 
 
 def process_condition_embedding(user_id, condition_id, combined_text, new_condition, session):
@@ -41,10 +36,25 @@ def process_condition_embedding(user_id, condition_id, combined_text, new_condit
         new_condition (Condition): The condition instance to update.
 
     Returns:
-        None
+        list: the (condition_name, tag_id, distance) match to record with
+        learn_aliases once the caller has committed (empty if none).
     """
+    learned = []
     try:
         new_condition = session.merge(new_condition)
+
+        # Alias fast path: common condition names resolve to a tag without a
+        # similarity search. The embedding is still stored (usually an
+        # embedding cache hit) so the condition stays searchable and re-taggable.
+        alias_tag = None
+        alias_tag_id = alias_index.lookup(session, new_condition.condition_name)
+        if alias_tag_id is not None:
+            alias_tag = session.get(Tag, alias_tag_id)
+            if alias_tag is not None:
+                new_condition.tags.append(alias_tag)
+                logging.info(f"Associated tag {alias_tag_id} with condition_id {condition_id} (alias match)")
+                print(f"Associated tag {alias_tag_id} with condition_id {condition_id} (alias match)")
+
         # Generate the embedding vector
         embedding_vector = generate_embedding(user_id, combined_text.strip())
         logging.info(f"Generated embedding for condition_id {condition_id}")
@@ -54,11 +64,14 @@ def process_condition_embedding(user_id, condition_id, combined_text, new_condit
             # Create a new embedding instance
             new_embedding = ConditionEmbedding(
                 condition_id=condition_id,
-                embedding=embedding_vector
+                user_id=user_id,
+                **condition_embedding_values(embedding_vector)
             )
             session.add(new_embedding)
             logging.info(f"Stored embedding for condition_id {condition_id}")
             print(f"Stored embedding for condition_id {condition_id}")
+            if alias_tag is not None:
+                return learned
 
             # Perform similarity search to find top tags
             top_tags_with_distance = find_top_tags(session, embedding_vector, top_n=1)
@@ -68,6 +81,7 @@ def process_condition_embedding(user_id, condition_id, combined_text, new_condit
                 top_tag, distance = top_tags_with_distance[0]
                 if distance <= MAX_COSINE_DISTANCE:
                     new_condition.tags.append(top_tag)
+                    learned.append((new_condition.condition_name, top_tag.tag_id, distance))
                     logging.info(
                         f"Associated tag {top_tag.tag_id} with condition_id {condition_id} "
                         f"(cosine distance: {distance:.4f})"
@@ -94,6 +108,9 @@ def process_condition_embedding(user_id, condition_id, combined_text, new_condit
                 print(
                     f"Condition_id {condition_id} marked as non-ratable (no tags found)"
                 )
+        elif alias_tag is not None:
+            # Tagged already; embed_pending_conditions stores the embedding later
+            logging.error(f"Embedding vector is None for alias-tagged condition_id {condition_id}; left pending")
         else:
             new_condition.is_ratable = False
             logging.error(
@@ -108,4 +125,144 @@ def process_condition_embedding(user_id, condition_id, combined_text, new_condit
         )
         logging.info(
             f"Failed to generate or assign embedding for condition_id {condition_id}: {str(e)}"
-        )
\ No newline at end of file
+        )
+    return learned
+
+
+def build_condition_text(condition_name, findings) -> str:
+    """Text embedded for a condition (same format the per-diagnosis worker uses)."""
+    return f"Condition Name: {condition_name}, Findings: {findings}"
+
+
+def assign_top_tags(session, conditions, vectors):
+    """
+    Tags each condition with its nearest Tag in one vectorized pass over the
+    tag index, or marks it non-ratable when no tag is within MAX_COSINE_DISTANCE.
+    A tagged condition is (again) ratable.
+    Returns the matches to record as learned aliases (helpers/tag_alias_index.py)
+    once the caller has committed.
+    """
+    matches = tag_index.top_k(session, vectors, k=1, max_distance=MAX_COSINE_DISTANCE)
+    tag_ids = {m[0][0] for m in matches if m}
+    tags = {t.tag_id: t for t in session.query(Tag).filter(Tag.tag_id.in_(tag_ids)).all()} if tag_ids else {}
+
+    learned = []
+    for condition, match in zip(conditions, matches):
+        if match and match[0][0] in tags:
+            tag_id, distance = match[0]
+            condition.tags.append(tags[tag_id])
+            condition.is_ratable = True
+            learned.append((condition.condition_name, tag_id, distance))
+            logging.info(
+                f"Associated tag {tag_id} with condition_id {condition.condition_id} "
+                f"(cosine distance: {distance:.4f})"
+            )
+        else:
+            condition.is_ratable = False
+            logging.info(
+                f"Condition_id {condition.condition_id} marked as non-ratable "
+                f"(no tag within cosine distance {MAX_COSINE_DISTANCE})"
+            )
+
+    return learned
+
+
+def assign_alias_tags(session, conditions):
+    """
+    Tags the conditions whose name is a known alias and returns the rest,
+    which still need a similarity search.
+    """
+    resolved, remaining = {}, []
+    for condition in conditions:
+        tag_id = alias_index.lookup(session, condition.condition_name)
+        if tag_id is None:
+            remaining.append(condition)
+        else:
+            resolved[condition] = tag_id
+    if not resolved:
+        return remaining
+
+    tags = {t.tag_id: t for t in session.query(Tag).filter(Tag.tag_id.in_(set(resolved.values()))).all()}
+    for condition, tag_id in resolved.items():
+        if tag_id in tags:
+            condition.tags.append(tags[tag_id])
+            condition.is_ratable = True
+        else:
+            remaining.append(condition)  # alias points at a tag deleted since the last refresh
+    logging.info(f"Resolved {len(resolved)} conditions through tag aliases")
+    return remaining
+
+
+def embed_pending_conditions(session, user_id, file_id=None, condition_ids=None):
+    """
+    Batched embedding stage: finds the user's conditions that have no embedding
+    yet (optionally limited to one file or to specific condition_ids), tags the
+    untagged ones whose name is a known alias (assign_alias_tags), embeds them
+    all with generate_embeddings_batch, stores the vectors against their
+    condition_id and assigns the nearest tags in one batch (assign_top_tags)
+    to the ones neither tagged nor alias-resolved.
+
+    Alias-resolved conditions are embedded too, so they stay searchable and
+    re-taggable; a condition that is tagged but has no embedding (e.g. an
+    alias hit whose embedding failed) is only embedded, not re-tagged.
+
+    With neither file_id nor condition_ids it sweeps every pending condition
+    of the user (embed_pending_conditions_task in celery_app.py), which picks
+    up conditions whose embedding failed earlier.
+
+    A failed embedding request leaves the conditions pending, with is_ratable
+    untouched: the alias-resolved ones are committed and the error is raised
+    so the caller can retry. Returns the number of conditions processed.
+    """
+    query = (
+        session.query(Conditions)
+        .outerjoin(ConditionEmbedding, ConditionEmbedding.condition_id == Conditions.condition_id)
+        .filter(Conditions.user_id == user_id, ConditionEmbedding.embedding_id.is_(None))
+    )
+    if file_id is not None:
+        query = query.filter(Conditions.file_id == file_id)
+    if condition_ids is not None:
+        query = query.filter(Conditions.condition_id.in_(condition_ids))
+    conditions = query.order_by(Conditions.condition_id).all()
+
+    if not conditions:
+        return 0
+
+    tagged_ids = set(session.execute(
+        select(condition_tags.c.condition_id)
+        .where(condition_tags.c.condition_id.in_([c.condition_id for c in conditions]))
+    ).scalars())
+    untagged = [c for c in conditions if c.condition_id not in tagged_ids]
+    unmatched = set(assign_alias_tags(session, untagged))
+
+    texts = [build_condition_text(c.condition_name, c.findings) for c in conditions]
+    logging.info(f"Embedding {len(conditions)} pending conditions for user_id {user_id} (file_id {file_id})")
+
+    try:
+        vectors = generate_embeddings_batch(user_id, texts)
+    except Exception as e:
+        logging.error(f"Batched embedding failed for user_id {user_id} (file_id {file_id}); left pending: {e}")
+        session.commit()
+        raise
+
+    stored, embedded, learned = 0, [], []
+    for condition, vector in zip(conditions, vectors):
+        if vector is None:
+            logging.error(f"No embedding returned for condition_id {condition.condition_id}; left pending")
+            continue
+        stored += 1
+        session.add(ConditionEmbedding(
+            condition_id=condition.condition_id,
+            user_id=condition.user_id,
+            **condition_embedding_values(vector)
+        ))
+        if condition in unmatched:
+            embedded.append((condition, vector))
+
+    if embedded:
+        learned = assign_top_tags(session, [c for c, _ in embedded], [v for _, v in embedded])
+
+    session.commit()
+    learn_aliases(learned)
+    logging.info(f"Stored {stored} embeddings for user_id {user_id} (file_id {file_id})")
+    return len(conditions)
@@ -0,0 +1,33 @@
+# helpers/embedding_storage.py
+#
+# Which embedding columns to read and write, driven by Config.EMBEDDING_STORAGE:
+#   "full"    - Vector(3072) columns (condition_embeddings.embedding, tags.embeddings)
+#   "compact" - HALFVEC(COMPACT_EMBEDDING_DIMENSIONS) columns (embedding_half, embeddings_half),
+#               filled from text-embedding-3-large with the `dimensions` parameter
+
+from config import Config
+from models.sql_models import ConditionEmbedding, Tag
+
+COMPACT_STORAGE = Config.EMBEDDING_STORAGE == "compact"
+COMPACT_DIMENSIONS = Config.COMPACT_EMBEDDING_DIMENSIONS
+
+
+def embedding_request_kwargs() -> dict:
+    """Extra kwargs for text-embedding-3-large requests (reduced `dimensions` in compact mode)."""
+    return {"dimensions": COMPACT_DIMENSIONS} if COMPACT_STORAGE else {}
+
+
+def condition_embedding_column():
+    """ConditionEmbedding column searched and written in the current storage mode."""
+    return ConditionEmbedding.embedding_half if COMPACT_STORAGE else ConditionEmbedding.embedding
+
+
+def tag_embedding_column():
+    """Tag column searched and written in the current storage mode."""
+    return Tag.embeddings_half if COMPACT_STORAGE else Tag.embeddings
+
+
+def condition_embedding_values(vector) -> dict:
+    """Keyword arguments for a new ConditionEmbedding row holding `vector`."""
+    return {"embedding_half": vector} if COMPACT_STORAGE else {"embedding": vector}
+
@@ -0,0 +1,149 @@
+# helpers/hedge_helpers.py
+#
+# Request hedging for slow OpenAI calls.
+#
+# A hedged call starts normally; if it has not finished after the configured
+# percentile of recent latencies for the same (call_site, model), a duplicate
+# request is fired and whichever finishes first is used. The loser is cancelled
+# if it has not started yet, otherwise it is abandoned: its result is discarded
+# and it stops retrying. Only the winner's response reaches the usage logging in
+# llm_wrappers, so the user is only billed once; the tokens OpenAI still bills
+# for an abandoned attempt that completes are counted in
+# llm_hedge_abandoned_tokens_total (and llm_tokens_total).
+#
+# Latencies fed to the tracker are measured from the start of the logical
+# call, so a hedge winner does not report only its own (shorter) time.
+# Attempts only run on the executor while it has a free worker: when it is
+# saturated the call runs inline without hedging (outcome "skipped"), rather
+# than queueing and counting the queue wait towards the hedge delay.
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from helpers.metrics_helpers import llm_hedges, llm_hedge_abandoned_tokens, record_llm_tokens
+
+LLM_HEDGING_ENABLED = os.getenv("LLM_HEDGING_ENABLED", "false").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_WINDOW = int(os.getenv("LLM_HEDGE_WINDOW", "200"))
+LLM_HEDGE_MAX_WORKERS = int(os.getenv("LLM_HEDGE_MAX_WORKERS", "64"))
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    """
+    Keeps a sliding window of recent successful call latencies per (call_site, model)
+    and answers "how long should we wait before hedging?".
+    """
+
+    def __init__(self, window: int = LLM_HEDGE_WINDOW):
+        self._window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, call_site: str, model: str, seconds: float):
+        with self._lock:
+            samples = self._samples.get((call_site, model))
+            if samples is None:
+                samples = self._samples[(call_site, model)] = deque(maxlen=self._window)
+            samples.append(seconds)
+
+    def hedge_delay(self, call_site: str, model: str):
+        """
+        Returns the LLM_HEDGE_PERCENTILE latency in seconds, or None if there are
+        not yet enough samples to decide (in which case the call is not hedged).
+        """
+        with self._lock:
+            samples = self._samples.get((call_site, model))
+            if not samples or len(samples) < LLM_HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * LLM_HEDGE_PERCENTILE / 100))
+        return ordered[index]
+
+
+latency_tracker = LatencyTracker()
+_hedge_executor = ThreadPoolExecutor(max_workers=LLM_HEDGE_MAX_WORKERS, thread_name_prefix="llm-hedge")
+# One slot per executor worker; taken without blocking, released when the attempt ends
+_hedge_slots = threading.BoundedSemaphore(LLM_HEDGE_MAX_WORKERS)
+
+
+def _submit(attempt_fn, **kwargs):
+    """Starts the attempt on a free executor worker, or returns None if there is none."""
+    if not _hedge_slots.acquire(blocking=False):
+        return None
+    try:
+        future = _hedge_executor.submit(attempt_fn, **kwargs)
+    except Exception:
+        _hedge_slots.release()
+        raise
+    future.add_done_callback(lambda _: _hedge_slots.release())
+    return future
+
+
+def _count_abandoned(call_site: str, model: str, future):
+    """Done callback of a losing attempt: counts the tokens of a response nobody uses."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    usage = getattr(future.result(), "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    record_llm_tokens(call_site, model, prompt_tokens, completion_tokens)
+    if prompt_tokens:
+        llm_hedge_abandoned_tokens.labels(call_site, model, "prompt").inc(prompt_tokens)
+    if completion_tokens:
+        llm_hedge_abandoned_tokens.labels(call_site, model, "completion").inc(completion_tokens)
+
+
+def call_hedged(call_site: str, model: str, attempt_fn, **kwargs):
+    """
+    Runs `attempt_fn(cancel_event=..., call_started=..., **kwargs)` with hedging.
+
+    `attempt_fn` is a full call including retries (llm_wrappers._call_with_retries);
+    it receives a threading.Event that is set once the attempt has lost the race,
+    and the perf_counter() time the logical call started, for the latency tracker.
+    """
+    call_started = time.perf_counter()
+    delay = latency_tracker.hedge_delay(call_site, model)
+    if delay is None:
+        return attempt_fn(cancel_event=None, call_started=call_started, **kwargs)
+
+    primary_cancel = threading.Event()
+    primary = _submit(attempt_fn, cancel_event=primary_cancel, call_started=call_started, **kwargs)
+    if primary is None:
+        llm_hedges.labels(call_site, model, "skipped").inc()
+        return attempt_fn(cancel_event=None, call_started=call_started, **kwargs)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+
+    hedge_cancel = threading.Event()
+    hedge = _submit(attempt_fn, cancel_event=hedge_cancel, call_started=call_started, **kwargs)
+    if hedge is None:
+        llm_hedges.labels(call_site, model, "skipped").inc()
+        return primary.result()
+    llm_hedges.labels(call_site, model, "fired").inc()
+    logger.info(f"Hedging {call_site} ({model}) after {delay:.2f}s")
+
+    attempts = {primary: ("primary", primary_cancel), hedge: ("hedge", hedge_cancel)}
+    pending = set(attempts)
+    first_error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            error = future.exception()
+            if error is not None:
+                first_error = first_error or error
+                continue
+            for loser in pending:
+                attempts[loser][1].set()
+                if not loser.cancel():
+                    loser.add_done_callback(lambda f: _count_abandoned(call_site, model, f))
+            llm_hedges.labels(call_site, model, f"won_by_{attempts[future][0]}").inc()
+            return future.result()
+
+    raise first_error
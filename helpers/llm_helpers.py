@@ -14,7 +14,10 @@ from models.llm_models import *
 import json
 from pydantic import ValidationError
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from helpers.llm_wrappers import call_openai_embeddings, call_openai_chat_parse, call_openai_chat_create
+from helpers.llm_wrappers import call_openai_embeddings, call_openai_chat_parse, call_openai_chat_create, call_openai_chat_stream
+from helpers.openai_client import get_openai_client
+from helpers.embedding_storage import embedding_request_kwargs
+from helpers.embedding_cache import get_cached_embeddings, store_embeddings, normalize_text
 from models.llm_models import BvaDecisionStructuredSummary
 import decimal
 
@@ -25,12 +28,14 @@ import decimal
 # ====================================================
 
 # Set up the OpenAI API key to interact with the GPT models
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY"),  # This is the default and can be omitted
-)
+client = get_openai_client()
 if not client:
     raise ValueError("Please set the VA_AUTOMATION_API_KEY environment variable.")
 
+# gpt-4o pricing used by the streaming helpers (same rates as call_openai_chat_create)
+GPT4O_PROMPT_TOKEN_COST = decimal.Decimal("0.0000025")    # $2.50 per 1M
+GPT4O_COMPLETION_TOKEN_COST = decimal.Decimal("0.00001")  # $10.00 per 1M
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -40,24 +45,28 @@ logger = logging.getLogger(__name__)
 
 # ============  TESTING  ============
 # ============  WRAPPED  ============
+def build_summary_messages(text_content: str) -> list:
+    """Messages for generate_summary / stream_summary."""
+    report_prompt_text = f"Please provide a concise summary of the following document:\n\n{text_content}"
+    return [
+        {"role": "assistant", "content": "You are a helpful assistant that summarizes documents."},
+        {"role": "user", "content": report_prompt_text}
+    ]
+
 def generate_summary(user_id: int, text_content: str) -> str:
     """
     Generate a summary of the text content using GPT-4 (or GPT-4o-mini),
     logging usage in openai_usage_logs via the call_openai_chat_create wrapper.
     """
     try:
-        report_prompt_text = f"Please provide a concise summary of the following document:\n\n{text_content}"
-
-        messages = [
-            {"role": "assistant", "content": "You are a helpful assistant that summarizes documents."},
-            {"role": "user", "content": report_prompt_text}
-        ]
+        messages = build_summary_messages(text_content)
 
         # 1) Call the wrapper instead of client.chat.completions.create
         response = call_openai_chat_create(
             user_id=user_id,
             model="gpt-4o",
-            messages=messages
+            messages=messages,
+            call_site="generate_summary"
             # you can pass temperature=0 if you want or other kwargs
         )
 
@@ -70,12 +79,36 @@ def generate_summary(user_id: int, text_content: str) -> str:
         print(e)
         raise e
 
+def stream_summary(user_id: int, text_content: str):
+    """
+    Streaming variant of generate_summary: yields the summary text as it is
+    generated. Usage is logged by call_openai_chat_stream when the stream ends.
+    """
+    return call_openai_chat_stream(
+        user_id=user_id,
+        model="gpt-4o",
+        messages=build_summary_messages(text_content),
+        cost_per_prompt_token=GPT4O_PROMPT_TOKEN_COST,
+        cost_per_completion_token=GPT4O_COMPLETION_TOKEN_COST,
+        call_site="stream_summary"
+    )
+
+EMBEDDING_MODEL = "text-embedding-3-large"
+
+def _embedding_dimensions() -> int:
+    return embedding_request_kwargs().get("dimensions", 3072)
+
 def generate_embedding(user_id: int, combined_text: str):
     """
     Generates an embedding vector for the given text using OpenAI's API,
     and logs usage via the call_openai_embeddings wrapper.
+    Texts already in the embedding cache are returned without an API call.
     """
     try:
+        cached = get_cached_embeddings(EMBEDDING_MODEL, _embedding_dimensions(), [combined_text])[0]
+        if cached is not None:
+            return cached
+
         # For "text-embedding-3-large", let's assume $0.130 / 1M tokens => 0.00000013 each
         cost_rate = decimal.Decimal("0.00000013")
 
@@ -83,17 +116,78 @@ def generate_embedding(user_id: int, combined_text: str):
         response = call_openai_embeddings(
             user_id=user_id,
             input_text=combined_text,
-            model="text-embedding-3-large",
-            cost_per_token=cost_rate
+            model=EMBEDDING_MODEL,
+            cost_per_token=cost_rate,
+            call_site="generate_embedding",
+            **embedding_request_kwargs()
         )
 
         # 2) Extract the embedding vector
         embedding = response.data[0].embedding
+        store_embeddings(EMBEDDING_MODEL, _embedding_dimensions(), [combined_text], [embedding])
         return embedding
     except Exception as e:
         print(f"OpenAI API error: {e}")
         raise
 
+# The embeddings endpoint accepts up to 2048 inputs and ~300k tokens per request;
+# batches are cut below both limits (tokens estimated at ~4 characters each).
+EMBEDDING_BATCH_MAX_INPUTS = int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", "2048"))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "250000"))
+
+def _embedding_batches(texts: List[str]):
+    """Yields (start_index, texts) slices that respect the per-request input and token limits."""
+    start, batch, batch_tokens = 0, [], 0
+    for i, text in enumerate(texts):
+        tokens = len(text) // 4 + 1
+        if batch and (len(batch) >= EMBEDDING_BATCH_MAX_INPUTS or batch_tokens + tokens > EMBEDDING_BATCH_MAX_TOKENS):
+            yield start, batch
+            start, batch, batch_tokens = i, [], 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        yield start, batch
+
+def generate_embeddings_batch(user_id: int, texts: List[str]) -> List[list]:
+    """
+    Batched counterpart of generate_embedding: embeds all `texts` in as few
+    requests as the API limits allow and returns the vectors in input order.
+    Usage is logged once per request (not once per text) by call_openai_embeddings.
+    Cached texts are skipped, and repeated texts within the batch are sent once.
+    """
+    cost_rate = decimal.Decimal("0.00000013")  # text-embedding-3-large, $0.130 / 1M tokens
+    dimensions = _embedding_dimensions()
+    embeddings = get_cached_embeddings(EMBEDDING_MODEL, dimensions, texts)
+
+    # Texts still to embed, one per cache key (normalized text), and the positions each one fills
+    pending = {}
+    for i, (text, vector) in enumerate(zip(texts, embeddings)):
+        if vector is None:
+            pending.setdefault(normalize_text(text), (text, []))[1].append(i)
+    unique_texts = [text for text, _ in pending.values()]
+
+    for start, batch in _embedding_batches(unique_texts):
+        response = call_openai_embeddings(
+            user_id=user_id,
+            input_text=batch,
+            model=EMBEDDING_MODEL,
+            cost_per_token=cost_rate,
+            call_site="generate_embeddings_batch",
+            **embedding_request_kwargs()
+        )
+        # response.data is ordered by index, but map explicitly to be safe
+        batch_vectors = [None] * len(batch)
+        for item in response.data:
+            batch_vectors[item.index] = item.embedding
+        for text, vector in zip(batch, batch_vectors):
+            for i in pending[normalize_text(text)][1]:
+                embeddings[i] = vector
+        store_embeddings(EMBEDDING_MODEL, dimensions, batch, batch_vectors)
+        logging.info(f"Embedded batch of {len(batch)} texts (offset {start})")
+
+    logging.info(f"Embeddings: {len(texts) - sum(len(p) for _, p in pending.values())} of {len(texts)} served from cache")
+    return embeddings
+
 def structured_summarize_bva_decision_llm(user_id: int, decision_citation: str, full_text: str):
     """
     Uses the Beta Chat parse endpoint to summarize a BVA decision, 
@@ -123,7 +217,8 @@ def structured_summarize_bva_decision_llm(user_id: int, decision_citation: str,
             messages=messages,
             response_format=BvaDecisionStructuredSummary,
             cost_per_prompt_token=prompt_rate,
-            cost_per_completion_token=completion_rate
+            cost_per_completion_token=completion_rate,
+            call_site="structured_summarize_bva_decision_llm"
         )
 
         # 2) Extract the structured info
@@ -136,17 +231,9 @@ def structured_summarize_bva_decision_llm(user_id: int, decision_citation: str,
 
     # Global variable to store progress messages
 
-def generate_cheat_sheet_response(user_id: int, text_content: str) -> str:
-    """
-    Generates a personalized cheat-sheet for C&P exam preparation using GPT-4,
-    logging usage via call_openai_chat_create.
-
-    :param user_id: Integer user ID for billing/usage logging.
-    :param text_content: The user's input text or evidence data.
-    :return: A summary string (the final cheat-sheet).
-    """
-    try:
-        assistant_prompt = f"""
+def build_cheat_sheet_messages(text_content: str) -> list:
+    """Messages for generate_cheat_sheet_response / stream_cheat_sheet_response."""
+    assistant_prompt = f"""
         You are a subject-matter expert in VA disability claims and C&P (Compensation & Pension) exams. Your task is to generate a personalized, last-minute, anxiety-relieving, easy-to-understand guide for a veteran attending a C&P exam. The guide must focus on helping the veteran articulate symptoms and understand how their condition may relate to VA disability ratings. 
 
         The payload includes specific evidence provided by the veteran, including diagnoses, relevant dates, and detailed information about their symptoms. Use this evidence to make the guide highly relevant and actionable (Provide exact dates, doctors, and diagnosis, and treatments from the evidence). Here are the specific requirements:
@@ -223,11 +310,23 @@ def generate_cheat_sheet_response(user_id: int, text_content: str) -> str:
 
         Use the provided input to tailor the guide to the veteran’s unique conditions and evidence.
         """
-       # Build the messages
-        messages = [
-            {"role": "assistant", "content": assistant_prompt},
-            {"role": "user", "content": text_content}
-        ]
+    return [
+        {"role": "assistant", "content": assistant_prompt},
+        {"role": "user", "content": text_content}
+    ]
+
+def generate_cheat_sheet_response(user_id: int, text_content: str) -> str:
+    """
+    Generates a personalized cheat-sheet for C&P exam preparation using GPT-4,
+    logging usage via call_openai_chat_create.
+
+    :param user_id: Integer user ID for billing/usage logging.
+    :param text_content: The user's input text or evidence data.
+    :return: A summary string (the final cheat-sheet).
+    """
+    try:
+        # Build the messages
+        messages = build_cheat_sheet_messages(text_content)
 
         # 1) Use the usage-logging chat wrapper
         response = call_openai_chat_create(
@@ -235,7 +334,8 @@ def generate_cheat_sheet_response(user_id: int, text_content: str) -> str:
             model="gpt-4o",
             messages=messages,
             temperature=0,  # Deterministic output
-            top_p=1
+            top_p=1,
+            call_site="generate_cheat_sheet_response"
         )
 
         # 2) Extract the final cheat-sheet text
@@ -246,6 +346,37 @@ def generate_cheat_sheet_response(user_id: int, text_content: str) -> str:
         logging.error(f"Error generating cheat sheet: {str(e)}")
         raise
 
+def stream_cheat_sheet_response(user_id: int, text_content: str):
+    """
+    Streaming variant of generate_cheat_sheet_response: yields the cheat-sheet
+    text as it is generated, logging usage when the stream ends.
+    """
+    return call_openai_chat_stream(
+        user_id=user_id,
+        model="gpt-4o",
+        messages=build_cheat_sheet_messages(text_content),
+        cost_per_prompt_token=GPT4O_PROMPT_TOKEN_COST,
+        cost_per_completion_token=GPT4O_COMPLETION_TOKEN_COST,
+        temperature=0,  # Deterministic output
+        top_p=1,
+        call_site="stream_cheat_sheet_response"
+    )
+
+def build_claim_messages(text_content: str) -> list:
+    """Messages for generate_claim_response / stream_claim_response."""
+    assistant_prompt = f"""
+        Please do not include a subject heading or a signoff like best, respectfully with a veteran name. Its a statement.
+        Write a statement in support of my VA claim, using a first-person perspective. The goal of this statement is to assist VA raters and Compensation & Pension (C&P) examiners in understanding the evidence in my in-service records that support an in-service event or injury. In the statement, please include the following details:
+        Clearly outline the in-service event, symptoms, or incident that occurred, based on documented evidence.
+        Describe the treatments I received at the time, any medical professionals notes, and findings documented in my service records.
+        Explain how these findings and treatments support a connection to my current medical conditions.
+        Use language that is factual yet compassionate, highlighting the impact of the service-connected event on my health.
+        The tone should be respectful, sincere, and clear, ensuring that my statement helps VA raters and C&P examiners see the link between my service record evidence and my current disability claim. Check the in_service boolean and based on whats in_service or not in_service that should help connect current (no inservice) conditions to in_service conditions. Be sure to mention both if they are availalbe. If only in_service treatment = True is in the text then explain simplily that the veteran still has symptoms and would like a C&P exam. But if in_service:True and in_service: False are in the text do not request C&P exam."""
+    return [
+        {"role": "assistant", "content": assistant_prompt},
+        {"role": "user", "content": text_content}
+    ]
+
 def generate_claim_response(user_id: int, text_content: str) -> str:
     """
     Generates a statement in support of a VA claim, using GPT-4,
@@ -256,25 +387,15 @@ def generate_claim_response(user_id: int, text_content: str) -> str:
     :return: A string containing the final generated statement.
     """
     try:
-        assistant_prompt = f"""
-        Please do not include a subject heading or a signoff like best, respectfully with a veteran name. Its a statement.
-        Write a statement in support of my VA claim, using a first-person perspective. The goal of this statement is to assist VA raters and Compensation & Pension (C&P) examiners in understanding the evidence in my in-service records that support an in-service event or injury. In the statement, please include the following details:
-        Clearly outline the in-service event, symptoms, or incident that occurred, based on documented evidence.
-        Describe the treatments I received at the time, any medical professionals notes, and findings documented in my service records.
-        Explain how these findings and treatments support a connection to my current medical conditions.
-        Use language that is factual yet compassionate, highlighting the impact of the service-connected event on my health.
-        The tone should be respectful, sincere, and clear, ensuring that my statement helps VA raters and C&P examiners see the link between my service record evidence and my current disability claim. Check the in_service boolean and based on whats in_service or not in_service that should help connect current (no inservice) conditions to in_service conditions. Be sure to mention both if they are availalbe. If only in_service treatment = True is in the text then explain simplily that the veteran still has symptoms and would like a C&P exam. But if in_service:True and in_service: False are in the text do not request C&P exam."""
-        messages = [
-            {"role": "assistant", "content": assistant_prompt},
-            {"role": "user", "content": text_content}
-        ]
+        messages = build_claim_messages(text_content)
 
         # 1) Use the chat wrapper
         response = call_openai_chat_create(
             user_id=user_id,
             model="gpt-4o",
             messages=messages,
-            max_tokens=2000
+            max_tokens=2000,
+            call_site="generate_claim_response"
         )
 
         # 2) Extract and return the final statement
@@ -285,6 +406,21 @@ def generate_claim_response(user_id: int, text_content: str) -> str:
         logging.error(f"Error generating claim response: {str(e)}")
         raise e
 
+def stream_claim_response(user_id: int, text_content: str):
+    """
+    Streaming variant of generate_claim_response: yields the statement text as
+    it is generated, logging usage when the stream ends.
+    """
+    return call_openai_chat_stream(
+        user_id=user_id,
+        model="gpt-4o",
+        messages=build_claim_messages(text_content),
+        cost_per_prompt_token=GPT4O_PROMPT_TOKEN_COST,
+        cost_per_completion_token=GPT4O_COMPLETION_TOKEN_COST,
+        max_tokens=2000,
+        call_site="stream_claim_response"
+    )
+
 def process_document_based_on_type(user_id: int, document_text: str, document_type):
     """
     Uses the Beta Chat parse wrapper to extract structured info 
@@ -323,7 +459,9 @@ def process_document_based_on_type(user_id: int, document_text: str, document_ty
                 response_format=response_format,
                 cost_per_prompt_token=prompt_rate,
                 cost_per_completion_token=completion_rate,
-                temperature=temp
+                temperature=temp,
+                call_site="process_document_based_on_type",
+                hedge=True
             )
             return completion.choices[0].message.parsed
 
@@ -509,7 +647,9 @@ def process_batch(user_id: int, start_idx: int, texts: List[str]) -> List[PageCl
             messages=messages,
             response_format=PageClassifications,
             cost_per_prompt_token=prompt_rate,
-            cost_per_completion_token=completion_rate
+            cost_per_completion_token=completion_rate,
+            call_site="process_batch",
+            hedge=True
         )
 
         message = completion.choices[0].message
@@ -561,7 +701,8 @@ def detect_document_type(user_id: int, text: str):
             messages=messages,
             response_format=PageClassification,
             cost_per_prompt_token=prompt_rate,      # new rate for input tokens
-            cost_per_completion_token=completion_rate   # new rate for output tokens
+            cost_per_completion_token=completion_rate,   # new rate for output tokens
+            call_site="detect_document_type"
         )
 
         # Extract the structured classification
@@ -572,6 +713,48 @@ def detect_document_type(user_id: int, text: str):
         print(f"Error detecting document type: {e}")
         raise
 
+def build_report_messages(svc_diag: str, post_diag: str) -> list:
+    """Messages for generate_report / stream_report."""
+    report_template = """
+    ---
+    **Summary of In-Service Diagnoses**
+    The in-service medical records document the following diagnoses:
+    {in_service_diagnoses}
+    
+    **Summary of Post-Service Diagnoses**
+    The post-service medical records document the following diagnoses:
+    {post_service_diagnoses}
+
+    **Recommendations for Disabilities to Claim**
+    Based on the analysis, the veteran should consider filing claims for the following disabilities:
+    {recommendations}
+
+    **Establishing Nexus Through Medications or Medical Events**
+    - **Medications:**
+    - Document any medications prescribed during service for the diagnosed conditions.
+    - Note any long-term side effects or conditions resulting from medication use.
+
+    - **Medical Events:**
+    - Highlight specific incidents (e.g., injury, exposure to trauma) with detailed descriptions.
+    - Provide incident reports or buddy statements as evidence.
+
+    ---
+    """
+
+    # Build the prompt
+    report_prompt_text = (
+        "You are a 20-year expert in Veterans Affairs claim consultancy. "
+        "Below are two datasets: in-service diagnoses and post-service diagnoses. "
+        "Please draft a final report analyzing potential connections between them. "
+        " :::::::::  In-Service Diagnoses:\n{svc} :::::::::  "
+        "\n :::::::::  Post-Service Diagnoses:\n{post} :::::::::  "
+    ).format(svc=svc_diag, post=post_diag)
+
+    return [
+        {"role": "assistant", "content": "You are an expert Veterans Affairs Claim Consultant"},
+        {"role": "user", "content": report_prompt_text}
+    ]
+
 def generate_report(user_id: int, svc_diag: str, post_diag: str) -> str:
     """
     Generates a final report analyzing in-service and post-service diagnoses,
@@ -583,51 +766,14 @@ def generate_report(user_id: int, svc_diag: str, post_diag: str) -> str:
     :return: A string containing the final GPT-generated report
     """
     try:
-        report_template = """
-        ---
-        **Summary of In-Service Diagnoses**
-        The in-service medical records document the following diagnoses:
-        {in_service_diagnoses}
-        
-        **Summary of Post-Service Diagnoses**
-        The post-service medical records document the following diagnoses:
-        {post_service_diagnoses}
-
-        **Recommendations for Disabilities to Claim**
-        Based on the analysis, the veteran should consider filing claims for the following disabilities:
-        {recommendations}
-
-        **Establishing Nexus Through Medications or Medical Events**
-        - **Medications:**
-        - Document any medications prescribed during service for the diagnosed conditions.
-        - Note any long-term side effects or conditions resulting from medication use.
-
-        - **Medical Events:**
-        - Highlight specific incidents (e.g., injury, exposure to trauma) with detailed descriptions.
-        - Provide incident reports or buddy statements as evidence.
-
-        ---
-        """
-
-        # Build the prompt
-        report_prompt_text = (
-            "You are a 20-year expert in Veterans Affairs claim consultancy. "
-            "Below are two datasets: in-service diagnoses and post-service diagnoses. "
-            "Please draft a final report analyzing potential connections between them. "
-            " :::::::::  In-Service Diagnoses:\n{svc} :::::::::  "
-            "\n :::::::::  Post-Service Diagnoses:\n{post} :::::::::  "
-        ).format(svc=svc_diag, post=post_diag)
-
-        messages = [
-            {"role": "assistant", "content": "You are an expert Veterans Affairs Claim Consultant"},
-            {"role": "user", "content": report_prompt_text}
-        ]
+        messages = build_report_messages(svc_diag, post_diag)
 
         # 1) Call your chat wrapper instead of direct client call
         response = call_openai_chat_create(
             user_id=user_id,
             model="gpt-4o",
-            messages=messages
+            messages=messages,
+            call_site="generate_report"
             # Add other kwargs like temperature, max_tokens if desired
         )
 
@@ -639,6 +785,20 @@ def generate_report(user_id: int, svc_diag: str, post_diag: str) -> str:
         logging.error(f"Error generating report: {e}")
         raise
 
+def stream_report(user_id: int, svc_diag: str, post_diag: str):
+    """
+    Streaming variant of generate_report: yields the report text as it is
+    generated, logging usage when the stream ends.
+    """
+    return call_openai_chat_stream(
+        user_id=user_id,
+        model="gpt-4o",
+        messages=build_report_messages(svc_diag, post_diag),
+        cost_per_prompt_token=GPT4O_PROMPT_TOKEN_COST,
+        cost_per_completion_token=GPT4O_COMPLETION_TOKEN_COST,
+        call_site="stream_report"
+    )
+
 def classify_and_store_diagnosis(user_id: int, pages_text: dict, prompt_text: str, model="gpt-4o") -> dict:
     """
     Processes text for each page, classifies medical conditions, and stores the results
@@ -667,7 +827,8 @@ def classify_and_store_diagnosis(user_id: int, pages_text: dict, prompt_text: st
                 messages=[
                     {"role": "system", "content": "You are a helpful VA claims assistant designed to output JSON."},
                     {"role": "user", "content": prompt}
-                ]
+                ],
+                call_site="classify_and_store_diagnosis"
             )
 
             # Store the classification result from the model's response
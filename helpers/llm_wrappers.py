@@ -1,27 +1,154 @@
 # llm_wrappers.py
 
 import decimal
+import random
+import time
 from datetime import datetime
 from flask import g
-from openai import OpenAI
-from models.sql_models import Users, OpenAIUsageLog
+from openai import RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+from sqlalchemy import update, func
+from sqlalchemy.dialects.postgresql import insert
+from models.sql_models import Users, OpenAIUsageLog, UserDailyUsage
 import os
 from database.session import ScopedSession
+from helpers.openai_client import get_openai_client
+from helpers.metrics_helpers import llm_request_latency, llm_retries, llm_errors, record_llm_tokens
+from helpers.hedge_helpers import LLM_HEDGING_ENABLED, latency_tracker, call_hedged
+
+# Retries are handled in _call_with_retries (instead of inside the OpenAI client)
+# so that every retry is visible in the llm_retries_total metric.
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+client = get_openai_client(max_retries=0)
+
+
+def record_usage(db_session, user, model: str, prompt_tokens: int, completion_tokens: int, total_tokens: int, cost):
+    """
+    Logs one OpenAI call: inserts the openai_usage_logs row, upserts today's
+    user_daily_usage rollup, and updates the user's credits and total_tokens_used.
+    The caller commits.
+    """
+    now = datetime.utcnow()
+    db_session.add(OpenAIUsageLog(
+        user_id=user.user_id,
+        model=model,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=total_tokens,
+        cost=cost,
+        created_at=now
+    ))
+
+    stmt = insert(UserDailyUsage).values(
+        user_id=user.user_id,
+        usage_date=now.date(),
+        model=model,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=total_tokens,
+        cost=cost,
+        calls=1
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "usage_date", "model"],
+        set_={
+            "prompt_tokens": UserDailyUsage.prompt_tokens + stmt.excluded.prompt_tokens,
+            "completion_tokens": UserDailyUsage.completion_tokens + stmt.excluded.completion_tokens,
+            "total_tokens": UserDailyUsage.total_tokens + stmt.excluded.total_tokens,
+            "cost": UserDailyUsage.cost + stmt.excluded.cost,
+            "calls": UserDailyUsage.calls + 1,
+        }
+    )
+    db_session.execute(stmt)
+
+    # Increment in SQL: concurrent calls for the same user must not overwrite each other
+    db_session.execute(
+        update(Users)
+        .where(Users.user_id == user.user_id)
+        .values(
+            credits_remaining=Users.credits_remaining - total_tokens,
+            total_tokens_used=func.coalesce(Users.total_tokens_used, 0) + total_tokens,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db_session.expire(user, ["credits_remaining", "total_tokens_used"])
+
+
+def _retry_delay(attempt: int, error: Exception) -> float:
+    """
+    Seconds to wait before retry number `attempt`. Honours the Retry-After header
+    when OpenAI sends one, otherwise exponential backoff (0.5s, 1s, 2s ... capped at 8s) with jitter.
+    """
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), 60.0)
+        except ValueError:
+            pass
+    return min(0.5 * (2 ** (attempt - 1)), 8.0) * (1 - 0.25 * random.random())
+
+
+def _call_with_retries(operation: str, call_site: str, model: str, api_call, cancel_event=None, call_started=None, **kwargs):
+    """
+    Calls `api_call(**kwargs)`, retrying transient OpenAI errors, and records
+    latency, retry and error metrics labelled by call site and model.
+    `cancel_event` is set by the hedging logic when this attempt lost the race;
+    `call_started` is when the hedged logical call began, which the hedge
+    latency tracker measures from (defaults to this attempt's start).
+    """
+    start_time = time.perf_counter()
+    attempt = 0
+    while True:
+        try:
+            response = api_call(**kwargs)
+            now = time.perf_counter()
+            llm_request_latency.labels(call_site, model, operation).observe(now - start_time)
+            latency_tracker.observe(call_site, model, now - (call_started or start_time))
+            return response
+        except Exception as e:
+            llm_errors.labels(call_site, model, operation, type(e).__name__).inc()
+            cancelled = cancel_event is not None and cancel_event.is_set()
+            if cancelled or not isinstance(e, RETRYABLE_ERRORS) or attempt >= LLM_MAX_RETRIES:
+                raise
+            attempt += 1
+            llm_retries.labels(call_site, model, operation).inc()
+            time.sleep(_retry_delay(attempt, e))
+
+
+def _call_openai(operation: str, call_site: str, model: str, api_call, hedge: bool = False, **kwargs):
+    """
+    Entry point used by the wrappers below. When `hedge` is requested and
+    LLM_HEDGING_ENABLED is set, the call is hedged (see helpers/hedge_helpers.py).
+    """
+    if hedge and LLM_HEDGING_ENABLED:
+        return call_hedged(
+            call_site,
+            model,
+            lambda cancel_event, call_started, **kw: _call_with_retries(
+                operation, call_site, model, api_call, cancel_event=cancel_event, call_started=call_started, **kw
+            ),
+            **kwargs
+        )
+    return _call_with_retries(operation, call_site, model, api_call, **kwargs)
 
-api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key)
 
 def call_openai_chat_create(
     user_id: int,
     model: str,
     messages: list,
     temperature: float = 0.7,
+    call_site: str = "unknown",
+    hedge: bool = False,
     **kwargs
 ):
     """
     Wrapper for client.chat.completions.create(...) that logs usage in openai_usage_logs
     and updates the user's cost/credits.
     Blocks call if user does not have enough credits.
+    `call_site` labels the latency/token/retry metrics (e.g. "process_batch").
+    `hedge=True` opts the call into request hedging (only the winner is billed).
     """
     db_session = ScopedSession()
     try:
@@ -35,7 +162,12 @@ def call_openai_chat_create(
             raise ValueError("User does not have enough credits to proceed.")
 
         # 2) Call the OpenAI ChatCompletion endpoint
-        response = client.chat.completions.create(
+        response = _call_openai(
+            "chat_create",
+            call_site,
+            model,
+            client.chat.completions.create,
+            hedge=hedge,
             model=model,
             messages=messages,
             temperature=temperature,
@@ -52,6 +184,7 @@ def call_openai_chat_create(
             prompt_tokens = 0
             completion_tokens = 0
             total_tokens = 0
+        record_llm_tokens(call_site, model, prompt_tokens, completion_tokens)
 
         # 4) Calculate cost
         cost_per_prompt_token = decimal.Decimal("0.0000025")   # Example: $2.50 per 1M
@@ -61,20 +194,8 @@ def call_openai_chat_create(
         completion_cost = completion_tokens * cost_per_completion_token
         total_cost = prompt_cost + completion_cost
 
-        # 5) Insert usage log
-        usage_log = OpenAIUsageLog(
-            user_id=user_id,
-            model=model,
-            prompt_tokens=prompt_tokens,
-            completion_tokens=completion_tokens,
-            total_tokens=total_tokens,
-            cost=total_cost,
-            created_at=datetime.utcnow()
-        )
-        db_session.add(usage_log)
-
-        # 6) Update user credits
-        user.credits_remaining -= total_tokens
+        # 5) Log usage, update the daily rollup and the user's credits
+        record_usage(db_session, user, model, prompt_tokens, completion_tokens, total_tokens, total_cost)
 
         db_session.commit()
 
@@ -92,6 +213,8 @@ def call_openai_embeddings(
     input_text: str,
     model: str,
     cost_per_token: decimal.Decimal,
+    call_site: str = "unknown",
+    hedge: bool = False,
     **kwargs
 ):
     """
@@ -102,6 +225,9 @@ def call_openai_embeddings(
       4) Logs usage info in openai_usage_logs
       5) Updates user credits/cost
       6) Returns the raw response
+    `input_text` may also be a list of strings; the whole batch is then logged as one usage record.
+    `call_site` labels the latency/token/retry metrics (e.g. "generate_embedding").
+    `hedge=True` opts the call into request hedging (only the winner is billed).
     """
     db_session = ScopedSession()
     try:
@@ -115,7 +241,12 @@ def call_openai_embeddings(
             raise ValueError("User does not have enough credits to proceed.")
 
         # 2) Make the embeddings call
-        response = client.embeddings.create(
+        response = _call_openai(
+            "embeddings",
+            call_site,
+            model,
+            client.embeddings.create,
+            hedge=hedge,
             input=input_text,
             model=model,
             **kwargs
@@ -129,24 +260,13 @@ def call_openai_embeddings(
         else:
             prompt_tokens = 0
             total_tokens = 0
+        record_llm_tokens(call_site, model, prompt_tokens, 0)
 
         # 4) Calculate cost
         cost_for_this_call = total_tokens * cost_per_token
 
-        # 5) Insert usage log
-        usage_log = OpenAIUsageLog(
-            user_id=user_id,
-            model=model,
-            prompt_tokens=prompt_tokens,
-            completion_tokens=0,
-            total_tokens=total_tokens,
-            cost=cost_for_this_call,
-            created_at=datetime.utcnow()
-        )
-        db_session.add(usage_log)
-
-        # 6) Update user credits
-        user.credits_remaining -= total_tokens
+        # 5) Log usage, update the daily rollup and the user's credits
+        record_usage(db_session, user, model, prompt_tokens, 0, total_tokens, cost_for_this_call)
 
         db_session.commit()
         return response
@@ -165,12 +285,16 @@ def call_openai_chat_parse(
     response_format,
     cost_per_prompt_token: decimal.Decimal,
     cost_per_completion_token: decimal.Decimal,
+    call_site: str = "unknown",
+    hedge: bool = False,
     **kwargs
 ):
     """
     A wrapper for client.beta.chat.completions.parse(...)
     Logs usage in openai_usage_logs and updates user’s credits or balance.
     Blocks call if user does not have enough credits.
+    `call_site` labels the latency/token/retry metrics (e.g. "process_document_based_on_type").
+    `hedge=True` opts the call into request hedging (only the winner is billed).
     """
     db_session = ScopedSession()
     try:
@@ -184,7 +308,12 @@ def call_openai_chat_parse(
             raise ValueError("User does not have enough credits to proceed.")
 
         # 2) Make the parse call
-        response = client.beta.chat.completions.parse(
+        response = _call_openai(
+            "chat_parse",
+            call_site,
+            model,
+            client.beta.chat.completions.parse,
+            hedge=hedge,
             model=model,
             messages=messages,
             response_format=response_format,
@@ -201,26 +330,15 @@ def call_openai_chat_parse(
             prompt_tokens = 0
             completion_tokens = 0
             total_tokens = 0
+        record_llm_tokens(call_site, model, prompt_tokens, completion_tokens)
 
         # 4) Calculate cost
         prompt_cost = prompt_tokens * cost_per_prompt_token
         completion_cost = completion_tokens * cost_per_completion_token
         total_cost = prompt_cost + completion_cost
 
-        # 5) Insert usage log
-        usage_log = OpenAIUsageLog(
-            user_id=user_id,
-            model=model,
-            prompt_tokens=prompt_tokens,
-            completion_tokens=completion_tokens,
-            total_tokens=total_tokens,
-            cost=total_cost,
-            created_at=datetime.utcnow()
-        )
-        db_session.add(usage_log)
-
-        # 6) Update user’s credits
-        user.credits_remaining -= total_tokens
+        # 5) Log usage, update the daily rollup and the user's credits
+        record_usage(db_session, user, model, prompt_tokens, completion_tokens, total_tokens, total_cost)
 
         db_session.commit()
         return response
@@ -230,3 +348,91 @@ def call_openai_chat_parse(
         raise
     finally:
         db_session.close()
+
+
+def _estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) used when a stream ends without usage."""
+    return (len(text) + 3) // 4 if text else 0
+
+
+def call_openai_chat_stream(
+    user_id: int,
+    model: str,
+    messages: list,
+    cost_per_prompt_token: decimal.Decimal,
+    cost_per_completion_token: decimal.Decimal,
+    temperature: float = 0.7,
+    call_site: str = "unknown",
+    **kwargs
+):
+    """
+    Streaming counterpart of call_openai_chat_create: a generator that yields
+    the completion's text deltas as they arrive.
+    Blocks call if user does not have enough credits.
+
+    Usage is logged once the stream ends. OpenAI sends the exact token counts
+    in the final chunk (stream_options.include_usage); if the client goes away
+    before that, prompt and completion tokens are estimated from the text so
+    that the partial generation is still billed.
+    """
+    db_session = ScopedSession()
+    try:
+        # 1) Retrieve user and check credits before opening the stream
+        user = db_session.query(Users).filter_by(user_id=user_id).first()
+        if not user:
+            raise ValueError(f"User not found (user_id={user_id}).")
+        if user.credits_remaining <= 0:
+            raise ValueError("User does not have enough credits to proceed.")
+    finally:
+        db_session.close()
+
+    # 2) Open the stream (retries only apply until the first byte arrives)
+    stream = _call_with_retries(
+        "chat_stream",
+        call_site,
+        model,
+        client.chat.completions.create,
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        stream=True,
+        stream_options={"include_usage": True},
+        **kwargs
+    )
+
+    # 3) Relay deltas, keeping the text in case usage never arrives
+    usage_obj = None
+    pieces = []
+    try:
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                usage_obj = chunk.usage
+            if chunk.choices:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    pieces.append(delta)
+                    yield delta
+    finally:
+        stream.close()
+
+        if usage_obj:
+            prompt_tokens = usage_obj.prompt_tokens
+            completion_tokens = usage_obj.completion_tokens
+        else:
+            prompt_tokens = sum(_estimate_tokens(str(m.get("content", ""))) for m in messages)
+            completion_tokens = _estimate_tokens("".join(pieces))
+        total_tokens = prompt_tokens + completion_tokens
+        record_llm_tokens(call_site, model, prompt_tokens, completion_tokens)
+
+        # 4) Log usage, update the daily rollup and the user's credits
+        total_cost = prompt_tokens * cost_per_prompt_token + completion_tokens * cost_per_completion_token
+        db_session = ScopedSession()
+        try:
+            user = db_session.query(Users).filter_by(user_id=user_id).first()
+            record_usage(db_session, user, model, prompt_tokens, completion_tokens, total_tokens, total_cost)
+            db_session.commit()
+        except Exception as e:
+            db_session.rollback()
+            print(f"[ERROR] Failed to log streamed usage for user_id={user_id}: {e}")
+        finally:
+            db_session.close()
@@ -0,0 +1,199 @@
+# helpers/metrics_helpers.py
+#
+# Prometheus metrics shared by the Flask app and the Celery workers.
+#
+# Both gunicorn and the Celery prefork pool run several processes, so when
+# PROMETHEUS_MULTIPROC_DIR is set the metrics are written to that directory
+# and aggregated at scrape time by a MultiProcessCollector.
+
+import os
+import logging
+from prometheus_client import (
+    Counter,
+    Gauge,
+    Histogram,
+    CollectorRegistry,
+    REGISTRY,
+    multiprocess,
+    start_http_server,
+)
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# LLM calls range from ~100ms (embeddings) to a minute (long gpt-4o completions)
+LLM_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 45, 60, 90, 120)
+
+# ====================================================
+# Section: LLM METRICS
+# ====================================================
+llm_request_latency = Histogram(
+    "llm_request_latency_seconds",
+    "Latency of OpenAI calls made through llm_wrappers, including retries.",
+    ["call_site", "model", "operation"],
+    buckets=LLM_LATENCY_BUCKETS,
+)
+
+llm_tokens = Counter(
+    "llm_tokens_total",
+    "Tokens consumed by OpenAI calls.",
+    ["call_site", "model", "token_type"],
+)
+
+llm_retries = Counter(
+    "llm_retries_total",
+    "Retries of OpenAI calls after a transient error.",
+    ["call_site", "model", "operation"],
+)
+
+llm_errors = Counter(
+    "llm_errors_total",
+    "Errors raised by OpenAI calls, labelled by exception class.",
+    ["call_site", "model", "operation", "error_class"],
+)
+
+llm_hedges = Counter(
+    "llm_hedges_total",
+    "Hedged OpenAI calls: duplicates fired (or skipped) and which request won.",
+    ["call_site", "model", "outcome"],
+)
+
+# Billed by OpenAI but never logged in openai_usage_logs: users are only charged for the winner
+llm_hedge_abandoned_tokens = Counter(
+    "llm_hedge_abandoned_tokens_total",
+    "Tokens of hedged OpenAI attempts that completed after losing the race.",
+    ["call_site", "model", "token_type"],
+)
+
+embedding_cache_lookups = Counter(
+    "embedding_cache_lookups_total",
+    "Embedding cache lookups by result (memory_hit, db_hit, miss).",
+    ["model", "result"],
+)
+
+tag_alias_lookups = Counter(
+    "tag_alias_lookups_total",
+    "Condition-to-tag alias lookups by result (hit, miss).",
+    ["result"],
+)
+
+
+def record_llm_tokens(call_site, model, prompt_tokens, completion_tokens):
+    """Adds the prompt/completion token counts of a single call to llm_tokens_total."""
+    if prompt_tokens:
+        llm_tokens.labels(call_site, model, "prompt").inc(prompt_tokens)
+    if completion_tokens:
+        llm_tokens.labels(call_site, model, "completion").inc(completion_tokens)
+
+
+# ====================================================
+# Section: DIAGNOSIS QUEUE METRICS
+# ====================================================
+# livesum: summed over the live worker processes when scraped in multiprocess mode
+diagnosis_queue_depth = Gauge(
+    "diagnosis_queue_depth",
+    "Diagnoses waiting in the per-process diagnosis queue.",
+    multiprocess_mode="livesum",
+)
+
+diagnosis_in_flight = Gauge(
+    "diagnosis_in_flight",
+    "Diagnoses currently being processed by diagnosis queue threads.",
+    multiprocess_mode="livesum",
+)
+
+
+# ====================================================
+# Section: CELERY TASK METRICS
+# ====================================================
+# Queue depth and oldest-message age are collected from the broker at scrape
+# time (helpers/queue_metrics.py); these are recorded by the task signals in celery_app.py
+TASK_DURATION_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+celery_tasks_in_flight = Gauge(
+    "celery_tasks_in_flight",
+    "Celery tasks currently executing, by task and queue.",
+    ["task", "queue"],
+    multiprocess_mode="livesum",
+)
+
+celery_tasks = Counter(
+    "celery_tasks_total",
+    "Celery tasks finished, by task, queue and final state.",
+    ["task", "queue", "state"],
+)
+
+celery_task_duration = Histogram(
+    "celery_task_duration_seconds",
+    "Execution time of Celery tasks.",
+    ["task", "queue"],
+    buckets=TASK_DURATION_BUCKETS,
+)
+
+celery_task_queue_wait = Histogram(
+    "celery_task_queue_wait_seconds",
+    "Time between a Celery task becoming due (published, or its ETA/countdown) and a worker starting it.",
+    ["task", "queue"],
+    buckets=TASK_DURATION_BUCKETS,
+)
+
+# Observed once per worker process (helpers/worker_warmup.py); the count is
+# also the number of child processes started, i.e. how often they are recycled
+WARMUP_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)
+
+celery_worker_warmup = Histogram(
+    "celery_worker_warmup_seconds",
+    "Cold-start time of a Celery worker process, by warm-up step.",
+    ["step"],
+    buckets=WARMUP_BUCKETS,
+)
+
+
+# ====================================================
+# Section: EXPOSITION
+# ====================================================
+def get_metrics_registry():
+    """
+    Returns the registry to expose. In multiprocess mode a fresh registry is
+    built on every call so that the collector re-reads the per-process files.
+    """
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def clear_multiproc_dir():
+    """
+    Removes the per-process files left in PROMETHEUS_MULTIPROC_DIR by a previous
+    run, whose old pids would otherwise be summed into the counters. Call once
+    in the parent process before any worker starts.
+    """
+    if not PROMETHEUS_MULTIPROC_DIR or not os.path.isdir(PROMETHEUS_MULTIPROC_DIR):
+        return
+    for name in os.listdir(PROMETHEUS_MULTIPROC_DIR):
+        if name.endswith(".db"):
+            try:
+                os.remove(os.path.join(PROMETHEUS_MULTIPROC_DIR, name))
+            except OSError as e:
+                logging.warning(f"Could not remove stale metrics file {name}: {e}")
+
+
+def start_metrics_server(port: int, collectors=()):
+    """
+    Starts a standalone HTTP exporter (used by the Celery worker main process
+    and the gunicorn master, see gunicorn.conf.py).
+    `collectors` are registered on the exported registry, e.g. the broker
+    queue collector from helpers/queue_metrics.py.
+    """
+    registry = get_metrics_registry()
+    for collector in collectors:
+        registry.register(collector)
+    start_http_server(port, registry=registry)
+    logging.info(f"Prometheus metrics exporter listening on port {port}")
+
+
+def mark_process_dead(pid: int):
+    """Cleans up live gauges for a child process that has exited."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,197 @@
+# helpers/nexus_bulk.py
+#
+# Set-based nexus tag recompute across the whole user base.
+#
+# After a change to tag mappings or to how in_service is derived, every
+# user's nexus tags may be stale. Instead of calling discover_nexus_tags and
+# revoke_nexus_tags_if_invalid user by user through the ORM,
+# bulk_recompute_nexus walks the users in batches (keyset pagination on
+# user_id, optionally one shard of user_id % shards) and per batch:
+#   1. tries each user's nexus advisory lock (helpers/nexus_finalize.py) for
+#      the length of the transaction, so it never overlaps a pipeline recompute;
+#      users whose lock is held are skipped and reported in stats["skipped_users"]
+#      (rerun them with `flask recompute-nexus-tags --full`),
+#   2. aggregates the locked users' conditions by (user, tag) into a temp table,
+#   3. inserts the newly qualified tags in one INSERT ... ON CONFLICT DO NOTHING
+#      against the partial unique index on active rows (migrations/009),
+#   4. revokes the active rows that no longer qualify in one UPDATE,
+#   5. optionally rewrites user_tag_counts from the same aggregate. The nexus
+#      lock does not block condition writes, so this is refused unless
+#      NEXUS_MAINTENANCE_MODE=true confirms uploads and processing are stopped.
+# Throttling: every statement runs with BULK_NEXUS_STATEMENT_TIMEOUT and
+# BULK_NEXUS_LOCK_TIMEOUT, and after each batch the job sleeps long enough to
+# keep its share of wall time at or below `max_duty`.
+# Progress (users done, rows changed, rate, last user_id for --start-after)
+# is logged and passed to an optional callback after every batch.
+
+import os
+import time
+import logging
+from sqlalchemy import text
+from database.session import SessionFactory
+from helpers.nexus_finalize import NEXUS_LOCK_NAMESPACE
+
+BULK_NEXUS_STATEMENT_TIMEOUT = os.getenv("BULK_NEXUS_STATEMENT_TIMEOUT", "30s")
+BULK_NEXUS_LOCK_TIMEOUT = os.getenv("BULK_NEXUS_LOCK_TIMEOUT", "5s")
+NEXUS_MAINTENANCE_MODE = os.getenv("NEXUS_MAINTENANCE_MODE", "false").lower() == "true"
+
+NEXT_USERS_SQL = text("""
+    SELECT user_id FROM users
+    WHERE user_id > :after AND user_id % :shards = :shard
+    ORDER BY user_id
+    LIMIT :limit
+""")
+
+# Never waits: a user whose lock is held by a pipeline recompute is skipped
+TRY_LOCK_USERS_SQL = text("""
+    SELECT user_id, pg_try_advisory_xact_lock(:ns, user_id) AS locked
+    FROM unnest(CAST(:user_ids AS integer[])) AS user_id
+    ORDER BY user_id
+""")
+
+AGGREGATE_SQL = text("""
+    CREATE TEMP TABLE nexus_bulk_counts ON COMMIT DROP AS
+    SELECT c.user_id,
+           ct.tag_id,
+           count(*) FILTER (WHERE c.in_service IS TRUE)  AS in_service_count,
+           count(*) FILTER (WHERE c.in_service IS FALSE) AS post_service_count
+    FROM conditions c
+    JOIN condition_tags ct ON ct.condition_id = c.condition_id
+    WHERE c.user_id = ANY(CAST(:user_ids AS integer[]))
+    GROUP BY c.user_id, ct.tag_id
+""")
+
+DISCOVER_SQL = text("""
+    INSERT INTO nexus_tags (user_id, tag_id)
+    SELECT user_id, tag_id
+    FROM nexus_bulk_counts
+    WHERE in_service_count > 0 AND post_service_count > 0
+    ON CONFLICT (user_id, tag_id) WHERE revoked_at IS NULL DO NOTHING
+""")
+
+REVOKE_SQL = text("""
+    UPDATE nexus_tags n
+    SET revoked_at = now()
+    WHERE n.user_id = ANY(CAST(:user_ids AS integer[]))
+      AND n.revoked_at IS NULL
+      AND NOT EXISTS (
+          SELECT 1 FROM nexus_bulk_counts q
+          WHERE q.user_id = n.user_id AND q.tag_id = n.tag_id
+            AND q.in_service_count > 0 AND q.post_service_count > 0
+      )
+""")
+
+# Only safe while no conditions are being written for these users: a trigger
+# increment committed after the aggregate was taken would be overwritten.
+# Hence NEXUS_MAINTENANCE_MODE.
+REBUILD_COUNTS_SQL = (
+    text("""
+        DELETE FROM user_tag_counts u
+        WHERE u.user_id = ANY(CAST(:user_ids AS integer[]))
+          AND NOT EXISTS (
+              SELECT 1 FROM nexus_bulk_counts q WHERE q.user_id = u.user_id AND q.tag_id = u.tag_id
+          )
+    """),
+    text("""
+        INSERT INTO user_tag_counts (user_id, tag_id, in_service_count, post_service_count, needs_nexus_check)
+        SELECT user_id, tag_id, in_service_count, post_service_count, false
+        FROM nexus_bulk_counts
+        ON CONFLICT (user_id, tag_id) DO UPDATE SET
+            in_service_count   = EXCLUDED.in_service_count,
+            post_service_count = EXCLUDED.post_service_count,
+            needs_nexus_check  = false
+    """),
+)
+
+
+def _recompute_batch(session, user_ids, rebuild_counts):
+    """
+    Runs one batch in the session's transaction, for the users whose nexus
+    lock it gets. Returns (discovered, revoked, skipped user_ids).
+    """
+    session.execute(text(f"SET LOCAL statement_timeout = '{BULK_NEXUS_STATEMENT_TIMEOUT}'"))
+    session.execute(text(f"SET LOCAL lock_timeout = '{BULK_NEXUS_LOCK_TIMEOUT}'"))
+    locks = session.execute(TRY_LOCK_USERS_SQL, {"ns": NEXUS_LOCK_NAMESPACE, "user_ids": user_ids}).all()
+    skipped = [row.user_id for row in locks if not row.locked]
+    user_ids = [row.user_id for row in locks if row.locked]
+    if not user_ids:
+        return 0, 0, skipped
+    session.execute(AGGREGATE_SQL, {"user_ids": user_ids})
+    discovered = session.execute(DISCOVER_SQL).rowcount
+    revoked = session.execute(REVOKE_SQL, {"user_ids": user_ids}).rowcount
+    if rebuild_counts:
+        for statement in REBUILD_COUNTS_SQL:
+            session.execute(statement, {"user_ids": user_ids})
+    return discovered, revoked, skipped
+
+
+def bulk_recompute_nexus(batch_size: int = 500, shard: int = 0, shards: int = 1,
+                         start_after: int = 0, max_duty: float = 0.5, min_sleep: float = 0.0,
+                         rebuild_counts: bool = False, dry_run: bool = False, progress=None):
+    """
+    Recomputes nexus tags for every user of the shard, `batch_size` users per
+    transaction. With dry_run=True each batch is rolled back, so the stats
+    are what would change. `progress(stats)` is called after every batch.
+    Users locked by a concurrent recompute are skipped and listed in
+    stats["skipped_users"]. rebuild_counts requires NEXUS_MAINTENANCE_MODE.
+    Returns the stats dict.
+    """
+    if not 0 < max_duty <= 1:
+        raise ValueError("max_duty must be in (0, 1]")
+    if not 0 <= shard < shards:
+        raise ValueError("shard must be in [0, shards)")
+    if rebuild_counts and not NEXUS_MAINTENANCE_MODE:
+        raise ValueError(
+            "rebuild_counts overwrites counters that triggers update concurrently; "
+            "stop uploads and processing and set NEXUS_MAINTENANCE_MODE=true first"
+        )
+
+    stats = {"batches": 0, "users": 0, "discovered": 0, "revoked": 0, "skipped_users": [], "last_user_id": start_after}
+    started = time.perf_counter()
+    session = SessionFactory()
+    try:
+        while True:
+            user_ids = [row[0] for row in session.execute(NEXT_USERS_SQL, {
+                "after": stats["last_user_id"], "shards": shards, "shard": shard, "limit": batch_size
+            })]
+            session.commit()
+            if not user_ids:
+                break
+
+            batch_started = time.perf_counter()
+            try:
+                discovered, revoked, skipped = _recompute_batch(session, user_ids, rebuild_counts)
+            except Exception:
+                session.rollback()
+                logging.exception(
+                    f"Bulk nexus recompute failed on users {user_ids[0]}..{user_ids[-1]}; "
+                    f"resume with start_after={stats['last_user_id']}"
+                )
+                raise
+            if dry_run:
+                session.rollback()
+            else:
+                session.commit()
+            batch_seconds = time.perf_counter() - batch_started
+
+            stats["batches"] += 1
+            stats["users"] += len(user_ids) - len(skipped)
+            stats["skipped_users"].extend(skipped)
+            stats["discovered"] += discovered
+            stats["revoked"] += revoked
+            stats["last_user_id"] = user_ids[-1]
+            stats["seconds"] = round(time.perf_counter() - started, 1)
+            stats["users_per_second"] = round(stats["users"] / max(stats["seconds"], 0.001), 1)
+            if skipped:
+                logging.warning(f"Bulk nexus recompute skipped users locked by a recompute: {skipped}")
+            logging.info(f"Bulk nexus recompute progress: {stats}")
+            if progress is not None:
+                progress(dict(stats))
+
+            # Keep the job's share of wall time at or below max_duty
+            time.sleep(max(min_sleep, batch_seconds * (1 - max_duty) / max_duty))
+    finally:
+        session.close()
+
+    stats["seconds"] = round(time.perf_counter() - started, 1)
+    return stats
@@ -0,0 +1,157 @@
+# helpers/nexus_finalize.py
+#
+# Coalesced, serialized nexus tag recomputes.
+#
+# Running the nexus recompute (sync_nexus_tags over the trigger-maintained
+# user_tag_counts) in the finalize_task of every file of a 10-file upload
+# repeats the same work 10 times, and concurrent runs can both insert the same
+# NexusTags row. Instead, each finalize_task calls
+# schedule_nexus_recompute(user_id), which:
+#   - writes a fresh token to nexus:debounce:<user_id> in Redis, and
+#   - schedules finalize_user_task(user_id, token) NEXUS_DEBOUNCE_SECONDS later.
+# A finalize_user_task whose token has been replaced by a later file does
+# nothing, as does one that finds other files of the user still processing
+# (their finalize schedules a new one), unless the burst has been waiting for
+# more than NEXUS_DEBOUNCE_MAX_WAIT_SECONDS. So one recompute runs after the
+# last file of a burst completes. The recompute itself holds a per-user
+# Postgres advisory lock (nexus_lock), so it never overlaps another recompute
+# for the same user, whether from the pipeline or from `flask retag-conditions`.
+#
+# If Redis is unreachable, the recompute runs immediately (still under the lock).
+
+import os
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+from functools import lru_cache
+import redis
+from sqlalchemy import text
+from database.session import engine, SessionFactory
+from helpers.sql_helpers import discover_nexus_tags, revoke_nexus_tags_if_invalid, sync_nexus_tags
+from models.sql_models import File
+
+NEXUS_REDIS_URL = os.getenv("NEXUS_REDIS_URL") or os.getenv("CELERY_BROKER_URL")
+NEXUS_DEBOUNCE_SECONDS = float(os.getenv("NEXUS_DEBOUNCE_SECONDS", "10"))
+NEXUS_DEBOUNCE_MAX_WAIT_SECONDS = float(os.getenv("NEXUS_DEBOUNCE_MAX_WAIT_SECONDS", "600"))
+
+# First key of the two-key form of pg_advisory_lock; the second is the user_id
+NEXUS_LOCK_NAMESPACE = 4701
+
+FINISHED_FILE_STATUSES = ('Complete', 'Failed')
+
+# Deletes the debounce keys only if they still hold this run's token
+_RELEASE_TOKEN_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1], KEYS[2])
+end
+return 0
+"""
+
+
+def _token_key(user_id) -> str:
+    return f"nexus:debounce:{user_id}"
+
+
+def _since_key(user_id) -> str:
+    return f"nexus:debounce:{user_id}:since"
+
+
+@lru_cache(maxsize=1)
+def get_nexus_redis():
+    """Redis client for the debounce tokens (the Celery broker unless NEXUS_REDIS_URL is set)."""
+    kwargs = {"ssl_cert_reqs": "required"} if NEXUS_REDIS_URL.startswith("rediss://") else {}
+    return redis.Redis.from_url(NEXUS_REDIS_URL, decode_responses=True, **kwargs)
+
+
+@contextmanager
+def nexus_lock(user_id):
+    """
+    Yields a session that holds the user's nexus advisory lock until the block
+    exits. The session is bound to one connection, so the lock survives the
+    session's commits.
+    """
+    with engine.connect() as connection:
+        params = {"ns": NEXUS_LOCK_NAMESPACE, "user_id": user_id}
+        connection.execute(text("SELECT pg_advisory_lock(:ns, :user_id)"), params)
+        connection.commit()
+        session = SessionFactory(bind=connection)
+        try:
+            yield session
+        finally:
+            session.close()
+            connection.rollback()
+            connection.execute(text("SELECT pg_advisory_unlock(:ns, :user_id)"), params)
+            connection.commit()
+
+
+def recompute_nexus_tags(user_id, full=False):
+    """
+    Updates the user's nexus tags under the per-user lock. By default only the
+    tags whose counters changed are looked at (sync_nexus_tags); full=True
+    re-aggregates the user's whole condition history instead, to repair drift.
+    """
+    started = time.perf_counter()
+    with nexus_lock(user_id) as session:
+        if full:
+            discover_nexus_tags(session, user_id)
+            revoke_nexus_tags_if_invalid(session, user_id)
+        else:
+            discovered, revoked = sync_nexus_tags(session, user_id)
+            logging.info(f"Nexus sync for user_id {user_id}: {discovered} discovered, {revoked} revoked")
+    logging.info(f"Recomputed nexus tags for user_id {user_id} in {time.perf_counter() - started:.2f}s")
+
+
+def schedule_nexus_recompute(user_id, task):
+    """
+    Debounces a nexus recompute for the user: (re)arms the user's token and
+    schedules `task` (finalize_user_task) to run with it after
+    NEXUS_DEBOUNCE_SECONDS. Returns the token, or None if the recompute ran
+    immediately because Redis was unavailable.
+    """
+    token = uuid.uuid4().hex
+    ttl = int(NEXUS_DEBOUNCE_MAX_WAIT_SECONDS + NEXUS_DEBOUNCE_SECONDS * 10)
+    try:
+        client = get_nexus_redis()
+        pipe = client.pipeline(transaction=True)
+        pipe.set(_token_key(user_id), token, ex=ttl)
+        pipe.set(_since_key(user_id), time.time(), ex=ttl, nx=True)
+        pipe.execute()
+    except Exception as e:
+        logging.warning(f"Nexus debounce unavailable for user_id {user_id}, recomputing now: {e}")
+        recompute_nexus_tags(user_id)
+        return None
+    task.apply_async(args=(user_id, token), countdown=NEXUS_DEBOUNCE_SECONDS)
+    return token
+
+
+def _files_in_flight(user_id) -> int:
+    session = SessionFactory()
+    try:
+        return (
+            session.query(File)
+            .filter(File.user_id == user_id, File.status.notin_(FINISHED_FILE_STATUSES))
+            .count()
+        )
+    finally:
+        session.close()
+
+
+def run_debounced_recompute(user_id, token) -> str:
+    """
+    Body of finalize_user_task. Returns what happened: "superseded",
+    "waiting" (other files still processing) or "recomputed".
+    """
+    client = get_nexus_redis()
+    if client.get(_token_key(user_id)) != token:
+        return "superseded"
+
+    since = float(client.get(_since_key(user_id)) or time.time())
+    if _files_in_flight(user_id) and time.time() - since < NEXUS_DEBOUNCE_MAX_WAIT_SECONDS:
+        return "waiting"
+
+    recompute_nexus_tags(user_id)
+    # A file that finalized during the recompute has re-armed the token and
+    # scheduled its own run, so only clear the keys if they are still ours
+    client.eval(_RELEASE_TOKEN_LUA, 2, _token_key(user_id), _since_key(user_id), token)
+    return "recomputed"
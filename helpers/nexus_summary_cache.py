@@ -0,0 +1,128 @@
+# helpers/nexus_summary_cache.py
+#
+# nexus_summaries as a cache for /generate_nexus_summary.
+#
+# Each active nexus tag has at most one NexusSummary row holding the last
+# generated statement and the condition_ids it was generated from. Both the
+# prompt and the key are built on the server from the tag's conditions
+# (nexus_conditions), never from what a client sends. A request whose
+# condition set matches the row, while needs_update is false, is answered
+# from the table with no LLM call. Triggers on conditions and condition_tags
+# (migrations/010_nexus_summary_cache.sql) set needs_update and bump
+# `version` whenever a condition linked to the tag is linked, unlinked,
+# deleted or has a column the prompt uses changed;
+# store_summary only clears the flag if the version is still the one read
+# before generating, so a change made mid-generation is not lost.
+#
+# With NEXUS_SUMMARY_BACKGROUND set, finalize_user_task queues
+# regenerate_nexus_summaries_task after a nexus recompute:
+#   off   (default) - summaries are only generated on request
+#   stale           - regenerate the user's existing summaries that need an update
+#   all             - also generate missing summaries for every active nexus tag
+
+import os
+import logging
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert
+from models.sql_models import NexusSummary, NexusTags, Conditions, condition_tags
+
+NEXUS_SUMMARY_BACKGROUND = os.getenv("NEXUS_SUMMARY_BACKGROUND", "off").lower()
+
+
+def condition_key(condition_ids) -> list:
+    """The cache key of a condition set: its sorted, de-duplicated ids."""
+    return sorted({int(cid) for cid in condition_ids})
+
+
+def get_or_create_summary(session, nexus_tags_id) -> NexusSummary:
+    """The nexus tag's summary row, created empty (needs_update) if missing."""
+    stmt = insert(NexusSummary).values(nexus_tags_id=nexus_tags_id, needs_update=True)
+    session.execute(stmt.on_conflict_do_nothing(index_elements=["nexus_tags_id"]))
+    return session.query(NexusSummary).filter_by(nexus_tags_id=nexus_tags_id).one()
+
+
+def cached_summary(session, nexus_tags_id, condition_ids):
+    """Returns the stored summary text if it is current for this condition set, else None."""
+    row = session.query(NexusSummary).filter_by(nexus_tags_id=nexus_tags_id).first()
+    if row is None or row.needs_update or not row.summary_text:
+        return None
+    if condition_key(row.condition_ids or []) != condition_key(condition_ids):
+        return None
+    return row.summary_text
+
+
+def store_summary(session, nexus_tags_id, condition_ids, summary_text, seen_version):
+    """
+    Saves a generated summary. needs_update is only cleared if the row's
+    version is still `seen_version` (read before generating). Commits.
+    """
+    session.execute(
+        update(NexusSummary)
+        .where(NexusSummary.nexus_tags_id == nexus_tags_id)
+        .values(
+            summary_text=summary_text,
+            condition_ids=condition_key(condition_ids),
+            needs_update=NexusSummary.version != seen_version,
+        )
+    )
+    session.commit()
+
+
+def nexus_conditions(session, nexus_tag) -> list:
+    """The user's conditions linked to the nexus tag, as summarized by /generate_nexus_summary (same shape as /feed_updates)."""
+    conditions = (
+        session.query(Conditions)
+        .join(condition_tags, condition_tags.c.condition_id == Conditions.condition_id)
+        .filter(condition_tags.c.tag_id == nexus_tag.tag_id, Conditions.user_id == nexus_tag.user_id)
+        .order_by(Conditions.condition_id)
+        .all()
+    )
+    return [
+        {
+            "condition_id": c.condition_id,
+            "condition_name": c.condition_name,
+            "date_of_visit": c.date_of_visit.isoformat() if c.date_of_visit else None,
+            "medical_professionals": c.medical_professionals,
+            "treatments": c.treatments,
+            "findings": c.findings,
+            "comments": c.comments,
+            "in_service": c.in_service,
+        }
+        for c in conditions
+    ]
+
+
+def regenerate_nexus_summaries(session, user_id, generate, include_missing=False):
+    """
+    Regenerates the user's stale summaries (and, with include_missing, creates
+    the missing ones) with `generate(user_id, text_content)`.
+    Returns the number of summaries generated.
+    """
+    query = (
+        session.query(NexusTags)
+        .outerjoin(NexusSummary, NexusSummary.nexus_tags_id == NexusTags.nexus_tags_id)
+        .filter(NexusTags.user_id == user_id, NexusTags.revoked_at.is_(None))
+    )
+    if include_missing:
+        query = query.filter((NexusSummary.nexus_summary_id.is_(None)) | NexusSummary.needs_update.is_(True))
+    else:
+        query = query.filter(NexusSummary.needs_update.is_(True))
+    nexus_tags = query.all()
+
+    generated = 0
+    for nexus_tag in nexus_tags:
+        nexus_tags_id = nexus_tag.nexus_tags_id
+        row = get_or_create_summary(session, nexus_tags_id)
+        seen_version = row.version
+        conditions_data = nexus_conditions(session, nexus_tag)
+        session.commit()  # don't hold a transaction open during the LLM call
+        if not conditions_data:
+            continue
+        try:
+            summary_text = generate(user_id, str(conditions_data))
+        except Exception as e:
+            logging.warning(f"Regenerating nexus summary {nexus_tags_id} for user_id {user_id} failed: {e}")
+            continue
+        store_summary(session, nexus_tags_id, [c["condition_id"] for c in conditions_data], summary_text, seen_version)
+        generated += 1
+    return generated
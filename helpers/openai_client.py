@@ -0,0 +1,28 @@
+# helpers/openai_client.py
+#
+# Single place where OpenAI clients are built. Setting OPENAI_STUB_ENABLED=true
+# points every client in the app (Flask routes, Celery workers, chatbot) at the
+# offline stand-in server in loadtest/openai_stub.py instead of api.openai.com.
+
+import os
+from functools import lru_cache
+from openai import OpenAI
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_STUB_ENABLED = os.getenv("OPENAI_STUB_ENABLED", "false").lower() == "true"
+OPENAI_STUB_URL = os.getenv("OPENAI_STUB_URL", "http://localhost:8089/v1")
+
+
+@lru_cache(maxsize=None)
+def get_openai_client(max_retries: int = 2) -> OpenAI:
+    """
+    Returns a shared OpenAI client. Clients are cached per `max_retries` so the
+    HTTP connection pool is reused across calls.
+    """
+    if OPENAI_STUB_ENABLED:
+        return OpenAI(
+            api_key=OPENAI_API_KEY or "stub-key",
+            base_url=OPENAI_STUB_URL,
+            max_retries=max_retries,
+        )
+    return OpenAI(api_key=OPENAI_API_KEY, max_retries=max_retries)
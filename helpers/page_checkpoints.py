@@ -0,0 +1,77 @@
+# helpers/page_checkpoints.py
+#
+# Durable per-page checkpoints for the extraction pipeline.
+#
+# OCR text, page classification and structured extraction are stored per
+# (file_id, page_number) in file_page_checkpoints as soon as each unit
+# finishes. When extraction_task is retried, read_and_extract_document loads
+# the checkpoints and only OCRs, classifies and extracts the pages that are
+# still missing, so a failure on page 780 of 800 does not re-run (and re-bill)
+# the first 779 pages. Each write uses its own short session, so checkpoints
+# survive the failure of the task that produced them.
+#
+# condition_idempotency_key gives every diagnosis of a file a stable key, so
+# a retried process_pages_task skips the conditions it already stored.
+
+import hashlib
+import logging
+from sqlalchemy.dialects.postgresql import insert
+from database.session import SessionFactory
+from models.sql_models import FilePageCheckpoint
+
+
+def condition_idempotency_key(file_id, page_number, visit_index, diagnosis_index, condition_name) -> str:
+    """Stable key for one diagnosis of one extracted visit."""
+    raw = f"{file_id}|{page_number}|{visit_index}|{diagnosis_index}|{condition_name}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def load_checkpoints(file_id, column):
+    """Returns {page_number: value} for the pages of the file where `column` is stored."""
+    session = SessionFactory()
+    try:
+        attr = getattr(FilePageCheckpoint, column)
+        rows = (
+            session.query(FilePageCheckpoint.page_number, attr)
+            .filter(FilePageCheckpoint.file_id == file_id, attr.isnot(None))
+            .all()
+        )
+        return {page_number: value for page_number, value in rows}
+    finally:
+        session.close()
+
+
+def save_checkpoints(file_id, column, values: dict):
+    """
+    Upserts {page_number: value} into `column`. Failures are logged, not
+    raised: a missing checkpoint only means the page is redone on retry.
+    """
+    if not values:
+        return
+    session = SessionFactory()
+    try:
+        stmt = insert(FilePageCheckpoint).values([
+            {"file_id": file_id, "page_number": page_number, column: value}
+            for page_number, value in values.items()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["file_id", "page_number"],
+            set_={column: getattr(stmt.excluded, column), "updated_at": stmt.excluded.updated_at}
+        )
+        session.execute(stmt)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logging.warning(f"Saving {column} checkpoints for file_id {file_id} failed: {e}")
+    finally:
+        session.close()
+
+
+def clear_checkpoints(file_id):
+    """Deletes every checkpoint of the file (after a successful run, or to force reprocessing)."""
+    session = SessionFactory()
+    try:
+        session.query(FilePageCheckpoint).filter(FilePageCheckpoint.file_id == file_id).delete()
+        session.commit()
+    finally:
+        session.close()
@@ -0,0 +1,136 @@
+# helpers/progress_events.py
+#
+# Push-based file processing progress.
+#
+# The Celery tasks publish fine-grained progress events (pages OCR'd, pages
+# classified and extracted, conditions found, status changes) to a per-user
+# Redis pub/sub channel. GET /documents/progress (routes/progress_routes.py)
+# relays them to the browser as server-sent events, so watching an upload
+# costs no database reads. The latest event of each file is also kept in a
+# per-user Redis hash, so a client that connects mid-run gets the current
+# state immediately.
+#
+# Event payloads, by stage:
+#   status:                          {"file_id": 42, "stage": "status", "status": "Finding Evidence", "ts": ...}
+#   ocr, classification, extraction: {"file_id": 42, "stage": "ocr", "done": 120, "total": 800, "ts": ...}
+#   conditions:                      {"file_id": 42, "stage": "conditions", "found": 57, "tagged": 51, "ts": ...}
+#
+# Publishing is best effort: a Redis failure is logged and never fails a task.
+# With neither PROGRESS_REDIS_URL nor CELERY_BROKER_URL set, publishing is a
+# no-op and the stream answers 503.
+#
+# Each open stream holds one gunicorn gthread thread and one Redis pub/sub
+# connection for as long as the browser keeps it open, so streams are capped
+# per web worker process: PROGRESS_MAX_STREAMS in total (keep it below the
+# worker's --threads so ordinary requests are still served) and
+# PROGRESS_MAX_STREAMS_PER_USER per user. Further streams get a 429.
+
+import os
+import json
+import time
+import logging
+import threading
+from functools import lru_cache
+import redis
+
+PROGRESS_REDIS_URL = os.getenv("PROGRESS_REDIS_URL") or os.getenv("CELERY_BROKER_URL")
+PROGRESS_SNAPSHOT_TTL_SECONDS = int(os.getenv("PROGRESS_SNAPSHOT_TTL_SECONDS", "86400"))
+PROGRESS_KEEPALIVE_SECONDS = float(os.getenv("PROGRESS_KEEPALIVE_SECONDS", "15"))
+PROGRESS_MAX_STREAMS = int(os.getenv("PROGRESS_MAX_STREAMS", "4"))
+PROGRESS_MAX_STREAMS_PER_USER = int(os.getenv("PROGRESS_MAX_STREAMS_PER_USER", "2"))
+
+_streams = {}  # user_id -> open streams in this process
+_streams_lock = threading.Lock()
+
+
+def _channel(user_id) -> str:
+    return f"progress:user:{user_id}"
+
+
+def _snapshot_key(user_id) -> str:
+    return f"progress:user:{user_id}:latest"
+
+
+@lru_cache(maxsize=1)
+def get_progress_redis():
+    """
+    Redis client for progress events (the Celery broker unless PROGRESS_REDIS_URL
+    is set), or None when neither is configured.
+    """
+    if not PROGRESS_REDIS_URL:
+        return None
+    kwargs = {"ssl_cert_reqs": "required"} if PROGRESS_REDIS_URL.startswith("rediss://") else {}
+    return redis.Redis.from_url(PROGRESS_REDIS_URL, decode_responses=True, **kwargs)
+
+
+def publish_progress(user_id, file_id, stage: str, **fields):
+    """Publishes one progress event for the user's file and records it as the file's latest state."""
+    if user_id is None or not PROGRESS_REDIS_URL:
+        return
+    event = {"file_id": file_id, "stage": stage, "ts": time.time(), **fields}
+    payload = json.dumps(event, default=str)
+    try:
+        client = get_progress_redis()
+        pipe = client.pipeline(transaction=False)
+        pipe.publish(_channel(user_id), payload)
+        pipe.hset(_snapshot_key(user_id), str(file_id), payload)
+        pipe.expire(_snapshot_key(user_id), PROGRESS_SNAPSHOT_TTL_SECONDS)
+        pipe.execute()
+    except Exception as e:
+        logging.warning(f"Publishing progress for file_id {file_id} failed: {e}")
+
+
+def progress_reporter(user_id, file_id):
+    """Returns a callback `report(stage, done, total)` bound to one file, for code that has no user context."""
+    def report(stage, done=None, total=None, **fields):
+        publish_progress(user_id, file_id, stage, done=done, total=total, **fields)
+    return report
+
+
+def latest_progress(user_id) -> list:
+    """The latest event of each of the user's recently processed files."""
+    client = get_progress_redis()
+    if client is None:
+        return []
+    snapshot = client.hgetall(_snapshot_key(user_id))
+    return [json.loads(payload) for payload in snapshot.values()]
+
+
+def acquire_stream(user_id) -> bool:
+    """Reserves a stream slot for the user in this process; False if a cap is reached."""
+    with _streams_lock:
+        if sum(_streams.values()) >= PROGRESS_MAX_STREAMS or _streams.get(user_id, 0) >= PROGRESS_MAX_STREAMS_PER_USER:
+            return False
+        _streams[user_id] = _streams.get(user_id, 0) + 1
+        return True
+
+
+def release_stream(user_id):
+    """Frees a slot taken with acquire_stream."""
+    with _streams_lock:
+        remaining = _streams.get(user_id, 0) - 1
+        if remaining > 0:
+            _streams[user_id] = remaining
+        else:
+            _streams.pop(user_id, None)
+
+
+class ProgressSubscription:
+    """
+    Subscription to one user's progress channel, made on construction so that
+    events published after it are not missed. Iterating yields the events,
+    and None every PROGRESS_KEEPALIVE_SECONDS without one (so the caller can
+    send a keep-alive). close() unsubscribes.
+    """
+
+    def __init__(self, user_id):
+        self.pubsub = get_progress_redis().pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(_channel(user_id))
+
+    def __iter__(self):
+        while True:
+            message = self.pubsub.get_message(timeout=PROGRESS_KEEPALIVE_SECONDS)
+            yield json.loads(message["data"]) if message else None
+
+    def close(self):
+        self.pubsub.close()
@@ -0,0 +1,60 @@
+# helpers/queue_metrics.py
+#
+# Broker-side queue metrics for autoscaling the Celery lanes.
+#
+# The LLM lanes are I/O-bound, so CPU stays low while their queues back up.
+# QueueCollector reads each queue from the Redis broker at scrape time:
+#   celery_queue_length{queue}                      messages waiting
+#   celery_queue_oldest_message_age_seconds{queue}  age of the next message to be consumed
+# The age comes from the `published_at` header stamped on every task when it
+# is published (celery_app.stamp_publish_time). Every worker pod exports the
+# same values, so HPA rules aggregate them with max()
+# (see prometheus-adapter-values.yaml and celery-worker-hpa.yaml).
+
+import json
+import time
+import logging
+from prometheus_client.core import GaugeMetricFamily
+
+PUBLISHED_AT_HEADER = "published_at"
+
+
+def oldest_message_age(raw_message, now: float) -> float:
+    """Seconds since the raw Redis message was published, or 0 if it carries no timestamp."""
+    try:
+        published_at = json.loads(raw_message).get("headers", {}).get(PUBLISHED_AT_HEADER)
+    except (ValueError, AttributeError):
+        return 0.0
+    return max(now - float(published_at), 0.0) if published_at else 0.0
+
+
+class QueueCollector:
+    """Prometheus collector reporting the length and lag of the given broker queues."""
+
+    def __init__(self, celery_app, queues):
+        self.celery_app = celery_app
+        self.queues = list(queues)
+
+    def collect(self):
+        length = GaugeMetricFamily(
+            "celery_queue_length", "Messages waiting in the Celery broker queue.", labels=["queue"]
+        )
+        age = GaugeMetricFamily(
+            "celery_queue_oldest_message_age_seconds",
+            "Age of the oldest message waiting in the Celery broker queue.",
+            labels=["queue"],
+        )
+        try:
+            with self.celery_app.connection_for_read() as connection:
+                client = connection.default_channel.client
+                now = time.time()
+                for queue in self.queues:
+                    length.add_metric([queue], client.llen(queue))
+                    # kombu LPUSHes and consumers BRPOP, so the oldest message is the last element
+                    oldest = client.lindex(queue, -1)
+                    age.add_metric([queue], oldest_message_age(oldest, now) if oldest else 0.0)
+        except Exception as e:
+            logging.warning(f"Could not read Celery queue metrics from the broker: {e}")
+            return
+        yield length
+        yield age
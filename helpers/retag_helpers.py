@@ -0,0 +1,129 @@
+# helpers/retag_helpers.py
+#
+# Bulk re-tagging of existing conditions from their stored embeddings.
+#
+# After curating the tags table or tuning MAX_COSINE_DISTANCE, existing
+# conditions keep their old condition_tags links. retag_conditions streams the
+# stored ConditionEmbedding vectors in chunks, matches each chunk against the
+# current tag matrix in one vectorized pass (helpers/tag_index.py), rewrites
+# condition_tags and is_ratable in bulk for the conditions whose result
+# changed, and finally recomputes nexus tags for the affected users.
+# No embedding API calls are made.
+
+import time
+import logging
+from sqlalchemy import select, delete, update, insert
+from database.session import SessionFactory
+from models.sql_models import Conditions, ConditionEmbedding, condition_tags
+from helpers.tag_index import tag_index
+from helpers.embedding_storage import condition_embedding_column
+from helpers.embedding_helpers import MAX_COSINE_DISTANCE
+from helpers.nexus_finalize import recompute_nexus_tags
+
+
+def _apply_chunk(session, rows, matches, stats):
+    """Compares one chunk's new tag assignment with the stored one and rewrites the differences."""
+    condition_ids = [row.condition_id for row in rows]
+    current_tags = {}
+    for condition_id, tag_id in session.execute(
+        select(condition_tags.c.condition_id, condition_tags.c.tag_id)
+        .where(condition_tags.c.condition_id.in_(condition_ids))
+    ):
+        current_tags.setdefault(condition_id, set()).add(tag_id)
+
+    retag_ids, new_links, ratable_ids, non_ratable_ids, affected_users = [], [], [], [], set()
+    for row, match in zip(rows, matches):
+        new_tag_id = match[0][0] if match else None
+        new_tags = {new_tag_id} if new_tag_id is not None else set()
+        new_ratable = new_tag_id is not None
+
+        tags_changed = current_tags.get(row.condition_id, set()) != new_tags
+        ratable_changed = row.is_ratable != new_ratable
+        if not tags_changed and not ratable_changed:
+            continue
+
+        affected_users.add(row.user_id)
+        if tags_changed:
+            retag_ids.append(row.condition_id)
+            if new_tag_id is not None:
+                new_links.append({"condition_id": row.condition_id, "tag_id": new_tag_id})
+        if ratable_changed:
+            (ratable_ids if new_ratable else non_ratable_ids).append(row.condition_id)
+
+    if retag_ids:
+        session.execute(delete(condition_tags).where(condition_tags.c.condition_id.in_(retag_ids)))
+    if new_links:
+        session.execute(insert(condition_tags), new_links)
+    if ratable_ids:
+        session.execute(update(Conditions).where(Conditions.condition_id.in_(ratable_ids)).values(is_ratable=True))
+    if non_ratable_ids:
+        session.execute(update(Conditions).where(Conditions.condition_id.in_(non_ratable_ids)).values(is_ratable=False))
+
+    stats["retagged"] += len(retag_ids)
+    stats["ratable_changed"] += len(ratable_ids) + len(non_ratable_ids)
+    return affected_users
+
+
+def retag_conditions(chunk_size: int = 2000, max_distance: float = MAX_COSINE_DISTANCE,
+                     user_id: int = None, dry_run: bool = False):
+    """
+    Re-tags every condition that has a stored embedding (or only one user's).
+    Each chunk is written in its own transaction; with dry_run=True changes
+    are counted and rolled back. Returns a stats dict.
+    """
+    stats = {"scanned": 0, "retagged": 0, "ratable_changed": 0, "users_recomputed": 0}
+    affected_users = set()
+    started = time.perf_counter()
+
+    read_session = SessionFactory()
+    write_session = SessionFactory()
+    try:
+        # Tags were just curated: load the current matrix instead of waiting for a refresh
+        tag_index.load(read_session)
+
+        vector_column = condition_embedding_column()
+        query = (
+            select(
+                ConditionEmbedding.condition_id,
+                Conditions.user_id,
+                Conditions.is_ratable,
+                vector_column.label("vector"),
+            )
+            .join(Conditions, Conditions.condition_id == ConditionEmbedding.condition_id)
+            .where(vector_column.isnot(None))
+            .order_by(ConditionEmbedding.condition_id)
+        )
+        if user_id is not None:
+            query = query.where(Conditions.user_id == user_id)
+
+        # Server-side cursor: only one chunk of vectors is held in memory at a time
+        result = read_session.execute(query.execution_options(stream_results=True, yield_per=chunk_size))
+        for rows in result.partitions(chunk_size):
+            matches = tag_index.top_k(read_session, [row.vector for row in rows], k=1, max_distance=max_distance)
+            affected_users |= _apply_chunk(write_session, rows, matches, stats)
+            if dry_run:
+                write_session.rollback()
+            else:
+                write_session.commit()
+
+            stats["scanned"] += len(rows)
+            logging.info(
+                f"Re-tag progress: {stats['scanned']} scanned, {stats['retagged']} re-tagged, "
+                f"{stats['ratable_changed']} ratable changes ({time.perf_counter() - started:.1f}s)"
+            )
+
+        # Nexus tags depend on condition_tags, so recompute them for every affected user
+        if not dry_run:
+            for affected_user_id in sorted(u for u in affected_users if u is not None):
+                recompute_nexus_tags(affected_user_id)
+                stats["users_recomputed"] += 1
+    except Exception:
+        write_session.rollback()
+        raise
+    finally:
+        read_session.close()
+        write_session.close()
+
+    stats["affected_users"] = len(affected_users)
+    stats["seconds"] = round(time.perf_counter() - started, 1)
+    return stats
@@ -1,6 +1,6 @@
 # helpers/sql_helpers.py
 
-from sqlalchemy import func, case
+from sqlalchemy import func, case, and_
 from datetime import datetime
 from models.sql_models import *
 
@@ -83,3 +83,63 @@ def revoke_nexus_tags_if_invalid(session, user_id):
         nexus_row.revoked_at = now_time
 
     session.commit()
+
+
+def sync_nexus_tags(session, user_id):
+    """
+    Incremental nexus maintenance from the user_tag_counts counters
+    (migrations/008_user_tag_counts.sql): only the (user, tag) rows flagged
+    needs_nexus_check since the last sync are looked at. A tag qualifies when
+    the user has both an in-service and a post-service condition for it.
+    Newly qualified tags get a nexus_tags row, active rows of tags that no
+    longer qualify are revoked, and the flags are cleared.
+    Returns (discovered, revoked) counts.
+    """
+    # Lock the flagged rows so a concurrent sync cannot act on them too
+    changed = (
+        session.query(UserTagCount)
+        .filter(UserTagCount.user_id == user_id, UserTagCount.needs_nexus_check.is_(True))
+        .with_for_update()
+        .all()
+    )
+    qualified = {row.tag_id for row in changed if row.in_service_count > 0 and row.post_service_count > 0}
+    disqualified = {row.tag_id for row in changed} - qualified
+
+    active_tag_ids = {
+        row[0] for row in (
+            session.query(NexusTags.tag_id)
+            .filter(NexusTags.user_id == user_id, NexusTags.revoked_at.is_(None))
+            .all()
+        )
+    }
+
+    newly_qualified = qualified - active_tag_ids
+    for t_id in newly_qualified:
+        session.add(NexusTags(tag_id=t_id, user_id=user_id))
+
+    # Active tags without a counter row have no tagged conditions left at all
+    uncounted = {
+        row[0] for row in (
+            session.query(NexusTags.tag_id)
+            .outerjoin(UserTagCount, and_(
+                UserTagCount.user_id == NexusTags.user_id, UserTagCount.tag_id == NexusTags.tag_id
+            ))
+            .filter(NexusTags.user_id == user_id, NexusTags.revoked_at.is_(None))
+            .filter(UserTagCount.tag_id.is_(None))
+            .all()
+        )
+    }
+    to_revoke = (disqualified | uncounted) & active_tag_ids
+    if to_revoke:
+        (
+            session.query(NexusTags)
+            .filter(NexusTags.user_id == user_id, NexusTags.revoked_at.is_(None))
+            .filter(NexusTags.tag_id.in_(to_revoke))
+            .update({NexusTags.revoked_at: datetime.utcnow()}, synchronize_session=False)
+        )
+
+    for row in changed:
+        row.needs_nexus_check = False
+
+    session.commit()
+    return len(newly_qualified), len(to_revoke)
@@ -0,0 +1,55 @@
+# helpers/sse_helpers.py
+#
+# Server-sent events for the long-form generation endpoints. A route that
+# supports streaming checks wants_event_stream() and returns
+# sse_response(<generator of text chunks>) instead of waiting for the full text.
+
+import json
+import logging
+from flask import Response, request, stream_with_context
+
+logger = logging.getLogger(__name__)
+
+
+def wants_event_stream() -> bool:
+    """
+    True when the client asked for a stream, either with ?stream=1 (or
+    "stream": true in the JSON body) or with an `Accept: text/event-stream` header.
+    """
+    if request.args.get("stream", "").lower() in ("1", "true", "yes"):
+        return True
+    body = request.get_json(silent=True) or {}
+    if isinstance(body, dict) and body.get("stream") is True:
+        return True
+    return "text/event-stream" in request.headers.get("Accept", "")
+
+
+def format_sse(data, event: str = None) -> str:
+    """Formats one SSE message. `data` is JSON-encoded."""
+    message = f"data: {json.dumps(data)}\n"
+    if event:
+        message = f"event: {event}\n{message}"
+    return message + "\n"
+
+
+def sse_response(chunks, done_payload: dict = None) -> Response:
+    """
+    Streams `chunks` (an iterable of text deltas) as SSE:
+        event: token  data: {"text": "..."}     (one per delta)
+        event: done   data: {...done_payload}   (once the generation finished)
+        event: error  data: {"error": "..."}    (if the generation failed mid-stream)
+    The generator runs inside the request context so that g.session stays usable.
+    """
+    def generate():
+        try:
+            for text in chunks:
+                yield format_sse({"text": text}, event="token")
+            yield format_sse(done_payload or {}, event="done")
+        except Exception as e:
+            logger.error(f"Error while streaming response: {e}")
+            yield format_sse({"error": str(e)}, event="error")
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # disable proxy buffering (nginx / ingress)
+    return response
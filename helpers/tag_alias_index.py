@@ -0,0 +1,173 @@
+# helpers/tag_alias_index.py
+#
+# Alias fast path for condition-to-tag assignment.
+#
+# Most diagnoses are common strings ("tinnitus", "lumbosacral strain", "ptsd")
+# that always land on the same Tag. tag_aliases maps their normalized form to
+# a tag_id so those conditions are tagged by dictionary lookup instead of a
+# similarity search. They are still embedded (usually an embedding cache hit),
+# so they stay searchable and `flask retag-conditions` revisits them.
+# Aliases come from:
+#   - Tag.disability_name (seed_aliases_from_tags, `flask seed-tag-aliases`)
+#   - embedding matches closer than TAG_ALIAS_LEARN_MAX_DISTANCE (learn_aliases);
+#     a learned alias is only used after TAG_ALIAS_MIN_HITS agreeing matches
+#   - manual rows (source='manual')
+# An alias that is matched to two different tags is flagged ambiguous and ignored.
+#
+# Embedding matches are made on the name plus the findings, but an alias is
+# keyed on the name alone, so a single match says little about the name. A
+# learned alias therefore needs several agreeing matches (at most one counted
+# per learn_aliases call, i.e. per file or condition), and one disagreeing match
+# is enough to disable it for good.
+# learn_aliases runs in its own short transaction after the caller has
+# committed, so hot alias rows are never locked for the length of a file's
+# persistence transaction; rows are upserted in alias order so concurrent
+# writers lock them in the same order.
+
+import os
+import re
+import time
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import or_, and_
+from sqlalchemy.dialects.postgresql import insert
+from database.session import SessionFactory
+from models.sql_models import Tag, TagAlias
+from helpers.metrics_helpers import tag_alias_lookups
+
+TAG_ALIAS_ENABLED = os.getenv("TAG_ALIAS_ENABLED", "true").lower() == "true"
+TAG_ALIAS_LEARN_MAX_DISTANCE = float(os.getenv("TAG_ALIAS_LEARN_MAX_DISTANCE", "0.35"))
+TAG_ALIAS_MIN_HITS = int(os.getenv("TAG_ALIAS_MIN_HITS", "5"))
+TAG_ALIAS_REFRESH_SECONDS = float(os.getenv("TAG_ALIAS_REFRESH_SECONDS", "60"))
+
+
+def normalize_condition_name(name: str) -> str:
+    """Lower-cases, drops punctuation and collapses whitespace: "Tinnitus, bilateral." -> "tinnitus bilateral"."""
+    name = re.sub(r"[^a-z0-9]+", " ", (name or "").lower())
+    return name.strip()[:255]
+
+
+class AliasIndex:
+    """In-process copy of the usable (non-ambiguous, confirmed) aliases, refreshed periodically."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._aliases = {}
+        self._loaded_at = None
+
+    def _usable(self, session):
+        rows = (
+            session.query(TagAlias.alias, TagAlias.tag_id)
+            .filter(TagAlias.ambiguous.is_(False))
+            .filter(or_(TagAlias.source != 'learned', TagAlias.hits >= TAG_ALIAS_MIN_HITS))
+            .all()
+        )
+        return {row.alias: row.tag_id for row in rows}
+
+    def ensure_fresh(self, session):
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < TAG_ALIAS_REFRESH_SECONDS:
+                return
+            self._aliases = self._usable(session)
+            self._loaded_at = time.monotonic()
+            logging.info(f"Tag alias index loaded: {len(self._aliases)} aliases")
+
+    def lookup(self, session, condition_name: str):
+        """Returns the tag_id for an exact alias hit, else None."""
+        if not TAG_ALIAS_ENABLED:
+            return None
+        self.ensure_fresh(session)
+        tag_id = self._aliases.get(normalize_condition_name(condition_name))
+        tag_alias_lookups.labels("hit" if tag_id is not None else "miss").inc()
+        return tag_id
+
+
+alias_index = AliasIndex()
+
+
+def _upsert_aliases(session, rows, source):
+    """
+    Inserts aliases or, for existing ones, counts the hit. A learned alias that
+    now points at a different tag is flagged ambiguous; seeded and manual
+    aliases are authoritative and keep their tag_id.
+    """
+    if not rows:
+        return
+    stmt = insert(TagAlias).values(sorted(rows, key=lambda row: row["alias"]))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["alias"],
+        set_={
+            "hits": TagAlias.hits + 1,
+            # Learned matches can only flag learned aliases; a seeded or manual
+            # alias is only flagged by its own source (e.g. a re-seed)
+            "ambiguous": TagAlias.ambiguous | and_(
+                TagAlias.source == 'learned', TagAlias.tag_id != stmt.excluded.tag_id
+            ) | and_(
+                stmt.excluded.ambiguous,
+                or_(TagAlias.source == 'learned', TagAlias.source == stmt.excluded.source)
+            ),
+            "best_distance": stmt.excluded.best_distance if source == "learned" else TagAlias.best_distance,
+            "updated_at": stmt.excluded.updated_at,
+        }
+    )
+    session.execute(stmt)
+
+
+def learn_aliases(matches):
+    """
+    Records high-confidence embedding matches as learned aliases, in a session
+    and transaction of its own. Call it after committing the conditions.
+    `matches` is a list of (condition_name, tag_id, cosine_distance).
+    Failures are logged and ignored: learning is an optimization.
+    """
+    if not TAG_ALIAS_ENABLED or not matches:
+        return
+    now = datetime.utcnow()
+
+    rows = {}
+    for condition_name, tag_id, distance in matches:
+        if distance is None or distance > TAG_ALIAS_LEARN_MAX_DISTANCE:
+            continue
+        alias = normalize_condition_name(condition_name)
+        if not alias:
+            continue
+        if alias in rows and rows[alias]["tag_id"] != tag_id:
+            rows[alias]["ambiguous"] = True  # conflicting matches within this batch
+            continue
+        rows.setdefault(alias, {
+            "alias": alias, "tag_id": tag_id, "source": "learned", "hits": 1,
+            "best_distance": distance, "ambiguous": False, "updated_at": now,
+        })
+    if not rows:
+        return
+
+    session = SessionFactory()
+    try:
+        _upsert_aliases(session, list(rows.values()), "learned")
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logging.warning(f"Learning tag aliases failed: {e}")
+    finally:
+        session.close()
+
+
+def seed_aliases_from_tags(session):
+    """Adds every Tag.disability_name as an alias; names shared by several tags are flagged ambiguous."""
+    now = datetime.utcnow()
+
+    by_alias = {}
+    for tag_id, disability_name in session.query(Tag.tag_id, Tag.disability_name).all():
+        alias = normalize_condition_name(disability_name)
+        if alias:
+            by_alias.setdefault(alias, set()).add(tag_id)
+
+    rows = [
+        {"alias": alias, "tag_id": min(tag_ids), "source": "disability_name", "hits": 1,
+         "best_distance": None, "ambiguous": len(tag_ids) > 1, "updated_at": now}
+        for alias, tag_ids in by_alias.items()
+    ]
+    _upsert_aliases(session, rows, "disability_name")
+    session.commit()
+    return len(rows)
@@ -0,0 +1,145 @@
+# helpers/tag_index.py
+#
+# Worker-resident index of Tag.embeddings for matching conditions to tags.
+#
+# The tag catalog is small and rarely changes, so instead of sending every
+# condition's 3,072-float vector to Postgres for an ORDER BY cosine_distance
+# over the whole tags table, the embeddings are loaded once into a normalized
+# NumPy matrix and many conditions are matched with a single matrix multiply.
+#
+# Freshness is checked against tag_catalog_version, a one-row counter bumped by
+# a statement trigger on tags (migrations/011_tag_catalog_version.sql), so the
+# periodic check reads one integer instead of hashing every tag vector.
+
+import os
+import time
+import logging
+import threading
+import numpy as np
+from sqlalchemy import text
+from models.sql_models import Tag
+from helpers.embedding_storage import tag_embedding_column
+
+# How often (seconds) the tags table version is checked for changes
+TAG_INDEX_REFRESH_SECONDS = float(os.getenv("TAG_INDEX_REFRESH_SECONDS", "60"))
+
+# Bumped by a trigger whenever tags are inserted, updated, deleted or truncated
+TAG_VERSION_SQL = text("SELECT version FROM tag_catalog_version WHERE id = 1")
+
+
+def as_float_array(value):
+    """pgvector returns numpy arrays for vector columns and HalfVector objects for halfvec."""
+    if hasattr(value, "to_numpy"):
+        value = value.to_numpy()
+    return np.asarray(value, dtype=np.float32)
+
+
+class TagIndex:
+    """
+    Normalized (n_tags x dim) matrix of tag embeddings plus the matching tag_ids.
+    Thread-safe; one instance per worker process (see `tag_index` below).
+    The ids, matrix and version are published together as one immutable
+    snapshot tuple, so a reader never pairs the ids of one load with the
+    matrix of another.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = (np.empty(0, dtype=np.int64), None, None)  # (tag_ids, matrix, version)
+        self._checked_at = None  # None until the first load
+
+    @property
+    def tag_ids(self):
+        return self._snapshot[0]
+
+    @property
+    def matrix(self):
+        return self._snapshot[1]
+
+    @property
+    def version(self):
+        return self._snapshot[2]
+
+    def load(self, session, version=None):
+        """(Re)loads every tag embedding from the database."""
+        if version is None:
+            # Read before the rows: a change committed in between only causes one extra reload
+            version = session.execute(TAG_VERSION_SQL).scalar()
+        column = tag_embedding_column()
+        rows = (
+            session.query(Tag.tag_id, column.label("vector"))
+            .filter(column.isnot(None))
+            .order_by(Tag.tag_id)
+            .all()
+        )
+        if rows:
+            matrix = np.stack([as_float_array(r.vector) for r in rows])
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix /= np.where(norms == 0, 1.0, norms)
+        else:
+            matrix = None
+
+        tag_ids = np.asarray([r.tag_id for r in rows], dtype=np.int64)
+        self._snapshot = (tag_ids, matrix, version)
+        self._checked_at = time.monotonic()
+        logging.info(f"Tag index loaded: {len(rows)} tags (version {self.version})")
+
+    def ensure_fresh(self, session):
+        """
+        Loads the index on first use and reloads it when the tags table version
+        has changed. The version is checked at most every TAG_INDEX_REFRESH_SECONDS.
+        """
+        with self._lock:
+            if self._checked_at is not None and time.monotonic() - self._checked_at < TAG_INDEX_REFRESH_SECONDS:
+                return
+            version = session.execute(TAG_VERSION_SQL).scalar()
+            if self._checked_at is None or version != self.version:
+                self.load(session, version)
+            else:
+                self._checked_at = time.monotonic()
+
+    def top_k(self, session, vectors, k: int = 1, max_distance: float = None):
+        """
+        Batched nearest-tag search for a list of query vectors.
+
+        Returns one list per query of (tag_id, cosine_distance) pairs, nearest
+        first. When max_distance is given, matches further than it are dropped
+        in the same pass, so a query can come back with an empty list.
+        """
+        self.ensure_fresh(session)
+        tag_ids, matrix, _ = self._snapshot  # read once: a concurrent load replaces the whole tuple
+        if not len(vectors):
+            return []
+        if matrix is None:
+            return [[] for _ in vectors]
+
+        queries = np.stack([as_float_array(v) for v in vectors])
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries /= np.where(norms == 0, 1.0, norms)
+
+        distances = 1.0 - queries @ matrix.T  # (n_queries, n_tags) cosine distances
+        k = min(k, distances.shape[1])
+        if k < distances.shape[1]:
+            candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.tile(np.arange(distances.shape[1]), (len(queries), 1))
+        candidate_distances = np.take_along_axis(distances, candidates, axis=1)
+        order = np.argsort(candidate_distances, axis=1)
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        candidate_distances = np.take_along_axis(candidate_distances, order, axis=1)
+
+        keep = np.ones_like(candidate_distances, dtype=bool)
+        if max_distance is not None:
+            keep = candidate_distances <= max_distance
+
+        return [
+            [
+                (int(tag_ids[candidates[i, j]]), float(candidate_distances[i, j]))
+                for j in range(k) if keep[i, j]
+            ]
+            for i in range(len(queries))
+        ]
+
+
+# One index per worker process
+tag_index = TagIndex()
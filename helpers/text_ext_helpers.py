@@ -12,6 +12,8 @@ from openai import OpenAI
 from urllib.parse import urlparse
 from pdf2image import convert_from_bytes, pdfinfo_from_bytes
 from helpers.llm_helpers import *
+from helpers.page_checkpoints import load_checkpoints, save_checkpoints
+from helpers.progress_events import progress_reporter
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Dict
 from typing import Union
@@ -31,11 +33,16 @@ logger = logging.getLogger(__name__)
 # ====================================================
 # Description: Invokes the processing of the file
 # ====================================================
-def read_and_extract_document(user_id, file_input: Union[str, BytesIO], file_type: str) -> str:
+def read_and_extract_document(user_id, file_input: Union[str, BytesIO], file_type: str, file_id=None) -> str:
     """
     Main function to process the document and return extracted information.
     Supports both file paths and in-memory BytesIO objects.
+    With a file_id, OCR text, classifications and extractions are checkpointed
+    per page (helpers/page_checkpoints.py) and reused when the task is retried,
+    and per-page progress is published (helpers/progress_events.py).
     """
+    progress = progress_reporter(user_id, file_id) if file_id is not None else None
+
     # Validate and read the file input
     if isinstance(file_input, (str, os.PathLike)):
         print("File Input is a string")
@@ -65,7 +72,7 @@ def read_and_extract_document(user_id, file_input: Union[str, BytesIO], file_typ
     # Process the document to extract text
     try:
         print("Processing document for text extraction")
-        extracted_text = process_document(file_bytes, file_type)
+        extracted_text = process_document(file_bytes, file_type, file_id=file_id, progress=progress)
         logger.info("Document processed and text extracted.")
         print("Document processed and text extracted.")
     except Exception as e:
@@ -75,7 +82,7 @@ def read_and_extract_document(user_id, file_input: Union[str, BytesIO], file_typ
     # Process all pages at once
     try:
         print("Processing pages")
-        document_outputs = process_pages(user_id, extracted_text)
+        document_outputs = process_pages(user_id, extracted_text, file_id=file_id, progress=progress)
     except Exception as e:
         logger.error(f"Failed to process pages: {e}")
         raise e
@@ -85,12 +92,16 @@ def read_and_extract_document(user_id, file_input: Union[str, BytesIO], file_typ
 
     return json.dumps(document_outputs, indent=4)
 
-def process_pages(user_id, page_contents: List[str]) -> List[Dict]:
+def process_pages(user_id, page_contents: List[str], file_id=None, progress=None) -> List[Dict]:
     """
     Process multiple pages concurrently and extract information.
+    With a file_id, pages whose classification or extraction is already
+    checkpointed are not sent to OpenAI again.
 
     Args:
         page_contents (List[str]): A list of page contents.
+        file_id (int, optional): File whose page checkpoints are used.
+        progress (callable, optional): Called as progress(stage, done, total).
 
     Returns:
         List[Dict]: A list of dictionaries containing page number, category, and details.
@@ -99,23 +110,31 @@ def process_pages(user_id, page_contents: List[str]) -> List[Dict]:
         # ====================================================
         # Section: Get Document Types
         # ====================================================
-        document_type_infos = detect_document_types(user_id, page_contents)
+        classifications = detect_missing_document_types(user_id, page_contents, file_id)
         logger.info(f"Document types extracted for {len(page_contents)} pages")
         print(f"Document types extracted for {len(page_contents)} pages")
+        if progress:
+            progress("classification", len(classifications), len(page_contents))
 
         # Create a mapping from page number to (content, classification)
         page_info = {
             classification.page_number: (page_contents[classification.page_number - 1], classification)
-            for classification in document_type_infos.pages
+            for classification in classifications
         }
 
-        results = []
+        # Pages extracted by an earlier attempt of this task are reused as they are
+        extracted = load_checkpoints(file_id, "extraction") if file_id is not None else {}
+        results = [extracted[page_num] for page_num in page_info if page_num in extracted]
+        if results:
+            logger.info(f"Reusing {len(results)} checkpointed page extractions for file_id {file_id}")
+
         with ThreadPoolExecutor(max_workers=3) as executor:
             futures = {
                 executor.submit(
-                    process_single_page, user_id, page_num, content, classification
+                    process_single_page, user_id, page_num, content, classification, file_id
                 ): page_num
                 for page_num, (content, classification) in page_info.items()
+                if page_num not in extracted
             }
 
             for future in as_completed(futures):
@@ -123,6 +142,8 @@ def process_pages(user_id, page_contents: List[str]) -> List[Dict]:
                 try:
                     result = future.result()
                     results.append(result)
+                    if progress:
+                        progress("extraction", len(results), len(page_info))
                 except Exception as e:
                     logger.error(f"Unhandled exception for page {page_num}: {e}")
                     results.append({
@@ -140,9 +161,38 @@ def process_pages(user_id, page_contents: List[str]) -> List[Dict]:
         logger.error(f"Error processing pages: {e}")
         raise RuntimeError(f"Error during information extraction: {e}") from e
 
-def process_single_page(user_id, page_num: int, page_content: str, classification: PageClassification) -> Dict:
+def detect_missing_document_types(user_id, page_contents: List[str], file_id=None) -> List[PageClassification]:
+    """
+    Classifies the pages that have no checkpointed classification and returns
+    the classifications of all pages, ordered by page number.
+    """
+    stored = load_checkpoints(file_id, "classification") if file_id is not None else {}
+    missing = [n for n in range(1, len(page_contents) + 1) if n not in stored]
+    classifications = [PageClassification(**stored[n]) for n in sorted(stored) if n <= len(page_contents)]
+
+    if missing:
+        detected = detect_document_types(user_id, [page_contents[n - 1] for n in missing])
+        new_checkpoints = {}
+        for classification in detected.pages:
+            # The model numbers the pages it was sent from 1; map back to the file's page numbers
+            if not 1 <= classification.page_number <= len(missing):
+                logger.warning(f"Ignoring classification for unknown page {classification.page_number}")
+                continue
+            classification.page_number = missing[classification.page_number - 1]
+            classifications.append(classification)
+            new_checkpoints[classification.page_number] = classification.dict()
+        if file_id is not None:
+            save_checkpoints(file_id, "classification", new_checkpoints)
+    else:
+        logger.info(f"Reusing checkpointed classifications for all {len(stored)} pages of file_id {file_id}")
+
+    classifications.sort(key=lambda c: c.page_number)
+    return classifications
+
+def process_single_page(user_id, page_num: int, page_content: str, classification: PageClassification, file_id=None) -> Dict:
     """
     Process a single page and extract information.
+    With a file_id the result is checkpointed once extraction succeeds.
 
     Args:
         page_num (int): Page number.
@@ -162,11 +212,14 @@ def process_single_page(user_id, page_num: int, page_content: str, classificatio
         logger.info(f"Information extracted from page {page_num}")
         print(f"Information extracted from page {page_num}")
 
-        return {
+        result = {
             'page': page_num,
             'category': page_document_type.value,
             'details': structured_info.dict() if structured_info else None
         }
+        if file_id is not None:
+            save_checkpoints(file_id, "extraction", {page_num: result})
+        return result
     except Exception as e:
         logger.error(f"Error processing page {page_num}: {e}")
         return {
@@ -295,13 +348,17 @@ def process_image_bytes(image_bytes: bytes) -> str:
         logger.error(f"Error processing image: {e}")
         raise
 
-def process_pdf_bytes(pdf_bytes: bytes, batch_size: int = 3) -> List[str]:
+def process_pdf_bytes(pdf_bytes: bytes, batch_size: int = 3, file_id=None, progress=None) -> List[str]:
     """
     Convert PDF bytes to text by performing OCR on each page in batches.
+    With a file_id, each page's text is checkpointed, and batches whose pages
+    are all checkpointed are not rendered or OCR'd again.
     
     Args:
         pdf_bytes (bytes): The PDF file content in bytes.
         batch_size (int): Number of pages to process at a time.
+        file_id (int, optional): File whose page checkpoints are used.
+        progress (callable, optional): Called as progress("ocr", pages_done, total_pages).
     
     Returns:
         List[str]: A list containing the extracted text for each page.
@@ -317,10 +374,18 @@ def process_pdf_bytes(pdf_bytes: bytes, batch_size: int = 3) -> List[str]:
         raise RuntimeError("Failed to obtain PDF info.") from e
 
     all_text_content = []
+    checkpointed = load_checkpoints(file_id, "ocr_text") if file_id is not None else {}
+    if checkpointed:
+        logger.info(f"Found OCR checkpoints for {len(checkpointed)} of {total_pages} pages (file_id {file_id})")
 
     # Process the PDF in batches of 'batch_size' pages. forcing the batch size to be 3
     for start_page in range(1, total_pages + 1, batch_size):
         end_page = min(start_page + batch_size - 1, total_pages)
+        if all(page_num in checkpointed for page_num in range(start_page, end_page + 1)):
+            all_text_content.extend(checkpointed[page_num] for page_num in range(start_page, end_page + 1))
+            if progress:
+                progress("ocr", end_page, total_pages)
+            continue
         try:
             logger.info(f"Converting pages {start_page} to {end_page} to images.")
             print(f"Converting pages {start_page} to {end_page} to images.")
@@ -334,6 +399,7 @@ def process_pdf_bytes(pdf_bytes: bytes, batch_size: int = 3) -> List[str]:
             raise RuntimeError(f"Failed to convert pages {start_page}-{end_page} to images.") from e
 
         batch_text_content = []
+        batch_checkpoints = {}
         # Create tuples of (page_number, image) for the current batch.
         page_num_image_tuples = list(enumerate(batch_images, start=start_page))
         max_workers = min(len(batch_images), 3)  # up to 10 threads for this batch
@@ -346,12 +412,17 @@ def process_pdf_bytes(pdf_bytes: bytes, batch_size: int = 3) -> List[str]:
                 try:
                     page_text = future.result()
                     batch_text_content.append(page_text)
+                    batch_checkpoints[page_num] = page_text
                     logger.info(f"OCR completed for page {page_num}.")
                 except Exception as e:
                     logger.error(f"OCR failed for page {page_num}: {e}")
                     batch_text_content.append(f"\n\nPage {page_num}:\n[Error processing page]")
         # Add the batch results to the overall results.
         all_text_content.extend(batch_text_content)
+        if file_id is not None:
+            save_checkpoints(file_id, "ocr_text", batch_checkpoints)
+        if progress:
+            progress("ocr", end_page, total_pages)
 
     # Optionally, sort the results by page number (if order is important).
     text_content_sorted = sorted(all_text_content, key=extract_page_num)
@@ -359,10 +430,10 @@ def process_pdf_bytes(pdf_bytes: bytes, batch_size: int = 3) -> List[str]:
     print("Completed OCR for all pages.")
     return text_content_sorted
 
-def process_document(file_content: bytes, file_type: str) -> str:
+def process_document(file_content: bytes, file_type: str, file_id=None, progress=None) -> str:
     """Process the document and extract text content."""
     if file_type.lower() == 'pdf':
-        return process_pdf_bytes(file_content)
+        return process_pdf_bytes(file_content, file_id=file_id, progress=progress)
     elif file_type.lower() in ['jpg', 'jpeg', 'png', 'tiff']:
         return process_image_bytes(file_content)
     else:
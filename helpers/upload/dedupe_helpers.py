@@ -0,0 +1,117 @@
+# helpers/upload/dedupe_helpers.py
+#
+# Per-user upload deduplication by content hash.
+#
+# Every uploaded file is hashed (sha256) before anything is sent to Azure or
+# Celery. If the user already has a file with the same content that is in
+# flight or complete, /upload returns that file's file_id and task ids
+# instead of creating a new blob, File row and pipeline run. A file whose
+# previous run failed, or an upload with force=true, reprocesses the
+# existing File row in place (its old conditions and checkpoints are removed
+# first), so a user never ends up with two copies of the same document.
+# force=true also recovers a file that has been in flight for longer than
+# UPLOAD_STUCK_SECONDS; the route revokes the old run's tasks.
+#
+# The reset is a conditional UPDATE on the file's status, so of two
+# concurrent reprocess requests only one resets the row and starts a run.
+
+import os
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_
+from models.sql_models import File, Conditions
+from helpers.page_checkpoints import clear_checkpoints
+
+HASH_CHUNK_BYTES = 1024 * 1024
+FAILED_STATUS = 'Failed'
+COMPLETE_STATUS = 'Complete'
+# An in-flight file uploaded (or last reprocessed) this long ago can be reprocessed with force=true
+UPLOAD_STUCK_SECONDS = int(os.getenv("UPLOAD_STUCK_SECONDS", "10800"))
+
+
+def file_content_hash(path: str) -> str:
+    """sha256 hex digest of the file at `path`, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_force_reprocess(request) -> bool:
+    """True when the upload asks to reprocess files it has already seen (form field or query param `force`)."""
+    value = request.form.get('force') or request.args.get('force') or ''
+    return value.strip().lower() in ('1', 'true', 'yes')
+
+
+def find_file_by_hash(session, user_id, content_hash):
+    """The user's existing File with this content, or None."""
+    return session.query(File).filter_by(user_id=user_id, content_hash=content_hash).first()
+
+
+def _stuck_before() -> datetime:
+    return datetime.utcnow() - timedelta(seconds=UPLOAD_STUCK_SECONDS)
+
+
+def is_in_flight(file_record) -> bool:
+    return file_record.status not in (COMPLETE_STATUS, FAILED_STATUS)
+
+
+def can_reprocess(file_record, force: bool) -> bool:
+    """
+    True if an upload of this existing file reprocesses it: always after a
+    failed run, and with force=true when it is complete or stuck in flight.
+    """
+    if file_record.status == FAILED_STATUS:
+        return True
+    if not force:
+        return False
+    return not is_in_flight(file_record) or file_record.uploaded_at < _stuck_before()
+
+
+def duplicate_response(file_record) -> dict:
+    """Entry of the /upload response for a file that was already uploaded."""
+    return {
+        'category': file_record.file_category,
+        "fileName": file_record.file_name,
+        "blobUrl": file_record.file_url,
+        "file_id": file_record.file_id,
+        "status": file_record.status,
+        "task_ids": file_record.task_ids or {},
+        "duplicate": True,
+    }
+
+
+def reset_file_for_reprocessing(session, file_record, force: bool) -> bool:
+    """
+    Claims the file for a new run with a conditional UPDATE (status back to
+    Uploading, task_ids cleared, uploaded_at restarted) that only matches while
+    can_reprocess still holds, then removes the results of the previous run
+    (conditions, with their embeddings and tags by cascade, and page
+    checkpoints). Returns False, changing nothing, if another request claimed
+    the file first. The caller commits and starts the new pipeline run.
+    """
+    allowed = [File.status == FAILED_STATUS]
+    if force:
+        allowed.append(File.status == COMPLETE_STATUS)
+        allowed.append(and_(File.status.notin_((COMPLETE_STATUS, FAILED_STATUS)), File.uploaded_at < _stuck_before()))
+    claimed = (
+        session.query(File)
+        .filter(File.file_id == file_record.file_id, or_(*allowed))
+        .update({"status": "Uploading", "task_ids": None, "uploaded_at": datetime.utcnow()},
+                synchronize_session=False)
+    )
+    session.expire(file_record)
+    if not claimed:
+        logging.info(f"file_id={file_record.file_id} was claimed by another request; not reprocessing")
+        return False
+
+    deleted = (
+        session.query(Conditions)
+        .filter(Conditions.file_id == file_record.file_id)
+        .delete(synchronize_session=False)
+    )
+    clear_checkpoints(file_record.file_id)
+    logging.info(f"Reset file_id={file_record.file_id} for reprocessing ({deleted} conditions removed)")
+    return True
@@ -2,14 +2,17 @@
 
 import logging
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import wait
 from database.session import ScopedSession
 from helpers.diagnosis_worker import worker_process_diagnosis
+from helpers.diagnosis_queue import diagnosis_queue
+from helpers.page_checkpoints import condition_idempotency_key
+from helpers.tag_alias_index import learn_aliases
 
-def process_visit(visit, page_number, service_periods, user_id, file_id):
+def parse_visit(visit, page_number, service_periods):
     """
-    Processes a single visit, including its diagnoses, using a ThreadPoolExecutor
-    for concurrency (no chunking).
+    Parses the visit date, medical professionals and in-service flag of an extracted visit.
+    Returns None when the visit date is invalid.
     """
     date_of_visit = visit.get('date_of_visit')
     try:
@@ -17,7 +20,7 @@ def process_visit(visit, page_number, service_periods, user_id, file_id):
     except ValueError as ve:
         logging.error(f"Invalid date format '{date_of_visit}' on page {page_number}: {ve}")
         print(f"Invalid date format '{date_of_visit}' on page {page_number}: {ve}")
-        return
+        return None
 
     diagnosis_list = visit.get('diagnosis', [])
     medical_professionals = visit.get('medical_professionals', [])
@@ -39,11 +42,45 @@ def process_visit(visit, page_number, service_periods, user_id, file_id):
     logging.info(f"Visit date {date_of_visit_dt} in service period: {in_service}")
     print(f"Visit date {date_of_visit_dt} in service period: {in_service}")
 
+    return {
+        "date_of_visit": date_of_visit,
+        "date_of_visit_dt": date_of_visit_dt,
+        "diagnosis_list": diagnosis_list,
+        "medical_professionals_str": medical_professionals_str,
+        "in_service": in_service
+    }
+
+
+def submit_visit(visit, page_number, service_periods, user_id, file_id, defer_embedding=False, visit_index=None):
+    """
+    Parses a single visit and submits each of its diagnoses to the per-process
+    diagnosis queue (helpers/diagnosis_queue.py).
+    Returns (visit_result, futures), or (None, []) when the visit date is invalid.
+    With defer_embedding=True the diagnoses are stored without embeddings; the
+    caller runs embed_pending_conditions for the file once all visits are done.
+    With a visit_index (the visit's position on its page) every diagnosis gets
+    an idempotency key, so a retried task does not store it twice.
+    """
+    parsed = parse_visit(visit, page_number, service_periods)
+    if parsed is None:
+        return None, []
+
+    date_of_visit = parsed["date_of_visit"]
+    date_of_visit_dt = parsed["date_of_visit_dt"]
+    diagnosis_list = parsed["diagnosis_list"]
+    medical_professionals_str = parsed["medical_professionals_str"]
+    in_service = parsed["in_service"]
+
     # Function to process a single diagnosis with its own session
-    def process_single_diagnosis(diagnosis):
+    def process_single_diagnosis(diagnosis_index, diagnosis):
+        idempotency_key = None
+        if visit_index is not None and isinstance(diagnosis.get('diagnosis_name'), str):
+            idempotency_key = condition_idempotency_key(
+                file_id, page_number, visit_index, diagnosis_index, diagnosis['diagnosis_name']
+            )
         session = ScopedSession()
         try:
-            worker_process_diagnosis(
+            learned = worker_process_diagnosis(
                 diagnosis=diagnosis,
                 user_id=user_id,
                 file_id=file_id,
@@ -51,27 +88,50 @@ def process_visit(visit, page_number, service_periods, user_id, file_id):
                 date_of_visit=date_of_visit_dt,
                 medical_professionals_str=medical_professionals_str,
                 in_service=in_service,
-                session=session
+                session=session,
+                defer_embedding=defer_embedding,
+                idempotency_key=idempotency_key
             )
             session.commit()
+            return learned
         except Exception as e:
             session.rollback()
             logging.error(f"Error processing diagnosis: {e}")
             print(f"Error processing diagnosis: {e}")
+            return []
         finally:
             ScopedSession.remove()
 
-    # Process all diagnoses concurrently with up to 10 worker threads
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = [executor.submit(process_single_diagnosis, diag) for diag in diagnosis_list]
-        # Wait for tasks to finish
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception as e:
-                logging.error(f"Thread raised an exception: {e}")
+    futures = [
+        diagnosis_queue.submit(user_id, process_single_diagnosis, index, diag)
+        for index, diag in enumerate(diagnosis_list)
+    ]
 
     return {
         "date_of_visit": date_of_visit,
         "date_of_visit_dt": date_of_visit_dt
-    }
+    }, futures
+
+
+def wait_for_diagnoses(futures):
+    """
+    Blocks until the submitted diagnoses are done, logging any that raised,
+    then learns their tag matches as aliases in one batch (all committed by now).
+    """
+    done, _ = wait(futures)
+    learned = []
+    for future in done:
+        try:
+            learned.extend(future.result() or [])
+        except Exception as e:
+            logging.error(f"Diagnosis raised an exception: {e}")
+    learn_aliases(learned)
+
+
+def process_visit(visit, page_number, service_periods, user_id, file_id, defer_embedding=False):
+    """
+    Processes a single visit, including its diagnoses, and waits for it to finish.
+    """
+    visit_result, futures = submit_visit(visit, page_number, service_periods, user_id, file_id, defer_embedding)
+    wait_for_diagnoses(futures)
+    return visit_result
@@ -0,0 +1,83 @@
+# helpers/worker_warmup.py
+#
+# Warm-up of Celery worker processes.
+#
+# The worker's main process imports celery_app (and with it llm_helpers and
+# the OpenAI and Azure clients) before forking the prefork children, so those
+# modules and clients are inherited, not rebuilt. What a child cannot safely
+# inherit is the database pool, and what it would otherwise build lazily on
+# its first task is the tag catalog. So:
+#   warm_up_main_process   (worker_init)         loads the tag index and alias
+#       index once, so every child inherits them copy-on-write, then closes
+#       the main process's DB connections.
+#   warm_up_worker_process (worker_process_init) drops the inherited pool,
+#       opens WORKER_WARM_DB_CONNECTIONS fresh connections and refreshes the
+#       catalogs if they are stale (normally a no-op).
+# Each step's time is observed in celery_worker_warmup_seconds{step}.
+# Warm-up failures are logged and never stop the worker: everything warmed
+# here is also built lazily on first use.
+
+import os
+import time
+import logging
+from contextlib import contextmanager
+from database.session import engine, SessionFactory
+from helpers.tag_index import tag_index
+from helpers.tag_alias_index import alias_index
+from helpers.metrics_helpers import celery_worker_warmup
+
+WORKER_WARMUP_ENABLED = os.getenv("WORKER_WARMUP_ENABLED", "true").lower() == "true"
+WORKER_WARM_DB_CONNECTIONS = int(os.getenv("WORKER_WARM_DB_CONNECTIONS", "1"))
+
+
+@contextmanager
+def _timed(step):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        logging.warning(f"Worker warm-up step '{step}' failed in pid {os.getpid()}: {e}")
+    finally:
+        celery_worker_warmup.labels(step).observe(time.perf_counter() - start)
+
+
+def preload_catalogs():
+    """Loads (or refreshes, if stale) the tag embedding matrix and the alias index."""
+    session = SessionFactory()
+    try:
+        tag_index.ensure_fresh(session)
+        alias_index.ensure_fresh(session)
+    finally:
+        session.close()
+
+
+def warm_up_main_process():
+    """worker_init: build what the children can inherit, then release the main process's connections."""
+    if not WORKER_WARMUP_ENABLED:
+        return
+    with _timed("main_catalogs"):
+        preload_catalogs()
+    # Forked children must never use sockets opened here
+    engine.dispose()
+
+
+def warm_up_worker_process():
+    """worker_process_init (prefork children) or worker_init (threads pool): per-process warm-up."""
+    if not WORKER_WARMUP_ENABLED:
+        return
+    start = time.perf_counter()
+
+    with _timed("db_pool"):
+        # Forget the connections inherited from the parent without closing
+        # them (they belong to the parent), then open our own
+        engine.dispose(close=False)
+        connections = [engine.connect() for _ in range(WORKER_WARM_DB_CONNECTIONS)]
+        for connection in connections:
+            connection.close()
+
+    with _timed("catalogs"):
+        preload_catalogs()
+
+    elapsed = time.perf_counter() - start
+    celery_worker_warmup.labels("total").observe(elapsed)
+    logging.info(f"Worker process {os.getpid()} warmed up in {elapsed:.2f}s")
@@ -0,0 +1,567 @@
+# loadtest/openai_stub.py
+#
+# Offline OpenAI-compatible stand-in server for load testing and benchmarking
+# the pipeline (Celery chain, process_visit, chatbot) without live OpenAI.
+#
+# Serves:
+#   POST /v1/chat/completions                      (plain, structured parse and stream=True)
+#   POST /v1/embeddings
+#   POST /v1/threads, /v1/threads/<id>/messages, /v1/threads/<id>/runs  (Assistants-style runs)
+#   GET  /stub/stats, POST /stub/reset             (token accounting)
+#
+# Run it with:
+#   python loadtest/openai_stub.py --port 8089 --config loadtest/stub_config.example.json
+# and start the app/workers with OPENAI_STUB_ENABLED=true (see helpers/openai_client.py).
+
+import os
+import re
+import json
+import math
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from flask import Flask, request, jsonify, Response
+
+app = Flask(__name__)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# ====================================================
+# Section: CONFIGURATION
+# ====================================================
+# Latencies are log-normal: median_ms * exp(sigma * N(0, 1)), plus
+# ms_per_output_token for every generated token.
+DEFAULT_CONFIG = {
+    "seed": None,
+    "error_rate_429": 0.0,
+    "retry_after_seconds": 1,
+    "completion_tokens": 300,
+    "latency": {
+        "chat.completions": {"median_ms": 800, "sigma": 0.5, "ms_per_output_token": 8},
+        "embeddings": {"median_ms": 120, "sigma": 0.3, "ms_per_output_token": 0},
+        "assistants.run": {"median_ms": 2500, "sigma": 0.5, "ms_per_output_token": 0},
+        "assistants.other": {"median_ms": 60, "sigma": 0.2, "ms_per_output_token": 0},
+    },
+    # Tool call to request once per run before completing (None disables it).
+    "assistant_tool_call": {"name": "semantic_search_user_conditions", "arguments": {"query_text": "back pain", "limit": 5}},
+}
+
+config = json.loads(json.dumps(DEFAULT_CONFIG))
+rng = random.Random()
+
+EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+
+def load_config(path=None):
+    """Merges a JSON config file (if given) over DEFAULT_CONFIG."""
+    global config
+    merged = json.loads(json.dumps(DEFAULT_CONFIG))
+    if path:
+        with open(path) as f:
+            overrides = json.load(f)
+        latency_overrides = overrides.pop("latency", {})
+        merged.update(overrides)
+        for endpoint, values in latency_overrides.items():
+            merged["latency"].setdefault(endpoint, {}).update(values)
+    config = merged
+    if config.get("seed") is not None:
+        rng.seed(config["seed"])
+
+
+# ====================================================
+# Section: TOKEN ACCOUNTING
+# ====================================================
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def count_tokens(text) -> int:
+    """Rough tokenizer (~4 characters per token), good enough for load shaping."""
+    if not text:
+        return 0
+    if not isinstance(text, str):
+        text = json.dumps(text)
+    return max(1, math.ceil(len(text) / 4))
+
+
+def record_usage(endpoint, model, prompt_tokens, completion_tokens, status="ok"):
+    with _stats_lock:
+        entry = _stats.setdefault(f"{endpoint}:{model}", {
+            "endpoint": endpoint, "model": model, "requests": 0, "rate_limited": 0,
+            "prompt_tokens": 0, "completion_tokens": 0,
+        })
+        if status == "rate_limited":
+            entry["rate_limited"] += 1
+            return
+        entry["requests"] += 1
+        entry["prompt_tokens"] += prompt_tokens
+        entry["completion_tokens"] += completion_tokens
+
+
+@app.route("/stub/stats", methods=["GET"])
+def stub_stats():
+    with _stats_lock:
+        rows = list(_stats.values())
+    totals = {
+        "requests": sum(r["requests"] for r in rows),
+        "rate_limited": sum(r["rate_limited"] for r in rows),
+        "prompt_tokens": sum(r["prompt_tokens"] for r in rows),
+        "completion_tokens": sum(r["completion_tokens"] for r in rows),
+    }
+    return jsonify({"totals": totals, "by_endpoint": rows})
+
+
+@app.route("/stub/reset", methods=["POST"])
+def stub_reset():
+    with _stats_lock:
+        _stats.clear()
+    return jsonify({"status": "reset"})
+
+
+# ====================================================
+# Section: LATENCY AND ERROR INJECTION
+# ====================================================
+def simulate_latency(endpoint, output_tokens=0):
+    settings = config["latency"].get(endpoint, {})
+    median = settings.get("median_ms", 0) / 1000.0
+    sigma = settings.get("sigma", 0)
+    delay = median * math.exp(sigma * rng.gauss(0, 1)) if median else 0
+    delay += output_tokens * settings.get("ms_per_output_token", 0) / 1000.0
+    if delay > 0:
+        time.sleep(delay)
+
+
+def maybe_rate_limit(endpoint, model):
+    """Returns a 429 response with probability error_rate_429, else None."""
+    if rng.random() >= config.get("error_rate_429", 0):
+        return None
+    record_usage(endpoint, model, 0, 0, status="rate_limited")
+    response = jsonify({"error": {
+        "message": "Rate limit reached (injected by openai_stub).",
+        "type": "requests",
+        "code": "rate_limit_exceeded",
+    }})
+    response.status_code = 429
+    response.headers["retry-after"] = str(config.get("retry_after_seconds", 1))
+    return response
+
+
+# ====================================================
+# Section: FIXTURES
+# ====================================================
+# A fixture file holds {"match": {...}, ...} and one of:
+#   "response":      a full recorded OpenAI response body, returned as-is
+#   "content":       message content (string) for chat completions
+#   "response_json": a template rendered to JSON content (structured parse)
+# Match keys: "endpoint", "model", "schema_name", "contains" (substring of the prompt).
+# Templates support {"$repeat": {"pattern": <regex over the prompt>, "item": {...}}}
+# and the string placeholders "$int:N" / "$group:N" for regex group N.
+_fixtures = None
+
+
+def load_fixtures():
+    global _fixtures
+    _fixtures = []
+    if not os.path.isdir(FIXTURES_DIR):
+        return _fixtures
+    for name in sorted(os.listdir(FIXTURES_DIR)):
+        if name.endswith(".json"):
+            with open(os.path.join(FIXTURES_DIR, name)) as f:
+                fixture = json.load(f)
+            fixture["_name"] = name
+            _fixtures.append(fixture)
+    return _fixtures
+
+
+def find_fixture(endpoint, model, schema_name, prompt_text):
+    for fixture in (_fixtures if _fixtures is not None else load_fixtures()):
+        match = fixture.get("match", {})
+        if match.get("endpoint", endpoint) != endpoint:
+            continue
+        if match.get("model") and match["model"] != model:
+            continue
+        if match.get("schema_name") and match["schema_name"] != schema_name:
+            continue
+        if match.get("contains") and match["contains"] not in prompt_text:
+            continue
+        return fixture
+    return None
+
+
+def render_template(template, prompt_text, groups=()):
+    if isinstance(template, dict):
+        if "$repeat" in template:
+            spec = template["$repeat"]
+            items = [
+                render_template(spec["item"], prompt_text, (m.group(0),) + m.groups())
+                for m in re.finditer(spec["pattern"], prompt_text)
+            ]
+            return items or [render_template(spec["item"], prompt_text, ("1", "1"))]
+        return {k: render_template(v, prompt_text, groups) for k, v in template.items()}
+    if isinstance(template, list):
+        return [render_template(v, prompt_text, groups) for v in template]
+    if isinstance(template, str):
+        placeholder = re.fullmatch(r"\$(int|group):(\d+)", template)
+        if placeholder and int(placeholder.group(2)) < len(groups):
+            value = groups[int(placeholder.group(2))]
+            return int(value) if placeholder.group(1) == "int" else value
+    return template
+
+
+def instance_from_schema(schema, root=None):
+    """Builds a minimal instance that satisfies a (strict) JSON schema."""
+    root = root or schema
+    if "$ref" in schema:
+        target = root
+        for part in schema["$ref"].lstrip("#/").split("/"):
+            target = target[part]
+        return instance_from_schema(target, root)
+    if "anyOf" in schema:
+        options = [o for o in schema["anyOf"] if o.get("type") != "null"] or schema["anyOf"]
+        return instance_from_schema(options[0], root)
+    if "allOf" in schema:
+        return instance_from_schema(schema["allOf"][0], root)
+    if "enum" in schema:
+        return schema["enum"][0]
+    schema_type = schema.get("type")
+    if isinstance(schema_type, list):
+        schema_type = next((t for t in schema_type if t != "null"), "null")
+    if schema_type == "object":
+        return {
+            key: instance_from_schema(value, root)
+            for key, value in schema.get("properties", {}).items()
+        }
+    if schema_type == "array":
+        return [instance_from_schema(schema.get("items", {}), root)]
+    if schema_type == "integer":
+        return 1
+    if schema_type == "number":
+        return 0.9
+    if schema_type == "boolean":
+        return False
+    if schema_type == "null":
+        return None
+    return "stub"
+
+
+def filler_text(n_tokens, seed_text=""):
+    words = ["veteran", "service", "condition", "evidence", "treatment", "diagnosis",
+             "symptoms", "record", "examination", "rating", "nexus", "claim"]
+    local = random.Random(hashlib.sha256(seed_text.encode()).hexdigest())
+    return " ".join(local.choice(words) for _ in range(max(1, n_tokens)))
+
+
+# ====================================================
+# Section: CHAT COMPLETIONS
+# ====================================================
+def _prompt_text(messages):
+    parts = []
+    for message in messages or []:
+        content = message.get("content")
+        if isinstance(content, list):
+            content = " ".join(p.get("text", "") for p in content if isinstance(p, dict))
+        parts.append(content or "")
+    return "\n".join(parts)
+
+
+@app.route("/v1/chat/completions", methods=["POST"])
+def chat_completions():
+    body = request.get_json(force=True)
+    model = body.get("model", "gpt-4o")
+    rate_limited = maybe_rate_limit("chat.completions", model)
+    if rate_limited is not None:
+        return rate_limited
+
+    prompt_text = _prompt_text(body.get("messages"))
+    response_format = body.get("response_format") or {}
+    json_schema = response_format.get("json_schema") if response_format.get("type") == "json_schema" else None
+    schema_name = json_schema.get("name") if json_schema else None
+    fixture = find_fixture("chat.completions", model, schema_name, prompt_text)
+
+    prompt_tokens = count_tokens(prompt_text)
+    if fixture and "response" in fixture:
+        recorded = json.loads(json.dumps(fixture["response"]))
+        usage = recorded.get("usage") or {}
+        simulate_latency("chat.completions", usage.get("completion_tokens", 0))
+        record_usage("chat.completions", model, usage.get("prompt_tokens", prompt_tokens), usage.get("completion_tokens", 0))
+        recorded["id"] = f"chatcmpl-{uuid.uuid4().hex}"
+        return jsonify(recorded)
+
+    if fixture and "response_json" in fixture:
+        content = json.dumps(render_template(fixture["response_json"], prompt_text))
+    elif fixture and "content" in fixture:
+        content = fixture["content"]
+    elif json_schema:
+        content = json.dumps(instance_from_schema(json_schema.get("schema", {})))
+    else:
+        content = filler_text(config.get("completion_tokens", 300), prompt_text)
+
+    completion_tokens = count_tokens(content)
+    if body.get("stream"):
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+        return Response(
+            _stream_chat(model, content, prompt_tokens, completion_tokens, include_usage),
+            mimetype="text/event-stream",
+        )
+
+    simulate_latency("chat.completions", completion_tokens)
+    record_usage("chat.completions", model, prompt_tokens, completion_tokens)
+    return jsonify({
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content, "refusal": None},
+            "logprobs": None,
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    })
+
+
+def _stream_chat(model, content, prompt_tokens, completion_tokens, include_usage):
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    per_token = config["latency"]["chat.completions"].get("ms_per_output_token", 0) / 1000.0
+
+    def chunk(delta, finish_reason=None, usage=None):
+        payload = {
+            "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        if usage:
+            payload["usage"] = usage
+        return f"data: {json.dumps(payload)}\n\n"
+
+    simulate_latency("chat.completions", 0)
+    yield chunk({"role": "assistant", "content": ""})
+    for piece in re.findall(r"\S+\s*", content):
+        if per_token:
+            time.sleep(per_token)
+        yield chunk({"content": piece})
+    yield chunk({}, finish_reason="stop")
+    record_usage("chat.completions", model, prompt_tokens, completion_tokens)
+    if include_usage:
+        yield chunk(None, usage={
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        })
+    yield "data: [DONE]\n\n"
+
+
+# ====================================================
+# Section: EMBEDDINGS
+# ====================================================
+def deterministic_embedding(text, dimensions):
+    """Unit-length pseudo-random vector seeded by the text (same text => same vector)."""
+    local = random.Random(hashlib.sha256(text.encode()).hexdigest())
+    vector = [local.gauss(0, 1) for _ in range(dimensions)]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+@app.route("/v1/embeddings", methods=["POST"])
+def embeddings():
+    body = request.get_json(force=True)
+    model = body.get("model", "text-embedding-3-large")
+    rate_limited = maybe_rate_limit("embeddings", model)
+    if rate_limited is not None:
+        return rate_limited
+
+    inputs = body.get("input")
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    dimensions = body.get("dimensions") or EMBEDDING_DIMENSIONS.get(model, 1536)
+
+    prompt_tokens = sum(count_tokens(text) for text in inputs)
+    simulate_latency("embeddings")
+    record_usage("embeddings", model, prompt_tokens, 0)
+    return jsonify({
+        "object": "list",
+        "model": model,
+        "data": [
+            {"object": "embedding", "index": i, "embedding": deterministic_embedding(text, dimensions)}
+            for i, text in enumerate(inputs)
+        ],
+        "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+    })
+
+
+# ====================================================
+# Section: ASSISTANTS (threads / messages / runs)
+# ====================================================
+_threads_lock = threading.Lock()
+_threads = {}
+_runs = {}
+
+
+def _message_object(thread_id, role, text):
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:24]}",
+        "object": "thread.message",
+        "created_at": int(time.time()),
+        "thread_id": thread_id,
+        "role": role,
+        "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+        "assistant_id": None,
+        "run_id": None,
+        "attachments": [],
+        "metadata": {},
+    }
+
+
+@app.route("/v1/threads", methods=["POST"])
+def create_thread():
+    simulate_latency("assistants.other")
+    thread_id = f"thread_{uuid.uuid4().hex[:24]}"
+    with _threads_lock:
+        _threads[thread_id] = []
+    return jsonify({"id": thread_id, "object": "thread", "created_at": int(time.time()), "metadata": {}})
+
+
+@app.route("/v1/threads/<thread_id>/messages", methods=["POST", "GET"])
+def thread_messages(thread_id):
+    simulate_latency("assistants.other")
+    with _threads_lock:
+        messages = _threads.setdefault(thread_id, [])
+        if request.method == "POST":
+            body = request.get_json(force=True)
+            message = _message_object(thread_id, body.get("role", "user"), body.get("content", ""))
+            messages.append(message)
+            return jsonify(message)
+        data = list(reversed(messages))  # newest first, like the real API
+    return jsonify({
+        "object": "list",
+        "data": data,
+        "first_id": data[0]["id"] if data else None,
+        "last_id": data[-1]["id"] if data else None,
+        "has_more": False,
+    })
+
+
+def _run_object(run):
+    public = {k: v for k, v in run.items() if not k.startswith("_")}
+    return jsonify(public)
+
+
+@app.route("/v1/threads/<thread_id>/runs", methods=["POST"])
+def create_run(thread_id):
+    body = request.get_json(force=True)
+    model = body.get("model") or "gpt-4o"
+    rate_limited = maybe_rate_limit("assistants.run", model)
+    if rate_limited is not None:
+        return rate_limited
+    simulate_latency("assistants.other")
+
+    settings = config["latency"]["assistants.run"]
+    duration = settings.get("median_ms", 0) / 1000.0 * math.exp(settings.get("sigma", 0) * rng.gauss(0, 1))
+    run_id = f"run_{uuid.uuid4().hex[:24]}"
+    run = {
+        "id": run_id,
+        "object": "thread.run",
+        "created_at": int(time.time()),
+        "thread_id": thread_id,
+        "assistant_id": body.get("assistant_id"),
+        "model": model,
+        "status": "queued",
+        "required_action": None,
+        "last_error": None,
+        "usage": None,
+        "instructions": "",
+        "tools": [],
+        "metadata": {},
+        "_ready_at": time.time() + duration,
+        "_tool_call_done": config.get("assistant_tool_call") is None,
+    }
+    with _threads_lock:
+        _runs[run_id] = run
+    return _run_object(run)
+
+
+def _advance_run(run):
+    """Moves a run through queued -> in_progress -> requires_action -> completed."""
+    if run["status"] in ("completed", "failed", "requires_action"):
+        return
+    if time.time() < run["_ready_at"]:
+        run["status"] = "in_progress"
+        return
+    if not run["_tool_call_done"]:
+        tool = config["assistant_tool_call"]
+        run["status"] = "requires_action"
+        run["required_action"] = {
+            "type": "submit_tool_outputs",
+            "submit_tool_outputs": {"tool_calls": [{
+                "id": f"call_{uuid.uuid4().hex[:24]}",
+                "type": "function",
+                "function": {"name": tool["name"], "arguments": json.dumps(tool.get("arguments", {}))},
+            }]},
+        }
+        return
+
+    messages = _threads.setdefault(run["thread_id"], [])
+    prompt_tokens = sum(count_tokens(m["content"][0]["text"]["value"]) for m in messages)
+    prompt_tokens += run.get("_tool_output_tokens", 0)
+    answer = filler_text(config.get("completion_tokens", 300), run["id"])
+    completion_tokens = count_tokens(answer)
+    messages.append(_message_object(run["thread_id"], "assistant", answer))
+    run["status"] = "completed"
+    run["usage"] = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+    record_usage("assistants.run", run["model"], prompt_tokens, completion_tokens)
+
+
+@app.route("/v1/threads/<thread_id>/runs/<run_id>", methods=["GET"])
+def retrieve_run(thread_id, run_id):
+    simulate_latency("assistants.other")
+    with _threads_lock:
+        run = _runs.get(run_id)
+        if not run:
+            return jsonify({"error": {"message": f"No run found with id '{run_id}'."}}), 404
+        _advance_run(run)
+        return _run_object(run)
+
+
+@app.route("/v1/threads/<thread_id>/runs/<run_id>/submit_tool_outputs", methods=["POST"])
+def submit_tool_outputs(thread_id, run_id):
+    body = request.get_json(force=True)
+    simulate_latency("assistants.other")
+    with _threads_lock:
+        run = _runs.get(run_id)
+        if not run:
+            return jsonify({"error": {"message": f"No run found with id '{run_id}'."}}), 404
+        outputs = body.get("tool_outputs", [])
+        run["_tool_output_tokens"] = sum(count_tokens(o.get("output", "")) for o in outputs)
+        run["_tool_call_done"] = True
+        run["required_action"] = None
+        run["status"] = "in_progress"
+        run["_ready_at"] = time.time() + config["latency"]["assistants.run"].get("median_ms", 0) / 2000.0
+        return _run_object(run)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline OpenAI stand-in server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("OPENAI_STUB_PORT", "8089")))
+    parser.add_argument("--config", default=os.getenv("OPENAI_STUB_CONFIG"))
+    args = parser.parse_args()
+    load_config(args.config)
+    load_fixtures()
+    print(f"Starting OpenAI stub on {args.host}:{args.port} with {len(_fixtures)} fixture(s)")
+    app.run(host=args.host, port=args.port, threaded=True)
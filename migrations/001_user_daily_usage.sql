@@ -0,0 +1,44 @@
+-- migrations/001_user_daily_usage.sql
+--
+-- Per-user daily usage rollup (see UserDailyUsage in models/sql_models.py).
+-- Backfills the rollup and users.total_tokens_used from openai_usage_logs.
+--
+-- openai_usage_logs.cost is widened to the rollup's NUMERIC(12, 6) first, so
+-- new per-call costs (often well under a cent) are no longer rounded to 0.00
+-- and the log and the rollup add up to the same totals. Rows logged before
+-- this migration were already rounded to cents and stay that way.
+
+BEGIN;
+
+ALTER TABLE openai_usage_logs ALTER COLUMN cost TYPE NUMERIC(12, 6);
+
+CREATE TABLE IF NOT EXISTS user_daily_usage (
+    user_id           INTEGER      NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    usage_date        DATE         NOT NULL,
+    model             VARCHAR(255) NOT NULL,
+    prompt_tokens     BIGINT       NOT NULL DEFAULT 0,
+    completion_tokens BIGINT       NOT NULL DEFAULT 0,
+    total_tokens      BIGINT       NOT NULL DEFAULT 0,
+    cost              NUMERIC(12, 6) NOT NULL DEFAULT 0,
+    calls             INTEGER      NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, usage_date, model)
+);
+
+INSERT INTO user_daily_usage (user_id, usage_date, model, prompt_tokens, completion_tokens, total_tokens, cost, calls)
+SELECT user_id, created_at::date, model,
+       SUM(prompt_tokens), SUM(completion_tokens), SUM(total_tokens), SUM(cost), COUNT(*)
+FROM openai_usage_logs
+GROUP BY user_id, created_at::date, model
+ON CONFLICT (user_id, usage_date, model) DO UPDATE SET
+    prompt_tokens     = EXCLUDED.prompt_tokens,
+    completion_tokens = EXCLUDED.completion_tokens,
+    total_tokens      = EXCLUDED.total_tokens,
+    cost              = EXCLUDED.cost,
+    calls             = EXCLUDED.calls;
+
+UPDATE users u
+SET total_tokens_used = t.total
+FROM (SELECT user_id, SUM(total_tokens) AS total FROM user_daily_usage GROUP BY user_id) t
+WHERE u.user_id = t.user_id;
+
+COMMIT;
@@ -0,0 +1,63 @@
+-- migrations/002_compact_embeddings.sql
+--
+-- Reduced-dimension, half-precision embedding columns (EMBEDDING_STORAGE=compact).
+-- Requires pgvector >= 0.7 (halfvec, subvector, l2_normalize).
+--
+-- text-embedding-3 vectors can be shortened by keeping the first N dimensions
+-- and re-normalizing; this is what the API's `dimensions` parameter returns, so
+-- existing rows are backfilled from the full vectors without calling OpenAI.
+--
+-- The dimension must equal COMPACT_EMBEDDING_DIMENSIONS (config.py, default
+-- 1024), which sizes the HALFVEC columns in models/sql_models.py and the
+-- `dimensions` requested from OpenAI. Pass the same value to psql:
+--   psql -v compact_dims="$COMPACT_EMBEDDING_DIMENSIONS" -f migrations/002_compact_embeddings.sql
+-- Without -v the default of 1024 is used. Changing the dimension later means
+-- dropping and re-adding both columns, then running this file again.
+--
+-- Rollout:
+--   1. run this file (safe to re-run; the backfill only touches NULL rows)
+--   2. run benchmarks/embedding_recall.py and check tag agreement
+--   3. deploy with EMBEDDING_STORAGE=compact
+--   4. once nothing reads them any more, drop the full columns (step 4 below)
+
+\if :{?compact_dims}
+\else
+    \set compact_dims 1024
+\endif
+-- Read back by the batched backfill below, which psql does not interpolate into
+SELECT set_config('compact_embeddings.dims', :'compact_dims', false);
+
+ALTER TABLE condition_embeddings ADD COLUMN IF NOT EXISTS embedding_half halfvec(:compact_dims);
+ALTER TABLE tags ADD COLUMN IF NOT EXISTS embeddings_half halfvec(:compact_dims);
+
+-- Backfill tags (small) in one statement
+UPDATE tags
+SET embeddings_half = l2_normalize(subvector(embeddings, 1, :compact_dims))::halfvec
+WHERE embeddings IS NOT NULL AND embeddings_half IS NULL;
+
+-- Backfill condition embeddings in batches of 5,000 rows, committing each batch
+-- so the table is never locked for the whole run (PostgreSQL 11+).
+DO $$
+DECLARE
+    dims    INTEGER := current_setting('compact_embeddings.dims')::integer;
+    updated INTEGER;
+BEGIN
+    LOOP
+        UPDATE condition_embeddings
+        SET embedding_half = l2_normalize(subvector(embedding, 1, dims))::halfvec
+        WHERE embedding_id IN (
+            SELECT embedding_id FROM condition_embeddings
+            WHERE embedding IS NOT NULL AND embedding_half IS NULL
+            LIMIT 5000
+        );
+        GET DIAGNOSTICS updated = ROW_COUNT;
+        EXIT WHEN updated = 0;
+        COMMIT;
+    END LOOP;
+END $$;
+
+-- Step 4 (run manually after the switch has been verified):
+-- ALTER TABLE condition_embeddings DROP COLUMN embedding;
+-- ALTER TABLE tags DROP COLUMN embeddings;
+-- VACUUM FULL condition_embeddings;
+-- VACUUM FULL tags;
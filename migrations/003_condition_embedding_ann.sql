@@ -0,0 +1,68 @@
+-- migrations/003_condition_embedding_ann.sql
+--
+-- Per-user approximate nearest-neighbour search over condition_embeddings
+-- (helpers/condition_search.py). Requires pgvector >= 0.7 for halfvec HNSW;
+-- hnsw.iterative_scan needs >= 0.8 (set SEMANTIC_SEARCH_ITERATIVE_SCAN=off otherwise).
+-- Run outside a transaction block: CREATE INDEX CONCURRENTLY cannot run inside one.
+-- Run it after deploying the code that writes condition_embeddings.user_id:
+-- step 3 makes the column NOT NULL, which fails inserts from older code.
+
+-- 1) Denormalized owner so the vector index and the user filter are on one table
+ALTER TABLE condition_embeddings
+    ADD COLUMN IF NOT EXISTS user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE;
+
+UPDATE condition_embeddings ce
+SET user_id = c.user_id
+FROM conditions c
+WHERE c.condition_id = ce.condition_id AND ce.user_id IS NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_condition_embeddings_user_id
+    ON condition_embeddings (user_id);
+
+-- 2) HNSW index on the column searched in the current EMBEDDING_STORAGE mode.
+--    vector HNSW is limited to 2,000 dimensions, so full 3,072-dim rows are indexed as halfvec.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_condition_embeddings_hnsw_full
+    ON condition_embeddings USING hnsw ((embedding::halfvec(3072)) halfvec_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
+
+-- EMBEDDING_STORAGE=compact (after migrations/002_compact_embeddings.sql):
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_condition_embeddings_hnsw_half
+    ON condition_embeddings USING hnsw (embedding_half halfvec_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
+
+-- 3) Second backfill pass for rows inserted without user_id while the steps
+--    above ran, then make the column NOT NULL so none can be added later (a
+--    NULL user_id row is invisible to the per-user search). The validated
+--    CHECK lets SET NOT NULL skip its table scan under the exclusive lock
+--    (PostgreSQL 12+).
+UPDATE condition_embeddings ce
+SET user_id = c.user_id
+FROM conditions c
+WHERE c.condition_id = ce.condition_id AND ce.user_id IS NULL;
+
+-- Embeddings of conditions without an owner are unreachable by any search:
+-- move them to condition_embeddings_orphaned (no constraints or foreign keys)
+-- and report how many were moved. Review and drop that table once checked.
+CREATE TABLE IF NOT EXISTS condition_embeddings_orphaned (LIKE condition_embeddings);
+ALTER TABLE condition_embeddings_orphaned
+    ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP NOT NULL DEFAULT now();
+
+DO $$
+DECLARE
+    archived INTEGER;
+BEGIN
+    WITH moved AS (
+        DELETE FROM condition_embeddings WHERE user_id IS NULL RETURNING *
+    )
+    INSERT INTO condition_embeddings_orphaned SELECT moved.*, now() FROM moved;
+    GET DIAGNOSTICS archived = ROW_COUNT;
+    RAISE NOTICE 'Archived % condition_embeddings row(s) without user_id into condition_embeddings_orphaned', archived;
+END $$;
+
+ALTER TABLE condition_embeddings
+    ADD CONSTRAINT condition_embeddings_user_id_not_null CHECK (user_id IS NOT NULL) NOT VALID;
+ALTER TABLE condition_embeddings VALIDATE CONSTRAINT condition_embeddings_user_id_not_null;
+ALTER TABLE condition_embeddings ALTER COLUMN user_id SET NOT NULL;
+ALTER TABLE condition_embeddings DROP CONSTRAINT condition_embeddings_user_id_not_null;
+
+ANALYZE condition_embeddings;
@@ -0,0 +1,17 @@
+-- migrations/004_embedding_cache.sql
+--
+-- Shared embedding cache (see EmbeddingCache in models/sql_models.py and
+-- helpers/embedding_cache.py). Vectors are stored without a fixed dimension
+-- so full and compact embeddings can share the table. The text itself is not
+-- stored (it holds patient findings); the sha256 key is enough for lookups.
+
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    cache_key       VARCHAR(64)  PRIMARY KEY,  -- sha256(model|dimensions|normalized text)
+    model           VARCHAR(255) NOT NULL,
+    dimensions      INTEGER      NOT NULL,
+    embedding       vector       NOT NULL,
+    created_at      TIMESTAMP    NOT NULL DEFAULT now()
+);
+
+-- Tables created by an earlier version of this file
+ALTER TABLE embedding_cache DROP COLUMN IF EXISTS normalized_text;
@@ -0,0 +1,17 @@
+-- migrations/005_tag_aliases.sql
+--
+-- Condition-name alias dictionary (see TagAlias in models/sql_models.py and
+-- helpers/tag_alias_index.py). Populate the seed aliases afterwards with
+-- `flask --app app seed-tag-aliases`.
+
+CREATE TABLE IF NOT EXISTS tag_aliases (
+    alias         VARCHAR(255) PRIMARY KEY,  -- normalized condition name
+    tag_id        INTEGER      NOT NULL REFERENCES tags (tag_id) ON DELETE CASCADE,
+    source        VARCHAR(20)  NOT NULL DEFAULT 'learned',  -- disability_name | learned | manual
+    hits          INTEGER      NOT NULL DEFAULT 1,
+    best_distance DOUBLE PRECISION,
+    ambiguous     BOOLEAN      NOT NULL DEFAULT false,
+    updated_at    TIMESTAMP    NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS ix_tag_aliases_tag_id ON tag_aliases (tag_id);
@@ -0,0 +1,23 @@
+-- migrations/006_page_checkpoints.sql
+--
+-- Per-page checkpoints for the extraction pipeline (FilePageCheckpoint,
+-- helpers/page_checkpoints.py) and idempotency keys for conditions created
+-- by the pipeline, so retried Celery tasks resume instead of starting over.
+--
+-- Run outside a transaction block: CREATE INDEX CONCURRENTLY cannot run inside one.
+
+CREATE TABLE IF NOT EXISTS file_page_checkpoints (
+    file_id        INTEGER   NOT NULL REFERENCES files (file_id) ON DELETE CASCADE,
+    page_number    INTEGER   NOT NULL,
+    ocr_text       TEXT,
+    classification JSON,
+    extraction     JSON,
+    updated_at     TIMESTAMP NOT NULL DEFAULT now(),
+    PRIMARY KEY (file_id, page_number)
+);
+
+ALTER TABLE conditions ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(64);
+
+-- Conditions created outside the pipeline keep a NULL key
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS conditions_idempotency_key_key
+    ON conditions (idempotency_key);
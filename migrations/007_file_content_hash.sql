@@ -0,0 +1,15 @@
+-- migrations/007_file_content_hash.sql
+--
+-- Per-user content hash of uploaded files, so /upload returns the existing
+-- file instead of reprocessing an identical upload
+-- (helpers/upload/dedupe_helpers.py), and the task ids of each file's latest
+-- pipeline run.
+--
+-- Run outside a transaction block: CREATE INDEX CONCURRENTLY cannot run inside one.
+
+ALTER TABLE files ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
+ALTER TABLE files ADD COLUMN IF NOT EXISTS task_ids JSON;
+
+-- Files uploaded before this migration keep a NULL hash
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS files_user_id_content_hash_key
+    ON files (user_id, content_hash);
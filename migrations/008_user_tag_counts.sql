@@ -0,0 +1,131 @@
+-- migrations/008_user_tag_counts.sql
+--
+-- Per-user tag counters for incremental nexus maintenance (UserTagCount in
+-- models/sql_models.py, sync_nexus_tags in helpers/sql_helpers.py).
+--
+-- user_tag_counts holds, for every (user, tag), how many of the user's tagged
+-- conditions are in service and how many are post service. Triggers keep it
+-- current as condition_tags rows are inserted, updated or deleted and as
+-- conditions are deleted or change user/in_service, and flag every changed
+-- row with needs_nexus_check. Nexus recomputes then only look at the flagged
+-- rows instead of re-aggregating the user's whole history.
+--
+-- Conditions with in_service NULL are not counted, matching the old
+-- aggregate, which only counted TRUE and FALSE.
+--
+-- Run in a single transaction (e.g. `psql -1 -f`): CREATE TRIGGER locks out
+-- writes to conditions and condition_tags until commit, so the backfill at the
+-- end sees exactly the rows the triggers have not counted.
+
+CREATE TABLE IF NOT EXISTS user_tag_counts (
+    user_id            INTEGER NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+    tag_id             INTEGER NOT NULL REFERENCES tags (tag_id) ON DELETE CASCADE,
+    in_service_count   INTEGER NOT NULL DEFAULT 0,
+    post_service_count INTEGER NOT NULL DEFAULT 0,
+    needs_nexus_check  BOOLEAN NOT NULL DEFAULT false,
+    PRIMARY KEY (user_id, tag_id)
+);
+
+CREATE INDEX IF NOT EXISTS ix_user_tag_counts_needs_nexus_check
+    ON user_tag_counts (user_id) WHERE needs_nexus_check;
+
+-- Adds `delta` to the counter of (user, tag) selected by in_service
+CREATE OR REPLACE FUNCTION user_tag_counts_apply(p_user_id INTEGER, p_tag_id INTEGER, p_in_service BOOLEAN, p_delta INTEGER)
+RETURNS void LANGUAGE plpgsql AS $$
+BEGIN
+    IF p_user_id IS NULL OR p_tag_id IS NULL OR p_in_service IS NULL THEN
+        RETURN;
+    END IF;
+    INSERT INTO user_tag_counts AS c (user_id, tag_id, in_service_count, post_service_count, needs_nexus_check)
+    VALUES (
+        p_user_id, p_tag_id,
+        CASE WHEN p_in_service THEN p_delta ELSE 0 END,
+        CASE WHEN p_in_service THEN 0 ELSE p_delta END,
+        true
+    )
+    ON CONFLICT (user_id, tag_id) DO UPDATE SET
+        in_service_count   = c.in_service_count + EXCLUDED.in_service_count,
+        post_service_count = c.post_service_count + EXCLUDED.post_service_count,
+        needs_nexus_check  = true;
+END;
+$$;
+
+-- condition_tags rows
+CREATE OR REPLACE FUNCTION user_tag_counts_condition_tags_trg()
+RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    cond RECORD;
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        -- When the condition itself is being deleted it is no longer visible
+        -- here; user_tag_counts_conditions_delete_trg already counted it out
+        SELECT user_id, in_service INTO cond FROM conditions WHERE condition_id = OLD.condition_id;
+        IF FOUND THEN
+            PERFORM user_tag_counts_apply(cond.user_id, OLD.tag_id, cond.in_service, -1);
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT user_id, in_service INTO cond FROM conditions WHERE condition_id = NEW.condition_id;
+        IF FOUND THEN
+            PERFORM user_tag_counts_apply(cond.user_id, NEW.tag_id, cond.in_service, 1);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS user_tag_counts_condition_tags ON condition_tags;
+CREATE TRIGGER user_tag_counts_condition_tags
+    AFTER INSERT OR UPDATE OR DELETE ON condition_tags
+    FOR EACH ROW EXECUTE FUNCTION user_tag_counts_condition_tags_trg();
+
+-- Deleted conditions: counted out while their condition_tags rows still exist
+CREATE OR REPLACE FUNCTION user_tag_counts_conditions_delete_trg()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM user_tag_counts_apply(OLD.user_id, ct.tag_id, OLD.in_service, -1)
+    FROM condition_tags ct
+    WHERE ct.condition_id = OLD.condition_id;
+    RETURN OLD;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS user_tag_counts_conditions_delete ON conditions;
+CREATE TRIGGER user_tag_counts_conditions_delete
+    BEFORE DELETE ON conditions
+    FOR EACH ROW EXECUTE FUNCTION user_tag_counts_conditions_delete_trg();
+
+-- Conditions moved to another user or between in service and post service
+CREATE OR REPLACE FUNCTION user_tag_counts_conditions_update_trg()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM user_tag_counts_apply(OLD.user_id, ct.tag_id, OLD.in_service, -1),
+            user_tag_counts_apply(NEW.user_id, ct.tag_id, NEW.in_service, 1)
+    FROM condition_tags ct
+    WHERE ct.condition_id = NEW.condition_id;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS user_tag_counts_conditions_update ON conditions;
+CREATE TRIGGER user_tag_counts_conditions_update
+    AFTER UPDATE OF user_id, in_service ON conditions
+    FOR EACH ROW
+    WHEN (OLD.user_id IS DISTINCT FROM NEW.user_id OR OLD.in_service IS DISTINCT FROM NEW.in_service)
+    EXECUTE FUNCTION user_tag_counts_conditions_update_trg();
+
+-- Backfill from the existing data; every row is checked on the user's next recompute
+INSERT INTO user_tag_counts (user_id, tag_id, in_service_count, post_service_count, needs_nexus_check)
+SELECT c.user_id,
+       ct.tag_id,
+       count(*) FILTER (WHERE c.in_service IS TRUE),
+       count(*) FILTER (WHERE c.in_service IS FALSE),
+       true
+FROM condition_tags ct
+JOIN conditions c ON c.condition_id = ct.condition_id
+WHERE c.user_id IS NOT NULL
+GROUP BY c.user_id, ct.tag_id
+ON CONFLICT (user_id, tag_id) DO UPDATE SET
+    in_service_count   = EXCLUDED.in_service_count,
+    post_service_count = EXCLUDED.post_service_count,
+    needs_nexus_check  = true;
@@ -0,0 +1,30 @@
+-- migrations/009_nexus_tags_active_unique.sql
+--
+-- At most one active (non-revoked) nexus_tags row per user and tag. Concurrent
+-- recomputes used to be able to insert the same row twice; the bulk recompute
+-- (helpers/nexus_bulk.py) relies on this index for INSERT ... ON CONFLICT DO NOTHING.
+--
+-- Run outside a transaction block: CREATE INDEX CONCURRENTLY cannot run inside one.
+--
+-- If a duplicate is inserted between the UPDATE and the index build, the build
+-- fails and leaves an INVALID index behind, which IF NOT EXISTS then silently
+-- skips on a rerun. After a failure, check for one:
+--   SELECT indisvalid FROM pg_index WHERE indexrelid = 'nexus_tags_active_user_tag_key'::regclass;
+-- and if it is false, drop it and run this whole file again:
+--   DROP INDEX CONCURRENTLY IF EXISTS nexus_tags_active_user_tag_key;
+
+-- Revoke the duplicates, keeping the earliest discovery of each tag
+UPDATE nexus_tags n
+SET revoked_at = now()
+WHERE n.revoked_at IS NULL
+  AND EXISTS (
+      SELECT 1 FROM nexus_tags d
+      WHERE d.user_id = n.user_id
+        AND d.tag_id = n.tag_id
+        AND d.revoked_at IS NULL
+        AND (d.discovered_at, d.nexus_tags_id) < (n.discovered_at, n.nexus_tags_id)
+  );
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS nexus_tags_active_user_tag_key
+    ON nexus_tags (user_id, tag_id)
+    WHERE revoked_at IS NULL;
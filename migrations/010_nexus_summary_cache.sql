@@ -0,0 +1,99 @@
+-- migrations/010_nexus_summary_cache.sql
+--
+-- nexus_summaries as a cache of /generate_nexus_summary
+-- (helpers/nexus_summary_cache.py): one row per nexus tag, flagged
+-- needs_update by triggers whenever a condition linked to that tag changes.
+-- `version` is bumped with every flag, so a summary generated while the
+-- conditions were changing is stored but stays flagged.
+--
+-- Run outside a transaction block: CREATE INDEX CONCURRENTLY cannot run inside one.
+
+ALTER TABLE nexus_summaries ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0;
+
+-- Keep the newest summary of each nexus tag
+DELETE FROM nexus_summaries s
+USING nexus_summaries newer
+WHERE s.nexus_tags_id = newer.nexus_tags_id
+  AND s.nexus_summary_id < newer.nexus_summary_id;
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS nexus_summaries_nexus_tags_id_key
+    ON nexus_summaries (nexus_tags_id);
+
+-- Flags the summary of the user's active nexus tag for this tag, if any
+CREATE OR REPLACE FUNCTION nexus_summaries_mark_stale(p_user_id INTEGER, p_tag_id INTEGER)
+RETURNS void LANGUAGE plpgsql AS $$
+BEGIN
+    IF p_user_id IS NULL OR p_tag_id IS NULL THEN
+        RETURN;
+    END IF;
+    UPDATE nexus_summaries s
+    SET needs_update = true, version = s.version + 1
+    FROM nexus_tags n
+    WHERE s.nexus_tags_id = n.nexus_tags_id
+      AND n.user_id = p_user_id
+      AND n.tag_id = p_tag_id
+      AND n.revoked_at IS NULL;
+END;
+$$;
+
+-- Conditions linked to or unlinked from a tag
+CREATE OR REPLACE FUNCTION nexus_summaries_condition_tags_trg()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    -- A condition being deleted is no longer visible here;
+    -- nexus_summaries_conditions_trg already flagged its tags
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        PERFORM nexus_summaries_mark_stale(c.user_id, OLD.tag_id)
+        FROM conditions c WHERE c.condition_id = OLD.condition_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM nexus_summaries_mark_stale(c.user_id, NEW.tag_id)
+        FROM conditions c WHERE c.condition_id = NEW.condition_id;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS nexus_summaries_condition_tags ON condition_tags;
+CREATE TRIGGER nexus_summaries_condition_tags
+    AFTER INSERT OR UPDATE OR DELETE ON condition_tags
+    FOR EACH ROW EXECUTE FUNCTION nexus_summaries_condition_tags_trg();
+
+-- Tagged conditions edited or deleted
+CREATE OR REPLACE FUNCTION nexus_summaries_conditions_trg()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM nexus_summaries_mark_stale(OLD.user_id, ct.tag_id)
+    FROM condition_tags ct WHERE ct.condition_id = OLD.condition_id;
+    IF TG_OP = 'UPDATE' AND NEW.user_id IS DISTINCT FROM OLD.user_id THEN
+        PERFORM nexus_summaries_mark_stale(NEW.user_id, ct.tag_id)
+        FROM condition_tags ct WHERE ct.condition_id = NEW.condition_id;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS nexus_summaries_conditions_delete ON conditions;
+CREATE TRIGGER nexus_summaries_conditions_delete
+    BEFORE DELETE ON conditions
+    FOR EACH ROW EXECUTE FUNCTION nexus_summaries_conditions_trg();
+
+-- Only the columns in the summary prompt (nexus_conditions in
+-- helpers/nexus_summary_cache.py) and the owner; keep the two lists in sync
+DROP TRIGGER IF EXISTS nexus_summaries_conditions_update ON conditions;
+CREATE TRIGGER nexus_summaries_conditions_update
+    AFTER UPDATE OF user_id, condition_name, date_of_visit, medical_professionals,
+                    treatments, findings, comments, in_service ON conditions
+    FOR EACH ROW
+    WHEN (OLD.user_id IS DISTINCT FROM NEW.user_id
+          OR OLD.condition_name IS DISTINCT FROM NEW.condition_name
+          OR OLD.date_of_visit IS DISTINCT FROM NEW.date_of_visit
+          OR OLD.medical_professionals IS DISTINCT FROM NEW.medical_professionals
+          OR OLD.treatments IS DISTINCT FROM NEW.treatments
+          OR OLD.findings IS DISTINCT FROM NEW.findings
+          OR OLD.comments IS DISTINCT FROM NEW.comments
+          OR OLD.in_service IS DISTINCT FROM NEW.in_service)
+    EXECUTE FUNCTION nexus_summaries_conditions_trg();
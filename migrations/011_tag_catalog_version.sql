@@ -0,0 +1,27 @@
+-- migrations/011_tag_catalog_version.sql
+--
+-- Cheap change detection for the worker-resident tag index (helpers/tag_index.py).
+-- Every statement that writes to tags bumps tag_catalog_version.version, so
+-- the index's periodic freshness check reads one integer instead of hashing
+-- every tag vector.
+
+CREATE TABLE IF NOT EXISTS tag_catalog_version (
+    id      INTEGER PRIMARY KEY CHECK (id = 1),
+    version BIGINT  NOT NULL DEFAULT 0
+);
+
+INSERT INTO tag_catalog_version (id, version) VALUES (1, 0)
+ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION tag_catalog_version_bump()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE tag_catalog_version SET version = version + 1 WHERE id = 1;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS tag_catalog_version_bump ON tags;
+CREATE TRIGGER tag_catalog_version_bump
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON tags
+    FOR EACH STATEMENT EXECUTE FUNCTION tag_catalog_version_bump();
@@ -6,9 +6,11 @@ import random
 import string
 
 from database import db, bcrypt
-from pgvector.sqlalchemy import Vector
+from pgvector.sqlalchemy import Vector, HALFVEC
+from config import Config
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy import Table, Column, Integer, ForeignKey, String, DateTime, func, Text
+from sqlalchemy.orm import deferred
 
 
 class Users(db.Model):
@@ -63,9 +65,33 @@ class File(db.Model):
     file_size = db.Column(db.Integer, nullable=True)
     file_category = db.Column(db.String(50), nullable=False)
     status = db.Column(db.String(50), nullable=False, default='Uploading')
+    # sha256 of the uploaded bytes, unique per user (helpers/upload/dedupe_helpers.py)
+    content_hash = db.Column(db.String(64), nullable=True)
+    # Celery task ids of the latest pipeline run, returned for duplicate uploads
+    task_ids = db.Column(db.JSON, nullable=True)
 
     user = db.relationship('Users', back_populates='files', lazy='select')
 
+    __table_args__ = (
+        db.Index('files_user_id_content_hash_key', 'user_id', 'content_hash', unique=True),
+    )
+
+
+class FilePageCheckpoint(db.Model):
+    """
+    Durable per-page progress of the extraction pipeline, so a retried task
+    resumes at the first incomplete page instead of re-running OCR and OpenAI
+    calls (see helpers/page_checkpoints.py).
+    """
+    __tablename__ = 'file_page_checkpoints'
+
+    file_id = db.Column(db.Integer, db.ForeignKey('files.file_id', ondelete='CASCADE'), primary_key=True)
+    page_number = db.Column(db.Integer, primary_key=True)
+    ocr_text = deferred(db.Column(db.Text, nullable=True))
+    classification = db.Column(db.JSON, nullable=True)  # PageClassification.dict()
+    extraction = deferred(db.Column(db.JSON, nullable=True))  # {'page', 'category', 'details'}
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 
 class ServicePeriod(db.Model):
     __tablename__ = 'service_periods'
@@ -103,6 +129,8 @@ class Conditions(db.Model):
     comments = db.Column(db.TEXT, nullable=True)
     is_ratable = db.Column(db.Boolean, nullable=True, default=True)
     in_service = db.Column(db.Boolean, nullable=False, default=False)
+    # sha256 of file/page/visit/diagnosis position; a retried task skips diagnoses already stored
+    idempotency_key = db.Column(db.String(64), nullable=True, unique=True)
 
     user = db.relationship('Users', back_populates='conditions', lazy='select')
     embedding = db.relationship("ConditionEmbedding", back_populates="conditions", uselist=False, lazy='select')
@@ -114,7 +142,12 @@ class ConditionEmbedding(db.Model):
     
     embedding_id = db.Column(db.Integer, primary_key=True)
     condition_id = db.Column(db.Integer, ForeignKey('conditions.condition_id', ondelete='CASCADE'), nullable=False)
-    embedding = db.Column(Vector(3072))  # Ensure pgvector is properly configured
+    # Copy of conditions.user_id so per-user vector search filters this table directly
+    user_id = db.Column(db.Integer, ForeignKey('users.user_id', ondelete='CASCADE'), nullable=False, index=True)
+    # Vector columns are deferred so that loading a row does not pull ~12 KB of floats
+    embedding = deferred(db.Column(Vector(3072)))  # Ensure pgvector is properly configured
+    # Reduced-dimension half-precision copy, used when EMBEDDING_STORAGE=compact
+    embedding_half = deferred(db.Column(HALFVEC(Config.COMPACT_EMBEDDING_DIMENSIONS), nullable=True))
     
     conditions = db.relationship("Conditions", back_populates="embedding", lazy='select')
 
@@ -126,7 +159,10 @@ class Tag(db.Model):
     code = db.Column(db.Integer, nullable=False)
     disability_name = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text)
-    embeddings = db.Column(Vector(3072))  # Ensure pgvector is properly configured
+    # Vector columns are deferred so that loading a row does not pull ~12 KB of floats
+    embeddings = deferred(db.Column(Vector(3072)))  # Ensure pgvector is properly configured
+    # Reduced-dimension half-precision copy, used when EMBEDDING_STORAGE=compact
+    embeddings_half = deferred(db.Column(HALFVEC(Config.COMPACT_EMBEDDING_DIMENSIONS), nullable=True))
     
     conditions = db.relationship(
         'Conditions',
@@ -135,6 +171,44 @@ class Tag(db.Model):
         lazy='select'
     )
 
+class EmbeddingCache(db.Model):
+    """
+    Shared cache of embeddings keyed by model, dimensions and normalized text
+    (see helpers/embedding_cache.py), so repeated condition texts are embedded once.
+    """
+    __tablename__ = 'embedding_cache'
+
+    cache_key = db.Column(db.String(64), primary_key=True)  # sha256(model|dimensions|normalized text)
+    model = db.Column(db.String(255), nullable=False)
+    dimensions = db.Column(db.Integer, nullable=False)
+    embedding = deferred(db.Column(Vector(), nullable=False))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<EmbeddingCache model={self.model} dimensions={self.dimensions} key={self.cache_key[:12]}>"
+
+class TagAlias(db.Model):
+    """
+    Normalized condition name -> tag_id, consulted before embedding a condition
+    (see helpers/tag_alias_index.py). Seeded from Tag.disability_name and
+    learned from high-confidence embedding matches; an alias seen with two
+    different tags is flagged ambiguous and no longer used.
+    """
+    __tablename__ = 'tag_aliases'
+
+    alias = db.Column(db.String(255), primary_key=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey('tags.tag_id', ondelete='CASCADE'), nullable=False)
+    source = db.Column(db.String(20), nullable=False, default='learned')  # disability_name | learned | manual
+    hits = db.Column(db.Integer, nullable=False, default=1)
+    best_distance = db.Column(db.Float, nullable=True)
+    ambiguous = db.Column(db.Boolean, nullable=False, default=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    tag = db.relationship('Tag', lazy='select')
+
+    def __repr__(self):
+        return f"<TagAlias alias={self.alias} tag_id={self.tag_id} source={self.source}>"
+
 class UserDecisionSaves(db.Model):
     __tablename__ = 'user_decision_saves'
 
@@ -173,6 +247,29 @@ class NexusTags(db.Model):
     tag = db.relationship('Tag', backref='nexus_tags', lazy='select')
     user = db.relationship('Users', backref='nexus_tags', lazy='select')
 
+    # One active row per user and tag (migrations/009_nexus_tags_active_unique.sql)
+    __table_args__ = (
+        db.Index(
+            'nexus_tags_active_user_tag_key', 'user_id', 'tag_id',
+            unique=True, postgresql_where=db.text('revoked_at IS NULL')
+        ),
+    )
+
+class UserTagCount(db.Model):
+    """
+    Per-user count of in-service and post-service conditions linked to each
+    tag, maintained by triggers on conditions and condition_tags
+    (migrations/008_user_tag_counts.sql). needs_nexus_check is set on every
+    change and cleared by sync_nexus_tags (helpers/sql_helpers.py).
+    """
+    __tablename__ = 'user_tag_counts'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id', ondelete='CASCADE'), primary_key=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey('tags.tag_id', ondelete='CASCADE'), primary_key=True)
+    in_service_count = db.Column(db.Integer, nullable=False, default=0)
+    post_service_count = db.Column(db.Integer, nullable=False, default=0)
+    needs_nexus_check = db.Column(db.Boolean, nullable=False, default=False)
+
 class NexusSummary(db.Model):
     __tablename__ = 'nexus_summaries'
 
@@ -181,11 +278,18 @@ class NexusSummary(db.Model):
     summary_text = db.Column(db.Text, nullable=True)
     condition_ids = db.Column(ARRAY(db.Integer), nullable=True)
     needs_update = db.Column(db.Boolean, default=False, nullable=False)
+    # Bumped by the triggers that set needs_update (migrations/010_nexus_summary_cache.sql)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, server_default=func.now(), nullable=False)
     updated_at = db.Column(db.DateTime, onupdate=func.now())
     # Relationship back to NexusTags
     nexus_tag = db.relationship('NexusTags', backref=db.backref('nexus_summaries', lazy='select', cascade='all, delete-orphan'))
 
+    # One cached summary per nexus tag (helpers/nexus_summary_cache.py)
+    __table_args__ = (
+        db.Index('nexus_summaries_nexus_tags_id_key', 'nexus_tags_id', unique=True),
+    )
+
 class RefreshToken(db.Model):
     __tablename__ = 'refresh_tokens'
 
@@ -273,7 +377,7 @@ class OpenAIUsageLog(db.Model):
     prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
     completion_tokens = db.Column(db.Integer, nullable=False, default=0)
     total_tokens = db.Column(db.Integer, nullable=False, default=0)
-    cost = db.Column(db.Numeric(10, 2), nullable=False, default=0.00)
+    cost = db.Column(db.Numeric(12, 6), nullable=False, default=0.00)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
     # Optional relationship back to Users
@@ -282,6 +386,26 @@ class OpenAIUsageLog(db.Model):
     def __repr__(self):
         return f"<OpenAIUsageLog usage_id={self.usage_id} user_id={self.user_id} model={self.model}>"
 
+class UserDailyUsage(db.Model):
+    """
+    Per-user, per-day, per-model rollup of openai_usage_logs. Maintained
+    incrementally by record_usage() in llm_wrappers.py so that spend and
+    usage history never have to scan the raw log table.
+    """
+    __tablename__ = 'user_daily_usage'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id', ondelete='CASCADE'), primary_key=True)
+    usage_date = db.Column(db.Date, primary_key=True)
+    model = db.Column(db.String(255), primary_key=True)
+    prompt_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    completion_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    total_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    cost = db.Column(db.Numeric(12, 6), nullable=False, default=0)
+    calls = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<UserDailyUsage user_id={self.user_id} date={self.usage_date} model={self.model}>"
+
 class ChatThread(db.Model):
     __tablename__ = 'chat_threads'
 
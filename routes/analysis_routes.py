@@ -6,6 +6,8 @@ import time
 import logging
 from helpers.llm_helpers import *
 from helpers.azure_helpers import *
+from helpers.text_ext_helpers import process_document
+from helpers.sse_helpers import wants_event_stream, sse_response
 
 # Create a Blueprint for analysis routes
 analysis_bp = Blueprint('analysis_bp', __name__)
@@ -31,15 +33,24 @@ def analyze_document():
         if file_content is None:
             return jsonify({"error": "Failed to download document."}), 500
 
-        # Process the document to extract text content
+        # Process the document to extract text content (PDFs come back one string per page)
         text_content = process_document(file_content, file_record.file_type)
-
-        # Generate a summary of the document
-        summary = generate_summary(text_content)
+        if isinstance(text_content, list):
+            text_content = "\n".join(text_content)
 
         # Determine the document type (e.g., In-Service or Post-Service)
         document_type = file_record.file_category
 
+        # Stream the summary over SSE when the client asks for it (?stream=1 or Accept: text/event-stream)
+        if wants_event_stream():
+            return sse_response(
+                stream_summary(file_record.user_id, text_content),
+                done_payload={"document_id": document_id, "document_type": document_type}
+            )
+
+        # Generate a summary of the document
+        summary = generate_summary(file_record.user_id, text_content)
+
         # Return the summary and document type
         return jsonify({
             "document_id": document_id,
@@ -8,12 +8,11 @@ import traceback
 from helpers.cors_helpers import cors_preflight
 import uuid
 from datetime import datetime
-from openai import OpenAI
+from helpers.openai_client import get_openai_client
 import os
 
 # Initialize the OpenAI client & forced update.
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY)
+client = get_openai_client()
 
 chatbot_bp = Blueprint("chatbot_bp", __name__)
 
@@ -1,10 +1,14 @@
 # credit_routes.py
 
+from datetime import datetime, timedelta
 from flask import Blueprint, request, jsonify, g
-from models.sql_models import Users
+from models.sql_models import Users, UserDailyUsage
 
 credits_bp = Blueprint('credits_bp', __name__)
 
+# Longest history /credits/usage will return
+MAX_USAGE_HISTORY_DAYS = 366
+
 @credits_bp.route("/credits", methods=["GET"])
 def get_user_credits():
     """
@@ -13,7 +17,8 @@ def get_user_credits():
     Returns a JSON object with the user's remaining credits if found.
     Example response:
     {
-        "credits_remaining": 10
+        "credits_remaining": 10,
+        "total_tokens_used": 125000
     }
     """
     try:
@@ -28,9 +33,78 @@ def get_user_credits():
             return jsonify({"error": f"No user found with userUUID={user_uuid}"}), 404
 
         # 3) Return the user's remaining credits
-        return jsonify({"credits_remaining": user.credits_remaining}), 200
+        return jsonify({
+            "credits_remaining": user.credits_remaining,
+            "total_tokens_used": user.total_tokens_used
+        }), 200
     
     except Exception as e:
         print("[ERROR] An exception occurred in /credits route:")
         # Log or print stack trace if needed
         return jsonify({"error": str(e)}), 500
+
+
+@credits_bp.route("/credits/usage", methods=["GET"])
+def get_user_usage_history():
+    """
+    GET /credits/usage?userUUID=<the user's UUID>&days=30
+
+    Returns the user's daily usage history from the user_daily_usage rollup
+    (one row per day and model), so the cost does not grow with openai_usage_logs.
+    Example response:
+    {
+        "days": 30,
+        "totals": {"total_tokens": 52000, "cost": "0.41", "calls": 37},
+        "history": [
+            {"date": "2025-01-14", "model": "gpt-4o", "prompt_tokens": 40000,
+             "completion_tokens": 9000, "total_tokens": 49000, "cost": "0.19", "calls": 12},
+            ...
+        ]
+    }
+    """
+    try:
+        user_uuid = request.args.get("userUUID", None)
+        if not user_uuid:
+            return jsonify({"error": "Missing userUUID query parameter"}), 400
+
+        try:
+            days = int(request.args.get("days", 30))
+        except ValueError:
+            return jsonify({"error": "days must be an integer"}), 400
+        days = max(1, min(days, MAX_USAGE_HISTORY_DAYS))
+
+        user = g.session.query(Users).filter_by(user_uuid=user_uuid).first()
+        if not user:
+            return jsonify({"error": f"No user found with userUUID={user_uuid}"}), 404
+
+        since = datetime.utcnow().date() - timedelta(days=days - 1)
+        rows = (
+            g.session.query(UserDailyUsage)
+            .filter(UserDailyUsage.user_id == user.user_id, UserDailyUsage.usage_date >= since)
+            .order_by(UserDailyUsage.usage_date.desc(), UserDailyUsage.model)
+            .all()
+        )
+
+        history = [
+            {
+                "date": row.usage_date.isoformat(),
+                "model": row.model,
+                "prompt_tokens": row.prompt_tokens,
+                "completion_tokens": row.completion_tokens,
+                "total_tokens": row.total_tokens,
+                "cost": str(row.cost),
+                "calls": row.calls,
+            }
+            for row in rows
+        ]
+        totals = {
+            "total_tokens": sum(row.total_tokens for row in rows),
+            "cost": str(sum((row.cost for row in rows), 0)),
+            "calls": sum(row.calls for row in rows),
+        }
+
+        return jsonify({"days": days, "totals": totals, "history": history}), 200
+
+    except Exception as e:
+        print("[ERROR] An exception occurred in /credits/usage route:")
+        return jsonify({"error": str(e)}), 500
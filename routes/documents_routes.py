@@ -44,11 +44,17 @@ from config import Config
 from helpers.upload.validation_helper import validate_and_setup_request
 from helpers.upload.usr_svcp_helpers import get_user_and_service_periods
 from helpers.sql_helpers import discover_nexus_tags, revoke_nexus_tags_if_invalid
+from helpers.nexus_finalize import recompute_nexus_tags
 from celery import chain
 from helpers.upload.upload_logic import can_user_afford_files
+from helpers.upload.dedupe_helpers import (
+    file_content_hash, is_force_reprocess, find_file_by_hash, duplicate_response,
+    can_reprocess, reset_file_for_reprocessing
+)
+from sqlalchemy.exc import IntegrityError
 
 # Import your Celery tasks
-from celery_app import extraction_task, process_pages_task, finalize_task
+from celery_app import celery, extraction_task, process_pages_task, finalize_task, pipeline_failed_task, pipeline_queues
 
 # Create a blueprint for document routes
 document_bp = Blueprint('document_bp', __name__)
@@ -96,12 +102,54 @@ def upload():
             print(f"Saved file '{uploaded_file.filename}' to temp path '{temp_file_path}'")
             temp_file_paths.append(temp_file_path)
 
+        # This will store info about each file we process
+        uploaded_urls = []
+
         # ------------------------------------------------
-        # 2b) **Check credits** using the local temp files
-        # create a list of temp file paths for each uploaded file
+        # 2b) Deduplicate by content hash (helpers/upload/dedupe_helpers.py).
+        #     A file the user already uploaded is returned as-is while it is
+        #     in flight or complete; a failed one (or, with force=true, a
+        #     complete or stuck one) is reprocessed in place.
         # ------------------------------------------------
+        force = is_force_reprocess(request)
+        to_process = []  # (uploaded_file, temp_file_path, content_hash, existing File or None)
+        seen_hashes = set()
+        later_copies = {}  # content_hash -> copies after the first one in this request
+        first_entries = {}  # content_hash -> response entry of the first copy
+        for uploaded_file, temp_file_path in zip(uploaded_files, temp_file_paths):
+            content_hash = file_content_hash(temp_file_path)
+            if content_hash in seen_hashes:
+                # Answered once the first copy has its file_id (end of step 3)
+                later_copies[content_hash] = later_copies.get(content_hash, 0) + 1
+                try:
+                    os.remove(temp_file_path)
+                except OSError:
+                    pass
+                continue
+            seen_hashes.add(content_hash)
+
+            existing = find_file_by_hash(g.session, user.user_id, content_hash)
+            reprocess = existing is not None and can_reprocess(existing, force)
+
+            if existing is not None and not reprocess:
+                logging.info(f"Duplicate upload of file_id={existing.file_id} ({existing.status}); not reprocessing")
+                uploaded_urls.append(duplicate_response(existing))
+                first_entries[content_hash] = uploaded_urls[-1]
+                try:
+                    os.remove(temp_file_path)
+                except OSError:
+                    pass
+                continue
+
+            to_process.append((uploaded_file, temp_file_path, content_hash, existing if reprocess else None))
+
+        # ------------------------------------------------
+        # 2c) **Check credits** using the local temp files
+        # of the files that will actually be processed
+        # ------------------------------------------------
+        process_paths = [item[1] for item in to_process]
         try:
-            affordable, total_pages, required_credits = can_user_afford_files(user, temp_file_paths)
+            affordable, total_pages, required_credits = can_user_afford_files(user, process_paths)
         except ValueError as ve:
             return jsonify({"error": str(ve)}), 400
         except Exception as e:
@@ -109,7 +157,7 @@ def upload():
 
         if not affordable:
             # If user cannot afford them, remove temp files and return error
-            for path in temp_file_paths:
+            for path in process_paths:
                 try:
                     os.remove(path)
                 except OSError:
@@ -122,61 +170,99 @@ def upload():
                 )
             }), 403
 
-        # This will store info about each file we process
-        uploaded_urls = []
-
         # ------------------------------------------------
         # 3) Now that we know user can afford them,
         #    process each temp file: upload to Azure, DB, etc.
         # ------------------------------------------------
-        for i, uploaded_file in enumerate(uploaded_files):
-            temp_file_path = temp_file_paths[i]
-
-            # Determine file type based on extension
-            file_extension = os.path.splitext(uploaded_file.filename)[1].lower()
-            file_type_mapping = {
-                '.pdf': 'pdf',
-                '.jpg': 'image',
-                '.jpeg': 'image',
-                '.png': 'image',
-                '.mp4': 'video',
-                '.mov': 'video',
-                '.mp3': 'audio'
-            }
-            file_type = file_type_mapping.get(file_extension, 'unknown')
-            logging.info(f"Determined file type '{file_type}' for extension '{file_extension}'")
-            print(f"Determined file type '{file_type}' for extension '{file_extension}'")
-
-            category = 'Unclassified'
-
-            # 3a) Upload file to Azure
-            blob_name = f"{user_uuid}/{category}/{uploaded_file.filename}"
-            blob_url = upload_file_to_azure(temp_file_path, blob_name)
-            logging.info(f"Uploaded file to Azure Blob Storage: {blob_url}")
-            print(f"Uploaded file to Azure Blob Storage: {blob_url}")
-
-            # 3b) Create DB record
-            new_file = File(
-                user_id=user.user_id,
-                file_name=uploaded_file.filename,
-                file_type=file_type,
-                file_url=blob_url,
-                file_date=datetime.now().date(),
-                uploaded_at=datetime.utcnow(),
-                file_size=os.path.getsize(temp_file_path),
-                file_category=category,
-                status="Uploading",
-            )
-            g.session.add(new_file)
-            g.session.flush()  # get new_file.file_id
-            file_id = new_file.file_id
-            g.session.commit()
-
-            logging.info(f"Inserted new file record with file_id={file_id}")
-            print(f"Inserted new file record with file_id={file_id}")
+        for uploaded_file, temp_file_path, content_hash, existing in to_process:
+
+            if existing is not None:
+                # 3a') Reprocess the existing file in place: same row, same blob
+                old_task_ids = [tid for tid in (existing.task_ids or {}).values() if tid]
+                if not reset_file_for_reprocessing(g.session, existing, force):
+                    # A concurrent request reprocesses it (or its status changed)
+                    g.session.commit()
+                    uploaded_urls.append(duplicate_response(existing))
+                    first_entries[content_hash] = uploaded_urls[-1]
+                    try:
+                        os.remove(temp_file_path)
+                    except OSError:
+                        pass
+                    continue
+                g.session.commit()
+                if old_task_ids:
+                    # A stuck run's tasks must not run (or finalize) after the new one starts
+                    celery.control.revoke(old_task_ids, terminate=True)
+                file_record = existing
+                file_id, file_type, blob_url, category = (
+                    existing.file_id, existing.file_type, existing.file_url, existing.file_category
+                )
+                logging.info(f"Reprocessing file_id={file_id} (force={force})")
+                print(f"Reprocessing file_id={file_id} (force={force})")
+            else:
+                # Determine file type based on extension
+                file_extension = os.path.splitext(uploaded_file.filename)[1].lower()
+                file_type_mapping = {
+                    '.pdf': 'pdf',
+                    '.jpg': 'image',
+                    '.jpeg': 'image',
+                    '.png': 'image',
+                    '.mp4': 'video',
+                    '.mov': 'video',
+                    '.mp3': 'audio'
+                }
+                file_type = file_type_mapping.get(file_extension, 'unknown')
+                logging.info(f"Determined file type '{file_type}' for extension '{file_extension}'")
+                print(f"Determined file type '{file_type}' for extension '{file_extension}'")
+
+                category = 'Unclassified'
+
+                # 3a) Upload file to Azure
+                blob_name = f"{user_uuid}/{category}/{uploaded_file.filename}"
+                blob_url = upload_file_to_azure(temp_file_path, blob_name)
+                logging.info(f"Uploaded file to Azure Blob Storage: {blob_url}")
+                print(f"Uploaded file to Azure Blob Storage: {blob_url}")
+
+                # 3b) Create DB record
+                file_record = File(
+                    user_id=user.user_id,
+                    file_name=uploaded_file.filename,
+                    file_type=file_type,
+                    file_url=blob_url,
+                    file_date=datetime.now().date(),
+                    uploaded_at=datetime.utcnow(),
+                    file_size=os.path.getsize(temp_file_path),
+                    file_category=category,
+                    status="Uploading",
+                    content_hash=content_hash,
+                )
+                g.session.add(file_record)
+                try:
+                    g.session.flush()  # get file_record.file_id
+                except IntegrityError:
+                    # A concurrent request (e.g. a double-click) created the same file first
+                    g.session.rollback()
+                    existing = find_file_by_hash(g.session, user.user_id, content_hash)
+                    if existing is None:
+                        raise  # not the content_hash constraint
+                    logging.info(f"Concurrent duplicate upload of file_id={existing.file_id}")
+                    uploaded_urls.append(duplicate_response(existing))
+                    first_entries[content_hash] = uploaded_urls[-1]
+                    try:
+                        os.remove(temp_file_path)
+                    except OSError:
+                        pass
+                    continue
+                file_id = file_record.file_id
+                g.session.commit()
+
+                logging.info(f"Inserted new file record with file_id={file_id}")
+                print(f"Inserted new file record with file_id={file_id}")
 
             # 3c) Kick off Celery chain (extraction -> process_pages -> finalize)
-            extraction = extraction_task.s(user.user_id, blob_url, file_type, file_id)
+            # Large files go to the bulk lanes (celery_app.pipeline_queues)
+            queues = pipeline_queues(os.path.getsize(temp_file_path))
+            extraction = extraction_task.s(user.user_id, blob_url, file_type, file_id).set(queue=queues['extraction'])
             processing = process_pages_task.s(
                 user_id=user.user_id,
                 user_uuid=user_uuid,
@@ -184,23 +270,32 @@ def upload():
                     'service_periods': service_periods,
                     'file_id': file_id
                 }
-            )
-            finalization = finalize_task.s(user.user_id, file_id)
+            ).set(queue=queues['processing'])
+            finalization = finalize_task.s(user.user_id, file_id).set(queue=queues['finalize'])
 
-            chain_result = (extraction | processing | finalization)()
+            # A stage that fails for good marks the file Failed and cleans up its blobs
+            pipeline = extraction | processing | finalization
+            pipeline.on_error(pipeline_failed_task.s(user.user_id, file_id))
+            chain_result = pipeline()
             task_ids = {
                 'extraction_task_id': extraction.freeze().id,
                 'processing_task_id': processing.freeze().id,
                 'finalization_task_id': finalization.freeze().id,
                 'chain_task_id': chain_result.id
             }
+            # Kept so a duplicate upload of this file can return the same task ids
+            file_record.task_ids = task_ids
+            g.session.commit()
 
             uploaded_urls.append({
                 'category': category,
                 "fileName": uploaded_file.filename,
                 "blobUrl": blob_url,
-                "task_ids": task_ids
+                "file_id": file_id,
+                "task_ids": task_ids,
+                "duplicate": False,
             })
+            first_entries[content_hash] = uploaded_urls[-1]
 
             # 3d) Clean up local temp file
             try:
@@ -210,6 +305,12 @@ def upload():
                 logging.warning(f"Failed to remove temporary file {temp_file_path}: {e}")
                 print(f"Failed to remove temporary file {temp_file_path}: {e}")
 
+        # Later copies of a file in this request point at the first copy's file
+        for content_hash, copies in later_copies.items():
+            entry = first_entries.get(content_hash)
+            if entry is not None:
+                uploaded_urls.extend(dict(entry, duplicate=True) for _ in range(copies))
+
         process_end_time = time.time()
         elapsed_time = process_end_time - process_start_time
         logging.info(f"Total time to queue Celery tasks: {elapsed_time:.2f} seconds.")
@@ -290,9 +391,8 @@ def delete_document(file_id):
         g.session.delete(file_record)
         g.session.commit()
 
-        # 7) Re-check user’s nexus tags
-        revoke_nexus_tags_if_invalid(g.session, user.user_id)
-        g.session.commit()
+        # 7) Re-check user’s nexus tags (only the tags whose counters the delete changed)
+        recompute_nexus_tags(user.user_id)
 
         return jsonify({"message": "File deleted successfully"}), 200
 
@@ -0,0 +1,58 @@
+# routes/progress_routes.py
+
+from flask import Blueprint, Response, request, jsonify, g, stream_with_context
+from models.sql_models import Users
+from helpers.cors_helpers import cors_preflight
+from helpers.sse_helpers import format_sse
+from helpers.progress_events import (
+    get_progress_redis, latest_progress, acquire_stream, release_stream, ProgressSubscription
+)
+
+progress_bp = Blueprint('progress_bp', __name__)
+
+@progress_bp.route('/documents/progress', methods=['GET', 'OPTIONS'])
+@cors_preflight
+def document_progress():
+    """
+    GET /documents/progress?userUUID=<uuid>
+
+    Server-sent event stream of the user's file processing progress
+    (helpers/progress_events.py), replacing polling of GET /documents:
+        event: snapshot  data: [<latest event of each file>]   (once, on connect)
+        event: progress  data: <event>                         (as the workers publish them)
+    A comment line is sent periodically as a keep-alive. The user is looked up
+    once on connect; events themselves cost no database reads.
+    Returns 503 when no progress Redis is configured and 429 when the
+    process's or the user's stream cap is reached.
+    """
+    user_uuid = request.args.get('userUUID')
+    if not user_uuid:
+        return jsonify({"error": "User UUID is required"}), 400
+    if get_progress_redis() is None:
+        return jsonify({"error": "Progress events are not configured"}), 503
+
+    user = g.session.query(Users).filter_by(user_uuid=user_uuid).first()
+    if not user:
+        return jsonify({"error": "Invalid user UUID"}), 404
+    user_id = user.user_id
+    # Release the DB connection now rather than holding it for the life of the stream
+    g.session.commit()
+
+    # Each stream holds a worker thread and a Redis connection until the client disconnects
+    if not acquire_stream(user_id):
+        return jsonify({"error": "Too many open progress streams"}), 429, {"Retry-After": "30"}
+
+    def generate():
+        subscription = ProgressSubscription(user_id)  # subscribe before reading the snapshot so no event is missed
+        try:
+            yield format_sse(latest_progress(user_id), event="snapshot")
+            for event in subscription:
+                yield format_sse(event, event="progress") if event is not None else ": keep-alive\n\n"
+        finally:
+            subscription.close()
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.call_on_close(lambda: release_stream(user_id))  # also runs if the stream never started
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # disable proxy buffering (nginx / ingress)
+    return response
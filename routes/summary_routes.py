@@ -7,19 +7,26 @@ from helpers.azure_helpers import (
     generate_sas_url,
     extract_blob_name
 )
-from helpers.llm_helpers import generate_claim_response, generate_cheat_sheet_response
-from models.sql_models import Users, Conditions, Tag, condition_tags, File
+from helpers.llm_helpers import (
+    generate_claim_response,
+    generate_cheat_sheet_response,
+    stream_claim_response,
+    stream_cheat_sheet_response
+)
+from helpers.sse_helpers import wants_event_stream, sse_response
+from models.sql_models import Users, Conditions, Tag, condition_tags, File, NexusTags
+from helpers.nexus_summary_cache import cached_summary, get_or_create_summary, store_summary, nexus_conditions
 import fitz  # PyMuPDF
 from io import BytesIO
 from datetime import datetime
 import os
 from helpers.decision_helper import summarize_decision
-from openai import OpenAI
+from helpers.openai_client import get_openai_client
 
 logger = logging.getLogger(__name__)
 
 # Set up the OpenAI API key to interact with the GPT models
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+client = get_openai_client()
 if not client:
     raise ValueError("Please set the VA_AUTOMATION_API_KEY environment variable.")
 
@@ -320,7 +327,11 @@ def generate_cheat_sheet():
             }
             results.setdefault(disability_name, []).append(condition_data)
 
-        cheat_sheet = generate_cheat_sheet_response(str(results))
+        # Stream tokens over SSE when the client asks for it (?stream=1 or Accept: text/event-stream)
+        if wants_event_stream():
+            return sse_response(stream_cheat_sheet_response(user.user_id, str(results)))
+
+        cheat_sheet = generate_cheat_sheet_response(user.user_id, str(results))
         print(cheat_sheet)
 
         # The global teardown_request will handle commit/rollback
@@ -351,7 +362,6 @@ def generate_nexus_summary():
         data = request.json
         user_uuid = data.get('userUUID')
         nexus_tags_id = data.get('nexus_tags_id')
-        conditions_data = data.get('conditions', []) 
 
         if not user_uuid or not nexus_tags_id:
             return jsonify({"error": "userUUID and nexus_tags_id are required"}), 400
@@ -363,30 +373,54 @@ def generate_nexus_summary():
         if not user:
             return jsonify({"error": "User not found"}), 404
 
-        # Optional: Confirm these conditions belong to this user
+        nexus_tag = (session.query(NexusTags)
+                            .filter_by(nexus_tags_id=nexus_tags_id, user_id=user.user_id)
+                            .first())
+        if not nexus_tag:
+            return jsonify({"error": "Nexus tag not found"}), 404
+
+        # The prompt and the cache key come from the tag's conditions in the
+        # database; conditions sent by the client are ignored
+        conditions_data = nexus_conditions(session, nexus_tag)
+        if not conditions_data:
+            return jsonify({"error": "No conditions linked to this nexus tag"}), 404
         condition_ids = [c["condition_id"] for c in conditions_data]
-        db_conditions = (session.query(Conditions)
-                                 .filter(Conditions.user_id == user.user_id,
-                                         Conditions.condition_id.in_(condition_ids))
-                                 .all())
-        # You can compare lengths or data if you want to ensure all exist for the user
+
+        # Served from nexus_summaries while the condition set is unchanged; edits
+        # to the conditions' content flag the row needs_update
+        # (helpers/nexus_summary_cache.py)
+        summary_text = cached_summary(session, nexus_tags_id, condition_ids)
+        if summary_text is not None:
+            logger.info("Serving cached nexus summary for nexus_tags_id=%s", nexus_tags_id)
+            if wants_event_stream():
+                return sse_response([summary_text], done_payload={"nexus_tags_id": nexus_tags_id, "cached": True})
+            return jsonify({"summary": summary_text, "cached": True}), 200
+
+        user_id = user.user_id
+        seen_version = get_or_create_summary(session, nexus_tags_id).version
+        session.commit()
+
+        # Stream tokens over SSE when the client asks for it (?stream=1 or Accept: text/event-stream)
+        if wants_event_stream():
+            def stream_and_store():
+                parts = []
+                for text in stream_claim_response(user_id, str(conditions_data)):
+                    parts.append(text)
+                    yield text
+                # Only reached when the stream completed (not on client disconnect)
+                store_summary(session, nexus_tags_id, condition_ids, "".join(parts), seen_version)
+
+            return sse_response(
+                stream_and_store(),
+                done_payload={"nexus_tags_id": nexus_tags_id, "cached": False}
+            )
 
         # Generate summary text with your LLM helper
-        claim_summary = generate_claim_response(str(conditions_data))
-
-        # [Optional] Insert a row into your new "NexusSummary" table
-        # e.g.:
-        # new_summary = NexusSummary(
-        #     nexus_tags_id=nexus_tags_id,
-        #     summary_text=claim_summary,
-        #     condition_ids=condition_ids,
-        #     needs_update=False
-        # )
-        # session.add(new_summary)
-        # session.flush()
+        claim_summary = generate_claim_response(user_id, str(conditions_data))
+        store_summary(session, nexus_tags_id, condition_ids, claim_summary, seen_version)
 
         # Return the summary or do more PDF logic if desired
-        return jsonify({"summary": claim_summary}), 200
+        return jsonify({"summary": claim_summary, "cached": False}), 200
 
     except Exception as e:
         print("Error in generating nexus summary:", e)